@@ -0,0 +1,90 @@
+"""
+Throughput of the embedding backends (PyTorch fp32, ONNX Runtime fp32 and int8)
+on the CPU across batch sizes and thread counts, plus a parity check: the cosine
+similarity of every backend's embeddings to the PyTorch fp32 ones.
+
+Embeds the FAISS chunk texts when they exist, otherwise synthetic sentences.
+
+Usage:
+    python -m benchmarks.embedding_backend --batch-sizes 1 8 32 --threads 1 4
+"""
+
+import os
+import random
+import time
+
+import numpy as np
+
+from src import config
+from src.index.embedding_backend import (
+    BACKENDS,
+    MIN_COSINE,
+    cosine_parity,
+    load_sentence_transformer,
+)
+from src.index.index_faiss import TEXTS_FILE_PATH, load_texts
+
+
+def load_sample(num_texts: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    if TEXTS_FILE_PATH.exists():
+        texts = load_texts(TEXTS_FILE_PATH)
+        return rng.sample(texts, min(num_texts, len(texts)))
+    words = "invasive ductal carcinoma margin lymph node grade stage tumor size biopsy".split()
+    return [" ".join(rng.choices(words, k=rng.randint(10, 120))) for _ in range(num_texts)]
+
+
+def texts_per_second(model, texts: list[str], batch_size: int, repeats: int) -> float:
+    model.encode(texts[:batch_size], batch_size=batch_size)  # Warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    return repeats * len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=sorted({1, 4, os.cpu_count() or 1})
+    )
+    parser.add_argument("--num-texts", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = load_sample(args.num_texts, args.seed)
+    reference = load_sentence_transformer(config.EMBEDDING_MODEL_NAME, "cpu", "torch").encode(
+        texts, convert_to_numpy=True
+    )
+    print(f"{len(texts)} texts, model {config.EMBEDDING_MODEL_NAME}")
+
+    failed = []
+    print(f"{'backend':<10} {'threads':>7} {'batch':>6} {'texts/s':>9}")
+    for backend in args.backends:
+        for threads in args.threads:
+            model = load_sentence_transformer(
+                config.EMBEDDING_MODEL_NAME, "cpu", backend, num_threads=threads
+            )
+            if threads == args.threads[0]:
+                parity = cosine_parity(reference, model.encode(texts, convert_to_numpy=True))
+                print(
+                    f"{backend}: cosine to torch fp32 mean {parity.mean():.5f}, "
+                    f"min {parity.min():.5f}"
+                )
+                if parity.min() < MIN_COSINE:
+                    failed.append(backend)
+            for batch_size in args.batch_sizes:
+                rate = texts_per_second(model, texts, batch_size, args.repeats)
+                print(f"{backend:<10} {threads:>7} {batch_size:>6} {rate:>9.1f}")
+
+    if failed:
+        print(f"Parity below {MIN_COSINE} for: {', '.join(failed)}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
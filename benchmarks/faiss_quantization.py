@@ -0,0 +1,110 @@
+"""
+Memory footprint, query latency and recall@10 of quantized FAISS codes (float16,
+int8 scalar quantization, binary sign bits), with and without rescoring against
+the full-precision vectors, measured against exact float32 search.
+
+Uses the vectors saved by `src.index.index_faiss`, or synthetic clustered vectors.
+
+Usage:
+    python -m benchmarks.faiss_quantization
+    python -m benchmarks.faiss_quantization --synthetic 100000 --rescore-factors 4 10
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from src.index.index_faiss import (
+    QUANTIZED_FACTORIES,
+    VECTORS_FILE_PATH,
+    index_faiss,
+    load_index,
+    load_vectors,
+    save_vectors,
+    search,
+)
+
+
+def make_vectors(num_synthetic: int | None, ndims: int, seed: int) -> np.ndarray:
+    if num_synthetic:
+        # Clustered data is closer to real embeddings than uniform noise
+        rng = np.random.default_rng(seed)
+        centers = rng.normal(size=(max(1, num_synthetic // 100), ndims))
+        assignments = rng.integers(len(centers), size=num_synthetic)
+        vectors = centers[assignments] + 0.3 * rng.normal(size=(num_synthetic, ndims))
+        return vectors.astype(np.float32)
+    return np.asarray(load_vectors(VECTORS_FILE_PATH), dtype=np.float32)
+
+
+def recall(ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    hits = sum(len(set(row) & set(exact_row)) for row, exact_row in zip(ids, exact_ids))
+    return hits / exact_ids.size
+
+
+def measure(index, queries: np.ndarray, k: int, vectors: np.ndarray | None, factor: int):
+    latencies = []
+    all_ids = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = search(index, query[None], k, vectors, factor)
+        latencies.append(time.perf_counter() - start)
+        all_ids.append(ids[0])
+    return np.array(latencies) * 1000, np.array(all_ids)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--synthetic", type=int, default=None, help="Use N synthetic vectors")
+    parser.add_argument("--ndims", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[4])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.synthetic, args.ndims, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    # Queries near stored vectors, like a report sentence close to a guideline chunk
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = (queries + 0.1 * queries.std() * rng.normal(size=queries.shape)).astype(np.float32)
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dimensions, {len(queries)} queries")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        vectors_path = tmp_dir / "vectors.npy"
+        save_vectors(vectors, vectors_path)
+        full_vectors = load_vectors(vectors_path)
+
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(vectors)  # type: ignore
+        _, exact_ids = exact.search(queries, args.k)  # type: ignore
+
+        print(
+            f"{'codes':<8} {'rescore':>7} {'index MB':>9} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'recall@' + str(args.k):>10}"
+        )
+        for name, factory in {"fp32": "Flat", **QUANTIZED_FACTORIES}.items():
+            index_path = tmp_dir / name
+            index_faiss(vectors, index_path, factory)
+            index = load_index(index_path)
+            size_mb = index_path.stat().st_size / 1024**2
+            configs = [(None, 1)] + [(full_vectors, factor) for factor in args.rescore_factors]
+            if name == "fp32":
+                configs = configs[:1]
+            for rescore_vectors, factor in configs:
+                latencies, ids = measure(index, queries, args.k, rescore_vectors, factor)
+                label = f"x{factor}" if rescore_vectors is not None else "-"
+                print(
+                    f"{name:<8} {label:>7} {size_mb:>9.1f} {np.percentile(latencies, 50):>8.3f} "
+                    f"{np.percentile(latencies, 99):>8.3f} {recall(ids, exact_ids):>10.3f}"
+                )
+        print(f"Full-precision vectors on disk: {vectors_path.stat().st_size / 1024**2:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
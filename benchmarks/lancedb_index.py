@@ -0,0 +1,152 @@
+"""
+Size on disk, recall@k and query latency of ANN indexes on the docs vectors,
+measured against exact (brute-force) search. The vectors are copied into a scratch
+database, so the real table and its index are left untouched.
+
+IVF_HNSW_SQ stores int8 codes and IVF_PQ compressed sub-vector codes; with
+--refine-factors above 0 the candidates are rescored against the full-precision
+vectors in the table.
+
+Usage:
+    python -m benchmarks.lancedb_index --index-type IVF_PQ
+    python -m benchmarks.lancedb_index --synthetic 100000 --index-type IVF_FLAT IVF_HNSW_SQ IVF_PQ
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+import lancedb
+from lancedb.table import Table
+from src.index.index_lancedb import DB_URI, INDEX_TYPES, METRIC, TABLE_NAME, create_vector_index
+
+
+def load_vectors(num_synthetic: int | None, ndims: int, seed: int) -> np.ndarray:
+    if num_synthetic:
+        # Clustered data is closer to real embeddings than uniform noise
+        rng = np.random.default_rng(seed)
+        centers = rng.normal(size=(max(1, num_synthetic // 100), ndims))
+        assignments = rng.integers(len(centers), size=num_synthetic)
+        vectors = centers[assignments] + 0.3 * rng.normal(size=(num_synthetic, ndims))
+        return vectors.astype(np.float32)
+    table = lancedb.connect(DB_URI).open_table(TABLE_NAME)
+    column = table.to_arrow()["vector"].combine_chunks()
+    return column.flatten().to_numpy().reshape(len(column), -1).astype(np.float32)
+
+
+def search_ids(
+    table: Table,
+    queries: np.ndarray,
+    k: int,
+    metric: str,
+    exact: bool = False,
+    nprobes: int | None = None,
+    refine_factor: int | None = None,
+) -> tuple[list[set[int]], np.ndarray]:
+    results = []
+    latencies = []
+    for query_vector in queries:
+        query = table.search(query_vector).distance_type(metric).limit(k).select(["id", "_distance"])  # type: ignore
+        if exact:
+            query = query.bypass_vector_index()
+        if nprobes:
+            query = query.nprobes(nprobes)
+        if refine_factor:
+            query = query.refine_factor(refine_factor)
+        start = time.perf_counter()
+        rows = query.to_arrow()
+        latencies.append(time.perf_counter() - start)
+        results.append(set(rows["id"].to_pylist()))
+    return results, np.array(latencies)
+
+
+def index_size_mb(db_dir: str, table_name: str) -> float:
+    files = (Path(db_dir) / f"{table_name}.lance" / "_indices").rglob("*")
+    return sum(path.stat().st_size for path in files if path.is_file()) / 1024**2
+
+
+def recall_at_k(approx: list[set[int]], exact: list[set[int]]) -> float:
+    return float(np.mean([len(a & e) / len(e) for a, e in zip(approx, exact) if e]))
+
+
+def report(name: str, latencies: np.ndarray, recall: float | None = None):
+    recall_text = f"recall@k={recall:.3f}  " if recall is not None else ""
+    print(
+        f"{name:<28} {recall_text}p50={np.percentile(latencies, 50) * 1e3:7.2f}ms  "
+        f"p99={np.percentile(latencies, 99) * 1e3:7.2f}ms"
+    )
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-type", choices=INDEX_TYPES, nargs="+", default=["IVF_PQ"])
+    parser.add_argument("--metric", default=METRIC)
+    parser.add_argument("--num-partitions", type=int, default=None)
+    parser.add_argument("--num-sub-vectors", type=int, default=None)
+    parser.add_argument("--synthetic", type=int, default=None, help="Use N random vectors instead of the docs table")
+    parser.add_argument("--ndims", type=int, default=768, help="Dimensions of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[1, 5, 10, 20, 50])
+    parser.add_argument("--refine-factors", type=int, nargs="+", default=[0, 5])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.synthetic, args.ndims, args.seed)
+    print(
+        f"{len(vectors)} vectors of {vectors.shape[1]} dimensions, "
+        f"{vectors.nbytes / 1024**2:.1f} MB as float32"
+    )
+    rng = np.random.default_rng(args.seed)
+    # Queries are perturbed corpus vectors, so each one has real near neighbours
+    queries = vectors[rng.integers(len(vectors), size=args.queries)]
+    queries = queries + 0.1 * queries.std() * rng.normal(size=queries.shape).astype(np.float32)
+    data = pa.table(
+        {
+            "id": pa.array(np.arange(len(vectors))),
+            "vector": pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), vectors.shape[1]),
+        }
+    )
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        db = lancedb.connect(db_dir)
+        exact_table = db.create_table("exact", data)
+        exact, latencies = search_ids(exact_table, queries, args.k, args.metric, exact=True)
+        report("exact", latencies)
+
+        for index_type in args.index_type:
+            # A table per index type, so replaced index files do not count towards the size
+            table = db.create_table(index_type.lower(), data)
+            start = time.perf_counter()
+            create_vector_index(
+                table, index_type, args.metric, args.num_partitions, args.num_sub_vectors
+            )
+            print(
+                f"{index_type} built in {time.perf_counter() - start:.1f}s, "
+                f"{index_size_mb(db_dir, index_type.lower()):.1f} MB on disk"
+            )
+
+            for nprobes in args.nprobes:
+                for refine_factor in args.refine_factors:
+                    approx, latencies = search_ids(
+                        table,
+                        queries,
+                        args.k,
+                        args.metric,
+                        nprobes=nprobes,
+                        refine_factor=refine_factor,
+                    )
+                    report(
+                        f"nprobes={nprobes} refine={refine_factor}",
+                        latencies,
+                        recall_at_k(approx, exact),
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Latency and cost of the RAG prompt layouts, with the prompts RAGChat sends, against
+a local OpenAI-compatible stub that models provider prefix caching: prompts are
+tokenized with the model's tiktoken encoding, a prefix of at least 1024 tokens that
+an earlier request already sent is cached in 128-token steps, and cached tokens are
+processed faster and billed at a discount.
+
+Usage:
+    python -m benchmarks.prompt_layout --requests 50
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+from src.chat.context import get_token_counter
+from src.chat.llm import MAX_TOKENS, TEMPERATURE, TokenUsage
+from src.chat.prompts import MIN_CACHED_PREFIX_TOKENS, PROMPT_LAYOUTS, build_rag_messages
+
+CACHE_STEP = 128
+
+
+class PrefixCachingStub(ThreadingHTTPServer):
+    def __init__(self, seconds_per_token: float, cached_speedup: float):
+        super().__init__(("127.0.0.1", 0), PrefixCachingHandler)
+        self.seconds_per_token = seconds_per_token
+        self.cached_speedup = cached_speedup
+        self.prefixes: set[str] = set()
+        self.lock = threading.Lock()
+
+    def cached_tokens(self, tokens: list[int]) -> int:
+        boundaries = range(MIN_CACHED_PREFIX_TOKENS, len(tokens) + 1, CACHE_STEP)
+        digests = [hashlib.sha256(str(tokens[:end]).encode()).hexdigest() for end in boundaries]
+        with self.lock:
+            cached = max(
+                (end for end, digest in zip(boundaries, digests) if digest in self.prefixes),
+                default=0,
+            )
+            self.prefixes.update(digests)
+        return cached
+
+
+class PrefixCachingHandler(BaseHTTPRequestHandler):
+    server: PrefixCachingStub
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        tokens = encode(
+            body["model"],
+            "".join(f"{message['role']}: {message['content']}" for message in body["messages"]),
+        )
+        cached = self.server.cached_tokens(tokens)
+        uncached = len(tokens) - cached
+        time.sleep(
+            self.server.seconds_per_token * (uncached + cached / self.server.cached_speedup)
+        )
+        data = json.dumps(
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Summary."},
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(tokens),
+                    "completion_tokens": 2,
+                    "total_tokens": len(tokens) + 2,
+                    "prompt_tokens_details": {"cached_tokens": cached},
+                },
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def encode(model: str, text: str) -> list[int]:
+    import tiktoken
+
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return encoding.encode(text, disallowed_special=())
+
+
+def random_text(rng: random.Random, num_words: int) -> str:
+    vocabulary = ["carcinoma", "margin", "lymph", "node", "grade", "stage", "tumor", "invasion"]
+    return " ".join(rng.choice(vocabulary) + str(rng.randrange(100)) for _ in range(num_words))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50, help="Requests per layout")
+    parser.add_argument("--model", default="gpt-3.5-turbo", help="Model whose tokenizer to use")
+    parser.add_argument("--chunks", type=int, default=8, help="Retrieved chunks per request")
+    parser.add_argument("--chunk-tokens", type=int, default=150)
+    parser.add_argument("--report-tokens", type=int, default=600)
+    parser.add_argument("--seconds-per-token", type=float, default=2e-5)
+    parser.add_argument("--cached-speedup", type=float, default=5.0)
+    parser.add_argument("--price", type=float, default=0.5, help="USD per 1M input tokens")
+    parser.add_argument(
+        "--cached-discount", type=float, default=0.5, help="Price fraction saved on cached tokens"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = PrefixCachingStub(args.seconds_per_token, args.cached_speedup)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OpenAI(
+        api_key="benchmark", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1"
+    )
+    count_tokens = get_token_counter(args.model)
+    system_prompt = build_rag_messages("", [])[0]["content"]
+    print(f"Static system prompt: {count_tokens(system_prompt)} tokens")
+
+    print(
+        f"{'layout':<14} {'p50 ms':>8} {'mean ms':>8} {'prompt tok':>11} "
+        f"{'cached':>7} {'cost $':>9}"
+    )
+    for layout in PROMPT_LAYOUTS:
+        # Same reports and chunks for every layout; a fresh cache per layout
+        rng = random.Random(args.seed + 1)
+        with server.lock:
+            server.prefixes.clear()
+        usage = TokenUsage()
+        latencies = []
+        for _ in range(args.requests):
+            chunks = [random_text(rng, args.chunk_tokens) for _ in range(args.chunks)]
+            messages = build_rag_messages(random_text(rng, args.report_tokens), chunks, layout)
+            start = time.perf_counter()
+            completion = client.chat.completions.create(
+                model=args.model,
+                messages=messages,  # type: ignore
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+            )
+            latencies.append(time.perf_counter() - start)
+            usage.record(completion.usage)
+        latencies.sort()
+        uncached = usage.prompt_tokens - usage.cached_tokens
+        cost = (uncached + usage.cached_tokens * (1 - args.cached_discount)) * args.price / 1e6
+        print(
+            f"{layout:<14} {1000 * latencies[len(latencies) // 2]:>8.1f} "
+            f"{1000 * sum(latencies) / len(latencies):>8.1f} {usage.prompt_tokens:>11} "
+            f"{usage.cached_fraction:>7.1%} {cost:>9.5f}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Break down startup time: per-module import cost (via `python -X importtime`) for the
+entry points, plus the time for RAGChat to load its table and embedding model.
+
+Usage: python -m benchmarks.startup_time [--top 15] [--warmup]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from src import config
+
+ENTRY_MODULES = ["src.chat.rag_chat", "src.chat.base_chat", "src.index.index_lancedb", "run"]
+
+
+def import_times(module: str) -> tuple[float, list[tuple[int, int, str]]]:
+    """
+    Import `module` in a fresh interpreter and return the wall time in seconds along
+    with `(self_us, cumulative_us, name)` for every module it imported.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=config.ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    return elapsed, rows
+
+
+def time_warmup() -> tuple[float, float]:
+    from src.chat.rag_chat import RAGChat
+
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    start = time.perf_counter()
+    chat = RAGChat()
+    constructed = time.perf_counter() - start
+    chat.retriever.warmup()
+    return constructed, time.perf_counter() - start
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list per module")
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="Also time loading the LanceDB table and embedding model",
+    )
+    args = parser.parse_args()
+
+    for module in ENTRY_MODULES:
+        try:
+            elapsed, rows = import_times(module)
+        except RuntimeError as e:
+            print(e)
+            continue
+        print(f"\nimport {module}: {elapsed:.2f}s wall, {len(rows)} modules")
+        # Sum self time per top-level package to see which dependencies cost the most
+        per_package: dict[str, int] = {}
+        for self_us, _, name in rows:
+            package = name.split(".")[0]
+            per_package[package] = per_package.get(package, 0) + self_us
+        for package, self_us in sorted(per_package.items(), key=lambda item: -item[1])[: args.top]:
+            print(f"  {self_us / 1e6:8.3f}s  {package}")
+        print(f"  {sum(per_package.values()) / 1e6:8.3f}s  total")
+
+    if args.warmup:
+        constructed, loaded = time_warmup()
+        print(f"\nRAGChat(): {constructed:.3f}s, table and embedding model ready after {loaded:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,291 @@
+import asyncio
+import json
+import os
 import time
+from pathlib import Path
+from typing import Any, Callable
 
-from deepeval import evaluate
-from deepeval.metrics import AnswerRelevancyMetric, ContextualRelevancyMetric
-from deepeval.test_case import LLMTestCase
 from loguru import logger
 
 from src import config
 from src.chat.base_chat import BaseChat
+from src.chat.llm import AsyncRateLimiter
 from src.chat.rag_chat import RAGChat
+from src.chat.reranker import CrossEncoderReranker
+from src.chat.response_cache import ResponseCache
+from src.chat.retrieval_cache import CACHE_DIR, RetrievalCache
 
+REPORTS_DIR = config.PROCESSED_DIR / "TCGA_Reports_txt"
+CHECKPOINT_PATH = config.REPORT_DIR / "eval_checkpoint.jsonl"
+CONCURRENCY = 8  # Reports evaluated at once
+EVAL_MODEL = "gpt-4o"
+THRESHOLD = 0.7
+CHATS = ("rag", "base")
 
-def main(limit: int = 10):
-    if not (config.PROCESSED_DIR / "TCGA_Reports_txt").exists():
-        logger.error("TCGA_Reports_txt directory does not exist. Run ocr_pymupdf.py first.")
-        return
-    model_name = "gpt-4o"
-    answer_relevancy_metric = AnswerRelevancyMetric(
-        threshold=0.7,
-        model=model_name,
-        include_reason=False
-    )
-    contextual_relevancy_metric = ContextualRelevancyMetric(
-        threshold=0.7,
-        model=model_name,
-        include_reason=False
-    )
 
-    rag_test_cases = []
-    base_test_cases = []
+def is_complete(record: dict) -> bool:
+    # A RAG answer without context means retrieval failed
+    retrieved = record["chat"] != "rag" or bool(record.get("retrieval_context"))
+    return retrieved and not any(metric.get("error") for metric in record["metrics_data"])
 
-    count = 0
 
-    rag_chat = RAGChat()
-    base_chat = BaseChat()
+def load_checkpoint(checkpoint_path: Path) -> dict[tuple[str, str], dict]:
+    """
+    Read finished results keyed by (report, chat). A line cut short by a crash,
+    or a record with a failed retrieval or metric, is ignored, so that test case
+    is simply evaluated again.
+    """
+    records = {}
+    if not checkpoint_path.exists():
+        return records
+    with open(checkpoint_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping a truncated line in {checkpoint_path}")
+                continue
+            if is_complete(record):
+                records[(record["report"], record["chat"])] = record
+    return records
 
-    start_time = time.time()
-    for report_path in (config.PROCESSED_DIR / "TCGA_Reports_txt").iterdir():
-        report_name = report_path.stem
-        logger.info(f"({count + 1}/{limit}) Processing {report_name}")
-        report_text = report_path.read_text()
-
-        rag_answer, rag_context = rag_chat.generate(report_text)
-        base_answer = base_chat.generate(report_text)
-        
-        rag_test_cases.append(
-            LLMTestCase(
-                input=report_text,
-                actual_output=rag_answer,
-                retrieval_context=rag_context,
-            )
+
+class CheckpointWriter:
+    """
+    Append-only JSONL writer that flushes and fsyncs every record, so a finished
+    test case survives a crash of the run.
+    """
+
+    def __init__(self, checkpoint_path: Path):
+        checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(checkpoint_path, "a+b")
+        # Terminate a line cut short by a crash so the next record starts cleanly
+        if self._file.tell() > 0:
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != b"\n":
+                self._file.write(b"\n")
+
+    def write(self, record: dict):
+        self._file.write((json.dumps(record) + "\n").encode("utf-8"))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def make_metrics(chat: str, eval_model: str = EVAL_MODEL) -> list:
+    # Metrics keep per-measurement state, so every test case gets its own instances
+    from deepeval.metrics import AnswerRelevancyMetric, ContextualRelevancyMetric
+
+    metrics: list = [
+        AnswerRelevancyMetric(threshold=THRESHOLD, model=eval_model, include_reason=False)
+    ]
+    if chat == "rag":
+        metrics.append(
+            ContextualRelevancyMetric(threshold=THRESHOLD, model=eval_model, include_reason=False)
         )
+    return metrics
 
-        base_test_cases.append(
-            LLMTestCase(
-                input=report_text,
-                actual_output=base_answer,
-            )
+
+async def measure(test_case: Any, metrics: list) -> list[dict]:
+    async def measure_one(metric) -> dict:
+        error = None
+        try:
+            await metric.a_measure(test_case)
+        except Exception as e:
+            error = str(e)
+        return {
+            "name": metric.__name__,
+            "threshold": metric.threshold,
+            "success": error is None and bool(metric.success),
+            "score": metric.score,
+            "reason": metric.reason,
+            "evaluation_model": getattr(metric, "evaluation_model", None),
+            "error": error,
+            "evaluation_cost": getattr(metric, "evaluation_cost", None),
+        }
+
+    return list(await asyncio.gather(*(measure_one(metric) for metric in metrics)))
+
+
+async def run_evaluation(
+    report_paths: list[Path],
+    rag_chat: RAGChat,
+    base_chat: BaseChat,
+    checkpoint_path: Path = CHECKPOINT_PATH,
+    concurrency: int = CONCURRENCY,
+    metrics_factory: Callable[[str], list] = make_metrics,
+) -> int:
+    """
+    Generate and score RAG and base answers for every report, `concurrency` reports
+    at a time. Each finished test case is appended to the checkpoint with its
+    metric results; (report, chat) pairs already there are skipped, so an
+    interrupted run resumes where it stopped. Returns the number of new records.
+    """
+    from deepeval.test_case import LLMTestCase
+
+    done = load_checkpoint(checkpoint_path)
+    pending = [
+        (path, chat)
+        for path in report_paths
+        for chat in CHATS
+        if (path.stem, chat) not in done
+    ]
+    logger.info(f"{len(done)} test cases checkpointed, {len(pending)} to go")
+    queue: asyncio.Queue[Path] = asyncio.Queue()
+    for path in dict.fromkeys(path for path, _ in pending):
+        queue.put_nowait(path)
+    pending_chats = {(path.stem, chat) for path, chat in pending}
+    writer = CheckpointWriter(checkpoint_path)
+    # Both chats share the LLM concurrency limit
+    llm_semaphore = asyncio.Semaphore(concurrency)
+    written = 0
+
+    async def evaluate_chat(report_name: str, report_text: str, chat: str):
+        nonlocal written
+        context = None
+        if chat == "rag":
+            answer, context = await rag_chat.agenerate(report_text, semaphore=llm_semaphore)
+            if not context:
+                raise RuntimeError(f"Retrieval failed: {answer}")
+        else:
+            answer = await base_chat.agenerate(report_text, semaphore=llm_semaphore)
+        test_case = LLMTestCase(
+            input=report_text, actual_output=answer, retrieval_context=context
+        )
+        metrics_data = await measure(test_case, metrics_factory(chat))
+        errors = [f"{m['name']}: {m['error']}" for m in metrics_data if m["error"]]
+        if errors:
+            # A judge rate limit or timeout is transient, so leave the case for a rerun
+            raise RuntimeError(f"Metrics failed: {'; '.join(errors)}")
+        writer.write(
+            {
+                "report": report_name,
+                "chat": chat,
+                "input": report_text,
+                "actual_output": answer,
+                "retrieval_context": context,
+                "success": all(metric["success"] for metric in metrics_data),
+                "metrics_data": metrics_data,
+            }
         )
+        written += 1
 
-        count += 1
-        if count == limit:
-            break
-    end_time = time.time()
-    
-    rag_results = evaluate(
-        test_cases=rag_test_cases,
-        metrics=[answer_relevancy_metric, contextual_relevancy_metric],
+    async def worker():
+        while not queue.empty():
+            path = queue.get_nowait()
+            report_text = path.read_text()
+            chats = [chat for chat in CHATS if (path.stem, chat) in pending_chats]
+            results = await asyncio.gather(
+                *(evaluate_chat(path.stem, report_text, chat) for chat in chats),
+                return_exceptions=True,
+            )
+            for chat, result in zip(chats, results):
+                if isinstance(result, Exception):
+                    # Left out of the checkpoint, so the next run retries it
+                    logger.opt(exception=result).error(
+                        f"Failed to evaluate {chat} on {path.stem}"
+                    )
+            logger.info(f"Evaluated {path.stem} ({written}/{len(pending)} test cases)")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        writer.close()
+    return written
+
+
+def write_results(checkpoint_path: Path = CHECKPOINT_PATH, report_dir: Path = config.REPORT_DIR):
+    """
+    Write `rag_results.json` and `base_results.json` from the checkpoint, in the
+    `test_results`/`metrics_data` layout that `notebooks/analyze.py` reads.
+    """
+    records = sorted(load_checkpoint(checkpoint_path).values(), key=lambda r: r["report"])
+    report_dir.mkdir(parents=True, exist_ok=True)
+    for chat in CHATS:
+        test_results = [
+            {
+                "name": record["report"],
+                "success": record["success"],
+                "metrics_data": record["metrics_data"],
+            }
+            for record in records
+            if record["chat"] == chat
+        ]
+        with open(report_dir / f"{chat}_results.json", "w") as f:
+            json.dump({"test_results": test_results}, f, indent=4)
+        logger.info(f"Saved {len(test_results)} {chat} results")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Evaluate only the first N reports"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=CONCURRENCY, help="Reports evaluated at once"
+    )
+    parser.add_argument("--checkpoint", type=Path, default=CHECKPOINT_PATH)
+    parser.add_argument(
+        "--restart", action="store_true", help="Discard the checkpoint and start over"
+    )
+    parser.add_argument("--k", type=int, default=10, help="Retrieved chunks in the RAG prompt")
+    parser.add_argument(
+        "--rerank",
+        action="store_true",
+        help="Rerank over-fetched chunks with a cross-encoder before keeping the top k; "
+        "use a separate --checkpoint to compare with plain retrieval",
     )
-    base_results = evaluate(
-        test_cases=base_test_cases,
-        metrics=[answer_relevancy_metric],
+    args = parser.parse_args()
+
+    if not REPORTS_DIR.exists():
+        logger.error("TCGA_Reports_txt directory does not exist. Run ocr_pymupdf.py first.")
+        return
+    if args.restart:
+        args.checkpoint.unlink(missing_ok=True)
+
+    # Reruns over the same reports reuse the retrieved chunks and LLM responses from disk
+    response_cache = ResponseCache()
+    # Both chats call the same API key, so they draw from one set of RPM/TPM buckets
+    rate_limiter = AsyncRateLimiter()
+    reranker = CrossEncoderReranker() if args.rerank else None
+    rag_chat = RAGChat(
+        k=args.k,
+        reranker=reranker,
+        retrieval_cache=RetrievalCache(cache_dir=CACHE_DIR),
+        response_cache=response_cache,
+        max_concurrency=args.concurrency,
+        rate_limiter=rate_limiter,
+    )
+    base_chat = BaseChat(
+        response_cache=response_cache,
+        max_concurrency=args.concurrency,
+        rate_limiter=rate_limiter,
     )
 
-    logger.info(f"Time taken: {end_time - start_time}")
+    report_paths = sorted(REPORTS_DIR.glob("*.txt"))[: args.limit]
+    start_time = time.time()
+    written = asyncio.run(
+        run_evaluation(report_paths, rag_chat, base_chat, args.checkpoint, args.concurrency)
+    )
+    logger.info(f"Evaluated {written} test cases in {time.time() - start_time:.1f}s")
+    logger.info(f"LLM response cache: {response_cache.hits} hits, {response_cache.misses} misses")
+    usage = response_cache.usage
+    logger.info(
+        f"LLM usage: {usage.prompt_tokens} prompt tokens "
+        f"({usage.cached_fraction:.1%} served from the provider prompt cache), "
+        f"{usage.completion_tokens} completion tokens"
+    )
+    if reranker is not None:
+        logger.info(
+            f"Reranked {reranker.reranked} reports, {reranker.timeouts} ran out of time"
+        )
+
+    write_results(args.checkpoint)
 
-    # save results
-    logger.info("Saving results...")
-    config.REPORT_DIR.mkdir(parents=True, exist_ok=True)
-    with open(config.REPORT_DIR / "rag_results.json", "w") as f:
-        f.write(rag_results.model_dump_json(indent=4))
-    with open(config.REPORT_DIR / "base_results.json", "w") as f:
-        f.write(base_results.model_dump_json(indent=4))
 
 if __name__ == "__main__":
-    main(10)
+    main()
@@ -1,3 +1,5 @@
+import threading
+
 import gradio as gr
 import pymupdf
 from dotenv import load_dotenv
@@ -10,6 +12,8 @@ load_dotenv()
 
 def main():
     processor = RAGChat()
+    # Load the table and embedding model in the background so the UI is served right away
+    threading.Thread(target=processor.warmup, daemon=True).start()
     current_report_text = ""
 
     def clear_current_report():
@@ -33,9 +37,13 @@ def main():
 
     def summarize_report():
         if not current_report_text:
-            return "Please enter a question first."
-        answer, _ = processor.generate(current_report_text)
-        return answer
+            yield "Please enter a question first."
+            return
+        # Show the answer as it streams in
+        answer = ""
+        for delta in processor.stream(current_report_text):
+            answer += delta
+            yield answer
 
     with gr.Blocks() as demo:
         with gr.Row():
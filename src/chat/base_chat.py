@@ -1,17 +1,57 @@
+import asyncio
 import os
+from contextlib import nullcontext
+from typing import Iterator
 
 from loguru import logger
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from .llm import (
+    MAX_CONCURRENCY,
+    MAX_TOKENS,
+    REQUESTS_PER_MINUTE,
+    TEMPERATURE,
+    TOKENS_PER_MINUTE,
+    AsyncRateLimiter,
+    gather_limited,
+    strip_stream,
+)
 from .prompt_templates import BASE_SYSTEM_TEMPLATE, USER_TEMPLATE
+from .response_cache import ResponseCache
 
 
 class BaseChat:
-    def __init__(self):
+    def __init__(
+        self,
+        response_cache: ResponseCache | None = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+        rate_limiter: AsyncRateLimiter | None = None,
+    ):
+        """
+        LLM responses go through `response_cache`, by default the shared on-disk cache
+        in read-through mode; pass `ResponseCache(mode="bypass")` to always call the API.
+        The async API runs at most `max_concurrency` completions at once, within the
+        given RPM/TPM limits. Chats calling the same API key should share one
+        `rate_limiter`, which then replaces those limits.
+        """
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OpenAI API key is not set in the environment variables.")
         self.client = OpenAI(api_key=api_key)  # Initialize OpenAI client
+        # Retries are handled by `acomplete`, with jitter and the rate limiter
+        self.async_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter or AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+
+    @staticmethod
+    def _messages(report: str) -> list[dict]:
+        return [
+            {"role": "system", "content": BASE_SYSTEM_TEMPLATE},
+            {"role": "user", "content": USER_TEMPLATE.format(report=report)},
+        ]
 
     def generate(self, report: str, model: str = "gpt-3.5-turbo") -> str:
         """
@@ -19,15 +59,62 @@ class BaseChat:
         and querying the OpenAI GPT model for an answer.
         """
         # Query the LLM
-        response = self.client.chat.completions.create(
+        response = self.response_cache.create(
+            self.client,
             model=model,
-            messages=[
-                {"role": "system", "content": BASE_SYSTEM_TEMPLATE},
-                {"role": "user", "content": USER_TEMPLATE.format(report=report)},
-            ],
-            temperature=0.7,
-            max_tokens=500,
+            messages=self._messages(report),
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
         )
         llm_response = (response.choices[0].message.content or "").strip()
 
         return llm_response
+
+    def stream(self, report: str, model: str = "gpt-3.5-turbo") -> Iterator[str]:
+        """
+        Streaming `generate`, yielding the answer in pieces as the model produces them.
+        """
+        yield from strip_stream(
+            self.response_cache.stream(
+                self.client,
+                model=model,
+                messages=self._messages(report),
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+            )
+        )
+
+    async def agenerate(
+        self,
+        report: str,
+        model: str = "gpt-3.5-turbo",
+        semaphore: asyncio.Semaphore | None = None,
+    ) -> str:
+        """
+        Async `generate`. `semaphore` bounds the completions in flight across calls.
+        """
+        async with semaphore or nullcontext():
+            response = await self.response_cache.acreate(
+                self.async_client,
+                model=model,
+                messages=self._messages(report),
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+                rate_limiter=self.rate_limiter,
+            )
+        return (response.choices[0].message.content or "").strip()
+
+    async def agenerate_many(self, reports: list[str], model: str = "gpt-3.5-turbo") -> list[str]:
+        return await gather_limited(
+            lambda report, semaphore: self.agenerate(report, model, semaphore),
+            reports,
+            self.max_concurrency,
+        )
+
+    def generate_many(self, reports: list[str], model: str = "gpt-3.5-turbo") -> list[str]:
+        """
+        Generate answers for `reports` concurrently, in the order given.
+        """
+        answers = asyncio.run(self.agenerate_many(reports, model))
+        logger.info(f"Generated {len(answers)} answers")
+        return answers
@@ -0,0 +1,169 @@
+from dataclasses import replace
+from functools import cache
+from typing import Callable
+
+from src.chat.retrievers import RetrievedChunk
+
+TOKEN_BUDGET = 2000  # Context tokens per prompt
+DUPLICATE_THRESHOLD = 0.8  # Word-shingle Jaccard similarity above which chunks are duplicates
+SHINGLE_SIZE = 3
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators the chat format adds to each message
+CHUNK_OVERLAP = 0  # Characters consecutive chunks share; matches get_chunks(overlap=...)
+# Chunks farther than this multiple of the closest chunk's distance are dropped. Distances
+# are relative to the query and the embedding model, so no fixed cutoff fits every report
+MAX_DISTANCE_RATIO = 1.5
+
+
+@cache
+def get_token_counter(model: str) -> Callable[[str], int]:
+    """
+    Token counter for an OpenAI chat model, falling back to the cl100k_base
+    encoding for models tiktoken does not know.
+    """
+    import tiktoken
+
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: list[dict], count_tokens: Callable[[str], int]) -> int:
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def format_chunk(i: int, text: str) -> str:
+    return f"<doc id='{i}'>\n{text}\n</doc>"
+
+
+def _shingles(text: str) -> set[tuple[str, ...]]:
+    words = text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _is_word_boundary(text: str, i: int) -> bool:
+    return i == 0 or i == len(text) or text[i - 1].isspace() or text[i].isspace()
+
+
+def _join_adjacent(first: str, second: str, overlap: int) -> str:
+    # Only drop text that is exactly the chunker's overlap and spans whole words;
+    # anything shorter is a coincidence, such as "include" + "endocrine"
+    if (
+        0 < overlap < min(len(first), len(second))
+        and first.endswith(second[:overlap])
+        and _is_word_boundary(first, len(first) - overlap)
+        and _is_word_boundary(second, overlap)
+    ):
+        return first + second[overlap:]
+    return f"{first}\n{second}"
+
+
+def merge_adjacent(
+    chunks: list[RetrievedChunk], overlap: int = CHUNK_OVERLAP
+) -> list[RetrievedChunk]:
+    """
+    Merge retrieved chunks with consecutive chunk_ids into one passage, dropping
+    the `overlap` characters the chunker repeated at the start of each chunk. A
+    merged passage takes the rank and distance of its best member.
+    """
+    by_id = {chunk.chunk_id: chunk for chunk in chunks if chunk.chunk_id is not None}
+    merged: list[RetrievedChunk] = []
+    absorbed: set[int] = set()
+    for chunk in chunks:
+        if chunk.chunk_id is None:
+            merged.append(chunk)
+            continue
+        if chunk.chunk_id in absorbed:
+            continue
+        start = chunk.chunk_id
+        while start - 1 in by_id and start - 1 not in absorbed:
+            start -= 1
+        end = chunk.chunk_id
+        while end + 1 in by_id and end + 1 not in absorbed:
+            end += 1
+        text = by_id[start].text
+        for chunk_id in range(start + 1, end + 1):
+            text = _join_adjacent(text, by_id[chunk_id].text, overlap)
+        absorbed.update(range(start, end + 1))
+        best = min(by_id[i].distance for i in range(start, end + 1))
+        merged.append(replace(chunk, text=text, distance=best, chunk_id=start))
+    return merged
+
+
+def drop_duplicates(
+    chunks: list[RetrievedChunk], threshold: float = DUPLICATE_THRESHOLD
+) -> list[RetrievedChunk]:
+    """
+    Drop chunks whose word shingles overlap a better-ranked chunk's by more than
+    `threshold` (Jaccard similarity).
+    """
+    kept: list[RetrievedChunk] = []
+    kept_shingles: list[set[tuple[str, ...]]] = []
+    for chunk in chunks:
+        shingles = _shingles(chunk.text)
+        if any(
+            len(shingles & other) / max(1, len(shingles | other)) > threshold
+            for other in kept_shingles
+        ):
+            continue
+        kept.append(chunk)
+        kept_shingles.append(shingles)
+    return kept
+
+
+class ContextPacker:
+    def __init__(
+        self,
+        token_budget: int = TOKEN_BUDGET,
+        max_distance: float | None = None,
+        max_distance_ratio: float | None = MAX_DISTANCE_RATIO,
+        duplicate_threshold: float = DUPLICATE_THRESHOLD,
+        count_tokens: Callable[[str], int] | None = None,
+        chunk_overlap: int = CHUNK_OVERLAP,
+    ):
+        """
+        Assemble retrieved chunks into prompt context: drop chunks farther than
+        `max_distance` or than `max_distance_ratio` times the closest chunk's
+        distance (BM25-only hits, which have no distance, are kept), merge
+        adjacent chunks, drop near-duplicates, then take chunks in rank order while
+        they fit in `token_budget` tokens of the target model. `count_tokens`
+        overrides the model's tokenizer. `chunk_overlap` is the overlap the index
+        was chunked with.
+        """
+        self.token_budget = token_budget
+        self.max_distance = max_distance
+        self.max_distance_ratio = max_distance_ratio
+        self.duplicate_threshold = duplicate_threshold
+        self._count_tokens = count_tokens
+        self.chunk_overlap = chunk_overlap
+
+    def count_tokens(self, model: str) -> Callable[[str], int]:
+        return self._count_tokens or get_token_counter(model)
+
+    def pack(self, chunks: list[RetrievedChunk], model: str) -> list[RetrievedChunk]:
+        cutoff = self.max_distance if self.max_distance is not None else float("inf")
+        best = min((chunk.distance for chunk in chunks), default=float("inf"))
+        if self.max_distance_ratio is not None and 0 < best < float("inf"):
+            cutoff = min(cutoff, best * self.max_distance_ratio)
+        chunks = [
+            chunk
+            for chunk in chunks
+            if chunk.distance <= cutoff or chunk.distance == float("inf")
+        ]
+        chunks = drop_duplicates(
+            merge_adjacent(chunks, self.chunk_overlap), self.duplicate_threshold
+        )
+        count_tokens = self.count_tokens(model)
+        packed: list[RetrievedChunk] = []
+        used = 0
+        for chunk in chunks:
+            tokens = count_tokens(format_chunk(len(packed), chunk.text))
+            # Skip a chunk that does not fit; a shorter, lower-ranked one still might
+            if used + tokens > self.token_budget:
+                continue
+            packed.append(chunk)
+            used += tokens
+        return packed
@@ -0,0 +1,248 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, Iterator, TypeVar
+
+import openai
+from loguru import logger
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion
+from openai.types.completion_usage import CompletionUsage
+
+T = TypeVar("T")
+
+TEMPERATURE = 0.7
+MAX_TOKENS = 500
+MAX_CONCURRENCY = 8  # Chat completions in flight at once
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+CHARS_PER_TOKEN = 4  # Rough estimate used for rate limiting
+
+
+@dataclass
+class TokenUsage:
+    """
+    Token counts summed over API responses. `cached_tokens` are prompt tokens the
+    provider served from its prefix cache, billed at a discount.
+    """
+
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+
+    def record(self, usage: CompletionUsage | None):
+        self.requests += 1
+        if usage is None:
+            return
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        details = usage.prompt_tokens_details
+        self.cached_tokens += (details.cached_tokens or 0) if details else 0
+
+    @property
+    def cached_fraction(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+class AsyncRateLimiter:
+    """
+    Token buckets for requests and tokens per minute, shared by all coroutines of
+    a client. Each bucket starts full and refills continuously.
+
+    State is guarded by a thread lock rather than an asyncio one, so a limiter
+    outlives the event loop of a single `asyncio.run`.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def acquire(self, tokens: int = 0):
+        # A request larger than the whole bucket only waits for a full bucket
+        tokens = min(tokens, int(self.tokens_per_minute))
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed_minutes = (now - self._updated) / 60
+                self._updated = now
+                self._requests = min(
+                    self.requests_per_minute,
+                    self._requests + elapsed_minutes * self.requests_per_minute,
+                )
+                self._tokens = min(
+                    self.tokens_per_minute,
+                    self._tokens + elapsed_minutes * self.tokens_per_minute,
+                )
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = 60 * max(
+                    (1 - self._requests) / self.requests_per_minute,
+                    (tokens - self._tokens) / self.tokens_per_minute,
+                )
+            await asyncio.sleep(wait)
+
+
+def estimate_tokens(messages: list[dict], max_tokens: int) -> int:
+    """
+    Tokens a request counts against the TPM limit: the prompt, estimated from its
+    length, plus the completion budget.
+    """
+    return sum(len(message["content"]) for message in messages) // CHARS_PER_TOKEN + max_tokens
+
+
+def _retry_delay(error: openai.APIError, attempt: int) -> float:
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(delay, float(retry_after)) if retry_after else delay
+    except ValueError:
+        return delay
+
+
+async def acomplete(
+    client: AsyncOpenAI,
+    model: str,
+    messages: list[dict],
+    temperature: float,
+    max_tokens: int,
+    rate_limiter: AsyncRateLimiter | None = None,
+    max_retries: int = MAX_RETRIES,
+) -> ChatCompletion:
+    """
+    Create a chat completion, retrying rate limits (429), server errors (5xx) and
+    connection failures with full-jitter exponential backoff, or the server's
+    Retry-After when it is longer.
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter:
+            await rate_limiter.acquire(estimate_tokens(messages, max_tokens))
+        try:
+            return await client.chat.completions.create(
+                model=model,
+                messages=messages,  # type: ignore
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        except (
+            openai.RateLimitError,
+            openai.InternalServerError,
+            openai.APIConnectionError,
+        ) as e:
+            if attempt == max_retries:
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning(f"{type(e).__name__} from {model}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def stream_completion(
+    client: OpenAI,
+    model: str,
+    messages: list[dict],
+    temperature: float,
+    max_tokens: int,
+) -> Iterator[str]:
+    """
+    Stream a chat completion, yielding content deltas as they arrive. Time to first
+    token and total latency are logged separately. Once the stream is exhausted
+    its return value is the assembled `ChatCompletion`.
+    """
+    start = time.perf_counter()
+    first_token = None
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,  # type: ignore
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parts: list[str] = []
+    finish_reason = None
+    last = None
+    for chunk in stream:
+        last = chunk
+        if not chunk.choices:
+            continue  # The final chunk only carries usage
+        choice = chunk.choices[0]
+        finish_reason = choice.finish_reason or finish_reason
+        delta = choice.delta.content
+        if delta:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            parts.append(delta)
+            yield delta
+    total = time.perf_counter() - start
+    logger.info(
+        f"{model}: first token after {first_token or total:.2f}s, completed in {total:.2f}s"
+    )
+    if last is None:
+        raise ValueError(f"{model} returned an empty completion stream")
+    return ChatCompletion.model_validate(
+        {
+            "id": last.id,
+            "object": "chat.completion",
+            "created": last.created,
+            "model": last.model,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": finish_reason or "stop",
+                    "message": {"role": "assistant", "content": "".join(parts)},
+                }
+            ],
+            "usage": last.usage.model_dump() if last.usage else None,
+        }
+    )
+
+
+def strip_stream(deltas: Iterable[str]) -> Iterator[str]:
+    """
+    Yield `deltas` without the whitespace around their concatenation, so a streamed
+    answer joins up to the same text as the stripped one from `generate`.
+    Whitespace is held back until more text follows it.
+    """
+    pending = ""
+    started = False
+    for delta in deltas:
+        if not started:
+            delta = delta.lstrip()
+            if not delta:
+                continue
+            started = True
+        text = pending + delta
+        stripped = text.rstrip()
+        pending = text[len(stripped) :]
+        if stripped:
+            yield stripped
+
+
+async def gather_limited(
+    agenerate: Callable[[str, asyncio.Semaphore], Awaitable[T]],
+    reports: list[str],
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> list[T]:
+    """
+    Run `agenerate` for every report, sharing one semaphore that bounds the LLM
+    calls in flight. Results keep the order of `reports`.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    return await asyncio.gather(*(agenerate(report, semaphore) for report in reports))
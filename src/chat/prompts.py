@@ -0,0 +1,35 @@
+from src.chat.context import format_chunk
+from src.chat.prompt_templates import (
+    RAG_SYSTEM_PROMPT,
+    RAG_SYSTEM_TEMPLATE,
+    RAG_USER_TEMPLATE,
+    USER_TEMPLATE,
+)
+
+# static_prefix: static system prompt first, retrieved context and report last
+# legacy: context inside the system prompt, so no two requests share a prefix
+PROMPT_LAYOUTS = ("static_prefix", "legacy")
+MIN_CACHED_PREFIX_TOKENS = 1024  # OpenAI only caches prompt prefixes at least this long
+
+
+def build_rag_messages(
+    report: str, retrieved_texts: list[str], layout: str = "static_prefix"
+) -> list[dict]:
+    """
+    Assemble the chat messages for a RAG request. With the default layout every
+    request starts with the same system prompt of over `MIN_CACHED_PREFIX_TOKENS`
+    tokens, which lets provider prompt caching serve it.
+    """
+    # Format chunks with doc tags and IDs
+    context = "\n".join(format_chunk(i, text) for i, text in enumerate(retrieved_texts))
+    if layout == "static_prefix":
+        return [
+            {"role": "system", "content": RAG_SYSTEM_PROMPT},
+            {"role": "user", "content": RAG_USER_TEMPLATE.format(context=context, report=report)},
+        ]
+    if layout == "legacy":
+        return [
+            {"role": "system", "content": RAG_SYSTEM_TEMPLATE.format(context=context)},
+            {"role": "user", "content": USER_TEMPLATE.format(report=report)},
+        ]
+    raise ValueError(f"Unknown prompt layout {layout!r}, expected one of {PROMPT_LAYOUTS}")
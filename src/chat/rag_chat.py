@@ -1,22 +1,158 @@
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Iterator
 
 from loguru import logger
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
-import lancedb
-from src.chat.prompt_templates import RAG_SYSTEM_TEMPLATE, USER_TEMPLATE
-from src.index.index_lancedb import DB_URI, TABLE_NAME
+from src.chat.context import ContextPacker, count_message_tokens
+from src.chat.llm import (
+    MAX_CONCURRENCY,
+    MAX_TOKENS,
+    REQUESTS_PER_MINUTE,
+    TEMPERATURE,
+    TOKENS_PER_MINUTE,
+    AsyncRateLimiter,
+    gather_limited,
+    strip_stream,
+)
+from src.chat.prompts import PROMPT_LAYOUTS, build_rag_messages
+from src.chat.reranker import RERANK_OVERFETCH, CrossEncoderReranker
+from src.chat.response_cache import ResponseCache
+from src.chat.retrieval_cache import CachedRetriever, RetrievalCache
+from src.chat.retrievers import (
+    MAX_SEGMENT_TOKENS,
+    LanceDBRetriever,
+    Retriever,
+    SegmentedRetriever,
+)
 
 
 class RAGChat:
-    def __init__(self, k: int = 10):
+    def __init__(
+        self,
+        k: int = 10,
+        nprobes: int = 20,
+        refine_factor: int | None = None,
+        metric: str = "l2",
+        retriever: Retriever | None = None,
+        segment_tokens: int | None = MAX_SEGMENT_TOKENS,
+        hybrid: bool = True,
+        fusion: str = "rrf",
+        retrieval_cache: RetrievalCache | None = None,
+        response_cache: ResponseCache | None = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+        rate_limiter: AsyncRateLimiter | None = None,
+        context_packer: ContextPacker | None = None,
+        pack_context: bool = True,
+        prompt_layout: str = "static_prefix",
+        reranker: CrossEncoderReranker | None = None,
+        rerank_overfetch: int = RERANK_OVERFETCH,
+    ):
+        """
+        `nprobes`, `refine_factor`, `metric`, `hybrid` and `fusion` configure the
+        default LanceDB retriever (see `LanceDBRetriever`), which combines BM25 and
+        vector search, and are ignored when `retriever` is given.
+        Reports are searched in segments of `segment_tokens` tokens whose results are
+        fused, so text past the embedding model's window still counts; pass None to
+        search with the whole report as a single query.
+
+        Retrieved chunks are cached per report in `retrieval_cache`, by default an
+        in-memory LRU; give it a `cache_dir` to share results across runs, or
+        `capacity=0` to disable it. LLM responses go through `response_cache`, by
+        default the shared on-disk cache in read-through mode. The async API runs at
+        most `max_concurrency` completions at once, within the given RPM/TPM limits;
+        chats calling the same API key should share one `rate_limiter` instead.
+
+        Retrieved chunks are filtered, deduplicated and fitted to a token budget by
+        `context_packer` (a default `ContextPacker` unless `pack_context` is False,
+        in which case all `k` chunks go into the prompt). `prompt_layout` is one of
+        `PROMPT_LAYOUTS`; see `build_rag_messages`.
+
+        With a `reranker`, `k * rerank_overfetch` candidates are retrieved and the
+        `k` the reranker scores highest go on to packing, so a small `k` keeps the
+        prompt short without missing chunks that rank low in vector search.
+        """
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt layout {prompt_layout!r}")
         self.k = k
-        db = lancedb.connect(DB_URI)
-        self.table = db.open_table(TABLE_NAME)
+        retriever = retriever or LanceDBRetriever(
+            nprobes, refine_factor, metric, hybrid=hybrid, fusion=fusion
+        )
+        if segment_tokens is not None:
+            retriever = SegmentedRetriever(retriever, segment_tokens)
+        self.retrieval_cache = retrieval_cache or RetrievalCache()
+        self.retriever = CachedRetriever(retriever, self.retrieval_cache)
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OpenAI API key is not set in the environment variables.")
         self.client = OpenAI(api_key=api_key)
+        # Retries are handled by `acomplete`, with jitter and the rate limiter
+        self.async_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter or AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+        self.context_packer = (context_packer or ContextPacker()) if pack_context else None
+        self.prompt_layout = prompt_layout
+        self.reranker = reranker
+        self.rerank_overfetch = rerank_overfetch
+        # Retrievals run one at a time off the event loop, overlapping in-flight LLM calls
+        self._retrieval_executor = ThreadPoolExecutor(max_workers=1)
+
+    def warmup(self):
+        """
+        Load the index, embedding model and reranker ahead of the first request.
+        """
+        try:
+            self.retriever.warmup()
+        except Exception:
+            logger.exception("Failed to load the retriever")
+        if self.reranker is not None:
+            try:
+                self.reranker.warmup()
+            except Exception:
+                logger.exception("Failed to load the reranker")
+
+    def _retrieve(self, report: str, model: str) -> list[str] | None:
+        """
+        Retrieve chunks for the report, rerank them when there is a reranker, and
+        pack them into the context budget of `model`, logging the prompt size
+        before and after packing.
+        """
+        k = self.k * self.rerank_overfetch if self.reranker is not None else self.k
+        try:
+            chunks = self.retriever.retrieve(report, k)
+        except Exception as e:
+            logger.error(f"Error searching the index: {e}")
+            return None
+        if self.reranker is not None:
+            try:
+                chunks = self.reranker.rerank(report, chunks, self.k)
+            except Exception as e:
+                logger.error(f"Error reranking, keeping the retrieval order: {e}")
+                chunks = chunks[: self.k]
+        if self.context_packer is None:
+            return [chunk.text for chunk in chunks]
+
+        packed = self.context_packer.pack(chunks, model)
+        count_tokens = self.context_packer.count_tokens(model)
+        tokens_before = count_message_tokens(
+            self._messages(report, [chunk.text for chunk in chunks]), count_tokens
+        )
+        retrieved_texts = [chunk.text for chunk in packed]
+        tokens_after = count_message_tokens(self._messages(report, retrieved_texts), count_tokens)
+        logger.info(
+            f"Prompt tokens: {tokens_before} with {len(chunks)} retrieved chunks, "
+            f"{tokens_after} with {len(packed)} packed"
+        )
+        return retrieved_texts
+
+    def _messages(self, report: str, retrieved_texts: list[str]) -> list[dict]:
+        return build_rag_messages(report, retrieved_texts, self.prompt_layout)
 
     def generate(self, report: str, model: str = "gpt-3.5-turbo") -> tuple[str, list[str]]:
         """
@@ -24,31 +160,84 @@ class RAGChat:
         and querying the OpenAI GPT model for an summarization.
         """
 
-        # Search LanceDB for relevant documents
-        try:
-            search_result = self.table.search(report).limit(self.k).to_polars()
-            retrieved_texts = search_result["text"].to_list()
-        except Exception as e:
-            logger.error(f"Error searching LanceDB: {e}")
+        # Search the index for relevant documents
+        retrieved_texts = self._retrieve(report, model)
+        if retrieved_texts is None:
             return "There was an error retrieving information from the database.", []
-        
-        # Format chunks with doc tags and IDs
-        formatted_texts = [
-            f"<doc id='{i}'>\n{text}\n</doc>"
-            for i, text in enumerate(retrieved_texts)
-        ]
-        retrieval_context = "\n".join(formatted_texts)
 
         # Query the LLM
-        response = self.client.chat.completions.create(
+        response = self.response_cache.create(
+            self.client,
             model=model,
-            messages=[
-                {"role": "system", "content": RAG_SYSTEM_TEMPLATE.format(context=retrieval_context)},
-                {"role": "user", "content": USER_TEMPLATE.format(report=report)},
-            ],
-            temperature=0.7,
-            max_tokens=500,
+            messages=self._messages(report, retrieved_texts),
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
         )
         llm_response = (response.choices[0].message.content or "").strip()
 
         return llm_response, retrieved_texts
+
+    def stream(self, report: str, model: str = "gpt-3.5-turbo") -> Iterator[str]:
+        """
+        Streaming `generate`, yielding the answer in pieces as the model produces them.
+        """
+        retrieved_texts = self._retrieve(report, model)
+        if retrieved_texts is None:
+            yield "There was an error retrieving information from the database."
+            return
+        yield from strip_stream(
+            self.response_cache.stream(
+                self.client,
+                model=model,
+                messages=self._messages(report, retrieved_texts),
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+            )
+        )
+
+    async def agenerate(
+        self,
+        report: str,
+        model: str = "gpt-3.5-turbo",
+        semaphore: asyncio.Semaphore | None = None,
+    ) -> tuple[str, list[str]]:
+        """
+        Async `generate`. Retrieval runs on a worker thread before `semaphore` is
+        taken, so it overlaps the completions other reports have in flight.
+        """
+        loop = asyncio.get_running_loop()
+        retrieved_texts = await loop.run_in_executor(
+            self._retrieval_executor, self._retrieve, report, model
+        )
+        if retrieved_texts is None:
+            return "There was an error retrieving information from the database.", []
+
+        async with semaphore or nullcontext():
+            response = await self.response_cache.acreate(
+                self.async_client,
+                model=model,
+                messages=self._messages(report, retrieved_texts),
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+                rate_limiter=self.rate_limiter,
+            )
+        return (response.choices[0].message.content or "").strip(), retrieved_texts
+
+    async def agenerate_many(
+        self, reports: list[str], model: str = "gpt-3.5-turbo"
+    ) -> list[tuple[str, list[str]]]:
+        return await gather_limited(
+            lambda report, semaphore: self.agenerate(report, model, semaphore),
+            reports,
+            self.max_concurrency,
+        )
+
+    def generate_many(
+        self, reports: list[str], model: str = "gpt-3.5-turbo"
+    ) -> list[tuple[str, list[str]]]:
+        """
+        Generate answers for `reports` concurrently, in the order given.
+        """
+        results = asyncio.run(self.agenerate_many(reports, model))
+        logger.info(f"Generated {len(results)} answers")
+        return results
@@ -0,0 +1,170 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import replace
+from itertools import batched
+from typing import Callable, Sequence
+
+from loguru import logger
+
+from src.chat.retrievers import RetrievedChunk, get_token_counter, split_segments
+
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"  # 22M parameters, fast on CPU
+RERANK_OVERFETCH = 4  # Candidates retrieved per chunk kept for the prompt
+RERANK_BATCH_SIZE = 16
+RERANK_TIME_BUDGET = 0.5  # Seconds per report before falling back to vector order
+RERANK_MAX_LENGTH = 512  # Tokens per (report, chunk) pair; the longer side is truncated
+RERANK_SEGMENT_TOKENS = 256  # Report tokens per pair, leaving the rest of the pair to the chunk
+RERANK_MAX_SEGMENTS = 2  # Report segments scored against each chunk
+COST_SMOOTHING = 0.3  # Weight of the latest batch in the running seconds-per-pair estimate
+
+
+class CrossEncoderReranker:
+    def __init__(
+        self,
+        model_name: str = RERANK_MODEL_NAME,
+        batch_size: int = RERANK_BATCH_SIZE,
+        time_budget: float | None = RERANK_TIME_BUDGET,
+        max_length: int = RERANK_MAX_LENGTH,
+        segment_tokens: int | None = RERANK_SEGMENT_TOKENS,
+        max_segments: int = RERANK_MAX_SEGMENTS,
+        score_pairs: Callable[[list[tuple[str, str]]], Sequence[float]] | None = None,
+        count_tokens: Callable[[str], int] | None = None,
+    ):
+        """
+        Rerank retrieved chunks by a cross-encoder's relevance score for each
+        (report, chunk) pair, scored in batches of `batch_size` on the CPU.
+        Reports are split into segments of `segment_tokens` tokens so the model's
+        `max_length` does not cut them off, and a chunk scores the maximum over
+        the first `max_segments` segments; pass None to score the whole report
+        at once.
+
+        `time_budget` bounds the scoring time per report. The seconds per pair
+        measured on earlier batches decide how many pairs fit in it: past that,
+        only the first segment is scored, and then only as many chunks as fit.
+        Batches are scored on a worker thread and waited on for at most the time
+        left, so a slow batch cannot overrun the budget either. The chunks scored
+        in time are ranked by score ahead of the rest, which keep their retrieval
+        order.
+        `score_pairs` and `count_tokens` override the model and its tokenizer,
+        e.g. in tests.
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.max_length = max_length
+        self.segment_tokens = segment_tokens
+        self.max_segments = max_segments
+        self._score_pairs = score_pairs
+        self._count_tokens = count_tokens
+        self._load_lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._pair_seconds: float | None = None
+        self.reranked = 0
+        self.timeouts = 0
+
+    def _scorer(self) -> Callable[[list[tuple[str, str]]], Sequence[float]]:
+        if self._score_pairs is None:
+            with self._load_lock:
+                if self._score_pairs is None:
+                    # Deferred like the embedding model: importing torch takes seconds
+                    from sentence_transformers import CrossEncoder
+
+                    model = CrossEncoder(
+                        self.model_name, max_length=self.max_length, device="cpu"
+                    )
+                    logger.info(f"Loaded reranker {self.model_name}")
+                    self._score_pairs = lambda pairs: model.predict(
+                        pairs, batch_size=len(pairs), convert_to_numpy=True
+                    )  # type: ignore
+        return self._score_pairs  # type: ignore
+
+    @staticmethod
+    def _new_executor() -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+
+    def _observe(self, seconds: float, num_pairs: int):
+        pair_seconds = seconds / num_pairs
+        if self._pair_seconds is None:
+            self._pair_seconds = pair_seconds
+        else:
+            self._pair_seconds += COST_SMOOTHING * (pair_seconds - self._pair_seconds)
+
+    @property
+    def count_tokens(self) -> Callable[[str], int]:
+        if self._count_tokens is None:
+            self._count_tokens = get_token_counter(self.model_name)
+        return self._count_tokens
+
+    def warmup(self):
+        self._scorer()
+        if self.segment_tokens is not None:
+            self.count_tokens
+
+    def _segments(self, query: str) -> list[str]:
+        if self.segment_tokens is None:
+            return [query]
+        return split_segments(query, self.segment_tokens, self.count_tokens) or [query]
+
+    def rerank(self, query: str, chunks: list[RetrievedChunk], top_n: int) -> list[RetrievedChunk]:
+        """
+        Return the `top_n` chunks with the highest cross-encoder scores, stored in
+        their `score`. If the time budget runs out, the chunks scored in time come
+        first, ranked by score, followed by the rest in retrieval order.
+        """
+        score_pairs = self._scorer()
+        segments = self._segments(query)[: self.max_segments]
+        num_scored = len(chunks)
+        if self.time_budget is not None and self._pair_seconds:
+            affordable = int(self.time_budget / self._pair_seconds)
+            if affordable < len(chunks) * len(segments):
+                segments = segments[:1]
+            # Always at least one full batch, which keeps the estimate up to date
+            num_scored = min(len(chunks), max(self.batch_size, affordable) // len(segments))
+        # Chunk-major, so chunks are fully scored in retrieval order
+        pairs = [(segment, chunk.text) for chunk in chunks[:num_scored] for segment in segments]
+        start = time.perf_counter()
+        pair_scores: list[float] = []
+        for batch in batched(pairs, self.batch_size):
+            remaining = None
+            if self.time_budget is not None:
+                remaining = self.time_budget - (time.perf_counter() - start)
+                if remaining <= 0:
+                    break
+            batch_start = time.perf_counter()
+            future = self._executor.submit(score_pairs, list(batch))
+            try:
+                batch_scores = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                # A lower bound on the cost, so the next report takes on fewer pairs
+                self._observe(time.perf_counter() - batch_start, len(batch))
+                # Leave the batch to finish on its own; the next report gets a new
+                # worker instead of queueing behind it
+                self._executor.shutdown(wait=False)
+                self._executor = self._new_executor()
+                break
+            self._observe(time.perf_counter() - batch_start, len(batch))
+            pair_scores.extend(float(score) for score in batch_scores)
+
+        scores = [
+            max(pair_scores[i : i + len(segments)])
+            for i in range(0, len(pair_scores) - len(segments) + 1, len(segments))
+        ]
+        elapsed = time.perf_counter() - start
+        if len(scores) < num_scored:
+            self.timeouts += 1
+            logger.warning(
+                f"Reranking stopped after {elapsed:.2f}s with {len(scores)}/{len(chunks)} "
+                "chunks scored, keeping the retrieval order for the rest"
+            )
+        else:
+            self.reranked += 1
+            logger.debug(
+                f"Reranked {num_scored}/{len(chunks)} chunks against {len(segments)} report "
+                f"segments in {elapsed:.2f}s"
+            )
+        # Stable, so ties keep their retrieval order
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])
+        ranked = [replace(chunks[i], score=scores[i]) for i in order]
+        return (ranked + chunks[len(scores) :])[:top_n]
@@ -0,0 +1,210 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+from loguru import logger
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion
+
+from src import config
+from src.utils import sha256_text
+
+from .llm import AsyncRateLimiter, TokenUsage, acomplete, stream_completion
+
+CACHE_PATH = config.PROCESSED_DIR / "llm_cache.sqlite"
+MAX_CACHE_BYTES = 512 * 1024**2
+# read_through: serve hits, call the API and store on a miss
+# write_through: always call the API and store, refreshing existing entries
+# bypass: neither read nor write the cache
+CACHE_MODES = ("read_through", "write_through", "bypass")
+
+
+class ResponseCache:
+    """
+    SQLite store of chat completions keyed by a hash of the request: model,
+    messages, temperature and max_tokens. Entries are evicted least recently used
+    first once their total size passes `max_bytes`. The database is opened in WAL
+    mode so several processes can share it.
+    """
+
+    def __init__(
+        self,
+        path: Path = CACHE_PATH,
+        max_bytes: int = MAX_CACHE_BYTES,
+        mode: str = "read_through",
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        # Usage of the completions fetched from the API, whatever the mode
+        self.usage = TokenUsage()
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, last_used REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+            )
+        self._size = self._total_size()
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, messages: list[dict], temperature: float, max_tokens: int) -> str:
+        return sha256_text(
+            json.dumps([model, messages, temperature, max_tokens], sort_keys=True)
+        )
+
+    def get(self, key: str) -> ChatCompletion | None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return ChatCompletion.model_validate_json(row[0])
+
+    def _record_usage(self, completion: ChatCompletion):
+        with self._lock:
+            self.usage.record(completion.usage)
+        if completion.usage is not None:
+            details = completion.usage.prompt_tokens_details
+            cached = (details.cached_tokens or 0) if details else 0
+            logger.debug(
+                f"{completion.model}: {completion.usage.prompt_tokens} prompt tokens, "
+                f"{cached} cached"
+            )
+
+    def put(self, key: str, completion: ChatCompletion):
+        response = completion.model_dump_json()
+        size = len(response.encode("utf-8"))
+        with self._lock, self._conn:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, completion.model, response, size, time.time()),
+            )
+            self._size += size - (old[0] if old else 0)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        with self._lock, self._conn:
+            # Other processes may have written too, so start from the stored total
+            self._size = self._total_size()
+            evicted = 0
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used")
+            stale = []
+            for key, size in rows:
+                if self._size <= self.max_bytes:
+                    break
+                stale.append((key,))
+                self._size -= size
+            if stale:
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                evicted = len(stale)
+        if evicted:
+            logger.info(f"Evicted {evicted} responses from {self.path}")
+
+    def create(
+        self,
+        client: OpenAI,
+        model: str,
+        messages: list[dict],
+        temperature: float,
+        max_tokens: int,
+    ) -> ChatCompletion:
+        """
+        `client.chat.completions.create`, going through the cache according to `mode`.
+        """
+        key = self.key(model, messages, temperature, max_tokens)
+        if self.mode == "read_through":
+            completion = self.get(key)
+            if completion is not None:
+                return completion
+        completion = client.chat.completions.create(
+            model=model,
+            messages=messages,  # type: ignore
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        self._record_usage(completion)
+        if self.mode != "bypass":
+            self.put(key, completion)
+        return completion
+
+    async def acreate(
+        self,
+        client: AsyncOpenAI,
+        model: str,
+        messages: list[dict],
+        temperature: float,
+        max_tokens: int,
+        rate_limiter: AsyncRateLimiter | None = None,
+    ) -> ChatCompletion:
+        """
+        Async counterpart of `create`, calling the API through `acomplete` on a miss.
+        """
+        key = self.key(model, messages, temperature, max_tokens)
+        if self.mode == "read_through":
+            completion = self.get(key)
+            if completion is not None:
+                return completion
+        completion = await acomplete(
+            client, model, messages, temperature, max_tokens, rate_limiter
+        )
+        self._record_usage(completion)
+        if self.mode != "bypass":
+            self.put(key, completion)
+        return completion
+
+    def stream(
+        self,
+        client: OpenAI,
+        model: str,
+        messages: list[dict],
+        temperature: float,
+        max_tokens: int,
+    ) -> Iterator[str]:
+        """
+        Streaming counterpart of `create`, yielding content deltas. A hit yields the
+        cached content at once; a streamed response is stored once it completes.
+        """
+        key = self.key(model, messages, temperature, max_tokens)
+        if self.mode == "read_through":
+            completion = self.get(key)
+            if completion is not None:
+                yield completion.choices[0].message.content or ""
+                return
+        completion = yield from stream_completion(
+            client, model, messages, temperature, max_tokens
+        )
+        self._record_usage(completion)
+        if self.mode != "bypass":
+            self.put(key, completion)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
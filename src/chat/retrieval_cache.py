@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+
+from loguru import logger
+
+from src import config
+from src.chat.retrievers import RetrievedChunk, Retriever
+from src.utils import atomic_open, sha256_text
+
+CACHE_DIR = config.PROCESSED_DIR / "retrieval_cache"
+CAPACITY = 256  # Queries kept in memory
+MAX_DISK_BYTES = 256 * 1024**2
+
+
+class RetrievalCache:
+    """
+    Retrieved chunks per query, held in an in-process LRU of `capacity` entries.
+    With `cache_dir`, entries are also written there as JSON files, one per key,
+    so other processes and later runs reuse them; that tier is evicted least
+    recently used first once it grows past `max_disk_bytes`.
+    """
+
+    def __init__(
+        self,
+        capacity: int = CAPACITY,
+        cache_dir: Path | None = None,
+        max_disk_bytes: int = MAX_DISK_BYTES,
+    ):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, list[RetrievedChunk]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_size = 0
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_size = sum(p.stat().st_size for p in self._entry_paths())
+
+    def _entry_paths(self) -> list[Path]:
+        assert self.cache_dir is not None
+        return list(self.cache_dir.glob("*/*.json"))
+
+    def path_for(self, key: str) -> Path:
+        assert self.cache_dir is not None
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    @staticmethod
+    def key(query: str, k: int, fingerprint: str) -> str:
+        return sha256_text(json.dumps([sha256_text(query), k, fingerprint]))
+
+    def get(self, key: str) -> list[RetrievedChunk] | None:
+        with self._lock:
+            chunks = self._entries.get(key)
+            if chunks is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return chunks
+        chunks = self._read(key) if self.cache_dir is not None else None
+        with self._lock:
+            if chunks is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, chunks)
+            return chunks
+
+    def _read(self, key: str) -> list[RetrievedChunk] | None:
+        path = self.path_for(key)
+        try:
+            rows = json.loads(path.read_text())
+            # Bump the modification time so eviction treats this entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return [RetrievedChunk(**row) for row in rows]
+
+    def put(self, key: str, chunks: list[RetrievedChunk]):
+        with self._lock:
+            self._remember(key, chunks)
+        if self.cache_dir is None:
+            return
+        path = self.path_for(key)
+        old_size = path.stat().st_size if path.exists() else 0
+        with atomic_open(path, "w") as f:
+            json.dump([asdict(chunk) for chunk in chunks], f)
+        with self._lock:
+            self._disk_size += path.stat().st_size - old_size
+        if self._disk_size > self.max_disk_bytes:
+            self.evict()
+
+    def _remember(self, key: str, chunks: list[RetrievedChunk]):
+        if self.capacity <= 0:
+            return
+        self._entries[key] = chunks
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def evict(self):
+        with self._lock:
+            entries = sorted(self._entry_paths(), key=lambda p: p.stat().st_mtime)
+            self._disk_size = sum(p.stat().st_size for p in entries)
+            evicted = 0
+            while entries and self._disk_size > self.max_disk_bytes:
+                path = entries.pop(0)
+                self._disk_size -= path.stat().st_size
+                path.unlink(missing_ok=True)
+                evicted += 1
+            if evicted:
+                logger.info(f"Evicted {evicted} entries from {self.cache_dir}")
+
+
+class CachedRetriever:
+    def __init__(self, retriever: Retriever, cache: RetrievalCache):
+        """
+        Serve repeated queries from `cache`. Keys cover the query text, `k` and the
+        wrapped retriever's fingerprint (index version, embedding model and search
+        parameters), so rebuilding the index or changing a parameter invalidates
+        earlier entries.
+        """
+        self.retriever = retriever
+        self.cache = cache
+
+    def warmup(self):
+        self.retriever.warmup()
+
+    def fingerprint(self) -> str:
+        return self.retriever.fingerprint()
+
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]:
+        return self.retrieve_many([query], k)[0]
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        fingerprint = self.retriever.fingerprint()
+        keys = [self.cache.key(query, k, fingerprint) for query in queries]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, chunks in enumerate(results) if chunks is None]
+        if missing:
+            retrieved = self.retriever.retrieve_many([queries[i] for i in missing], k)
+            for i, chunks in zip(missing, retrieved):
+                self.cache.put(keys[i], chunks)
+                results[i] = chunks
+        return results  # type: ignore
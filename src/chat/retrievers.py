@@ -0,0 +1,510 @@
+import json
+import threading
+import time
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import Any, Callable, Protocol
+
+import numpy as np
+from loguru import logger
+
+from src import config
+
+# Stays under the embedding model's 512-token window, including [CLS] and [SEP]
+MAX_SEGMENT_TOKENS = 500
+RRF_K = 60  # Reciprocal rank fusion constant; larger values flatten the rank weights
+FUSIONS = ("rrf", "linear")
+VECTOR_WEIGHT = 0.7  # Weight of the vector scores in linear fusion; BM25 gets the rest
+VERSION_CHECK_INTERVAL = 5.0  # Seconds between checks for writes to the LanceDB table
+
+
+@dataclass(frozen=True)
+class RetrievedChunk:
+    text: str
+    distance: float  # Lower is closer
+    chunk_id: int | None = None
+    score: float | None = None  # Fused, BM25 or reranker score, from the last ranking stage
+
+
+class Retriever(Protocol):
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]: ...
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        """
+        Retrieve for several queries with one batched embedding and search call.
+        """
+        ...
+
+    def warmup(self) -> None: ...
+
+    def fingerprint(self) -> str:
+        """
+        Identify the index version, embedding model and search parameters, so that
+        cached results are only reused while all of them stay the same.
+        """
+        ...
+
+
+class LanceDBRetriever:
+    def __init__(
+        self,
+        nprobes: int = 20,
+        refine_factor: int | None = None,
+        metric: str = "l2",
+        hybrid: bool = False,
+        fusion: str = "rrf",
+        vector_weight: float = VECTOR_WEIGHT,
+        version_check_interval: float = VERSION_CHECK_INTERVAL,
+    ):
+        """
+        `nprobes` and `refine_factor` tune the ANN index when the table has one:
+        the number of IVF partitions searched, and how many times `k` candidates
+        are re-ranked with full-precision vectors. `metric` must match the one the
+        index was built with.
+
+        With `hybrid`, a BM25 search on the table's full-text index runs alongside the
+        vector search and both rankings are merged with `fusion`: "rrf" for
+        reciprocal rank fusion, or "linear" for a `vector_weight`-weighted sum of
+        normalized scores. Without a full-text index only the vector search runs.
+
+        `fingerprint` checks for a newer table version at most every
+        `version_check_interval` seconds and reopens the table when it finds one,
+        so re-indexing while the retriever is running invalidates cached results.
+        """
+        if fusion not in FUSIONS:
+            raise ValueError(f"Unknown fusion {fusion!r}, expected one of {FUSIONS}")
+        self.nprobes = nprobes
+        self.refine_factor = refine_factor
+        self.metric = metric
+        self.hybrid = hybrid
+        self.fusion = fusion
+        self.vector_weight = vector_weight
+        self.version_check_interval = version_check_interval
+        self._has_fts = False
+        self._version = ""
+        self._version_checked = 0.0
+        self._table = None
+        self._model = None
+        self._table_lock = threading.Lock()
+
+    @property
+    def table(self):
+        """
+        The LanceDB table, opened on first use together with the embedding model so
+        that importing or constructing a retriever stays cheap.
+        """
+        if self._table is None:
+            with self._table_lock:
+                if self._table is None:
+                    self._table = self._open_table()
+        return self._table
+
+    def _open_table(self):
+        import lancedb
+
+        from src.index.index_lancedb import DB_URI, TABLE_NAME, get_model
+
+        self._model = get_model()
+        db = lancedb.connect(DB_URI)
+        table = db.open_table(TABLE_NAME)
+        logger.info(f"Opened LanceDB table {TABLE_NAME}")
+        self._version = self._table_version(table)
+        self._version_checked = time.monotonic()
+        if self.hybrid:
+            self._has_fts = any(index.index_type == "FTS" for index in table.list_indices())
+            if not self._has_fts:
+                logger.warning(
+                    f"Table {TABLE_NAME} has no full-text index, falling back to vector search. "
+                    "Rebuild it with `python -m src.index.index_lancedb --upsert`"
+                )
+        return table
+
+    @staticmethod
+    def _table_version(table) -> str:
+        # Version numbers restart when the table is dropped and recreated, so pair the
+        # version with its commit time to tell rebuilt tables apart
+        latest = max(table.list_versions(), key=lambda v: v["version"])
+        return f"{table.name}@{latest['version']}:{latest['timestamp'].isoformat()}"
+
+    def _refresh(self):
+        """
+        Reopen the table if it has been written to since it was opened, checking
+        at most every `version_check_interval` seconds.
+        """
+        table = self.table
+        with self._table_lock:
+            if time.monotonic() - self._version_checked < self.version_check_interval:
+                return
+            self._version_checked = time.monotonic()
+            try:
+                table.checkout_latest()
+                version = self._table_version(table)
+            except Exception as e:
+                # The handle can go bad when the table is dropped and recreated, so
+                # reopen it; if that fails too, never match the stale fingerprint again
+                logger.warning(f"Failed to check the LanceDB table version, reopening: {e}")
+                try:
+                    self._table = self._open_table()
+                except Exception as e:
+                    logger.warning(f"Failed to reopen the LanceDB table: {e}")
+                    self._version = f"unavailable@{time.time_ns()}"
+                return
+            if version != self._version:
+                logger.info(f"Table changed from {self._version} to {version}, reopening")
+                self._table = self._open_table()
+
+    def warmup(self):
+        self.table
+
+    def fingerprint(self) -> str:
+        self._refresh()
+        return json.dumps(
+            [
+                "lancedb",
+                self._version,
+                self._model.name,  # type: ignore
+                self._model.backend,  # type: ignore
+                self.metric,
+                self.nprobes,
+                self.refine_factor,
+                self.hybrid and self._has_fts,
+                self.fusion,
+                self.vector_weight,
+            ]
+        )
+
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]:
+        return self.retrieve_many([query], k)[0]
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        results = self._vector_search(queries, k)
+        if not (self.hybrid and self._has_fts):
+            return results
+        fuse = reciprocal_rank_fusion if self.fusion == "rrf" else self._linear_fusion
+        return [
+            fuse([vector_ranking, self._fts_search(query, k)], k)
+            for query, vector_ranking in zip(queries, results)
+        ]
+
+    def _linear_fusion(self, rankings: list[list[RetrievedChunk]], k: int) -> list[RetrievedChunk]:
+        return linear_fusion(rankings[0], rankings[1], k, self.vector_weight)
+
+    def _vector_search(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        table = self.table
+        vectors = self._model.generate_embeddings(queries)  # type: ignore
+        search = (
+            table.search(vectors)
+            .distance_type(self.metric)  # type: ignore
+            .limit(k)
+            .nprobes(self.nprobes)
+            .select(["chunk_id", "text", "_distance"])
+        )
+        if self.refine_factor:
+            search = search.refine_factor(self.refine_factor)
+        results: list[list[RetrievedChunk]] = [[] for _ in queries]
+        for row in search.to_arrow().to_pylist():
+            # A single query vector comes back without a query_index column
+            results[row.get("query_index", 0)].append(
+                RetrievedChunk(row["text"], row["_distance"], row["chunk_id"])
+            )
+        return results
+
+    def _fts_search(self, query: str, k: int) -> list[RetrievedChunk]:
+        rows = (
+            self.table.search(query, query_type="fts")
+            .limit(k)
+            .select(["chunk_id", "text", "_score"])
+            .to_arrow()
+            .to_pylist()
+        )
+        # BM25 hits have no vector distance; fusion keeps the vector one when both match
+        return [
+            RetrievedChunk(row["text"], float("inf"), row["chunk_id"], row["_score"])
+            for row in rows
+        ]
+
+
+class FaissRetriever:
+    def __init__(
+        self,
+        index_file_path: Path | None = None,
+        texts_file_path: Path | None = None,
+        search_params: str | None = None,
+        mmap: bool = True,
+        rescore_factor: int | None = None,
+        vectors_file_path: Path | None = None,
+    ):
+        """
+        Serve queries from the index written by `src.index.index_faiss`.
+        `search_params` is a faiss.ParameterSpace string such as "nprobe=16" or
+        "efSearch=64", matching the index type.
+
+        With `rescore_factor`, the index (typically fp16, SQ8 or binary codes)
+        proposes `k * rescore_factor` candidates that are reranked by exact L2
+        distance against the memory-mapped float32 vectors in `vectors_file_path`.
+        """
+        self.index_file_path = index_file_path
+        self.texts_file_path = texts_file_path
+        self.search_params = search_params
+        self.mmap = mmap
+        self.rescore_factor = rescore_factor
+        self.vectors_file_path = vectors_file_path
+        self._vectors: np.ndarray | None = None
+        self._loaded: tuple[Any, list[str], Any, Any] | None = None
+        self._version = ""
+        self._load_lock = threading.Lock()
+
+    def _load(self) -> tuple[Any, list[str], Any, Any]:
+        if self._loaded is None:
+            with self._load_lock:
+                if self._loaded is None:
+                    import faiss
+
+                    from src import config
+                    from src.index.embedding_backend import cache_namespace
+                    from src.index.embedding_cache import EmbeddingCache
+                    from src.index.index_faiss import (
+                        INDEX_FILE_PATH,
+                        TEXTS_FILE_PATH,
+                        VECTORS_FILE_PATH,
+                        get_model,
+                        load_index,
+                        load_texts,
+                        load_vectors,
+                    )
+
+                    index_file_path = self.index_file_path or INDEX_FILE_PATH
+                    stat = index_file_path.stat()
+                    self._version = f"{index_file_path}:{stat.st_mtime_ns}:{stat.st_size}"
+                    index = load_index(index_file_path, self.mmap)
+                    if self.search_params:
+                        if isinstance(index, faiss.IndexBinary):
+                            raise ValueError("search_params are not supported for binary indexes")
+                        faiss.ParameterSpace().set_index_parameters(index, self.search_params)
+                    texts = load_texts(self.texts_file_path or TEXTS_FILE_PATH)
+                    if index.ntotal != len(texts):
+                        raise ValueError(
+                            f"Index holds {index.ntotal} vectors but there are {len(texts)} texts"
+                        )
+                    if self.rescore_factor:
+                        vectors_file_path = self.vectors_file_path or VECTORS_FILE_PATH
+                        # Rescoring reads these vectors, so rewriting them changes the results
+                        stat = vectors_file_path.stat()
+                        self._version += f";{vectors_file_path}:{stat.st_mtime_ns}:{stat.st_size}"
+                        self._vectors = load_vectors(vectors_file_path)
+                        if len(self._vectors) != index.ntotal:
+                            raise ValueError(
+                                f"Index holds {index.ntotal} vectors but there are "
+                                f"{len(self._vectors)} full-precision vectors"
+                            )
+                    model = get_model()
+                    cache = EmbeddingCache(
+                        index.d,
+                        cache_namespace(config.EMBEDDING_MODEL_NAME, config.EMBEDDING_BACKEND),
+                    )
+                    self._loaded = (index, texts, model, cache)
+                    logger.info(f"Loaded FAISS index with {index.ntotal} vectors")
+        return self._loaded
+
+    def warmup(self):
+        self._load()
+
+    def fingerprint(self) -> str:
+        self._load()
+        return json.dumps(
+            [
+                "faiss",
+                self._version,
+                config.EMBEDDING_MODEL_NAME,
+                config.EMBEDDING_BACKEND,
+                self.search_params,
+                self.rescore_factor,
+            ]
+        )
+
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]:
+        return self.retrieve_many([query], k)[0]
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        from src.index.index_faiss import search
+
+        index, texts, model, cache = self._load()
+        query_vectors = cache.encode(
+            queries, lambda batch: model.encode(batch, convert_to_numpy=True)
+        )
+        distances, ids = search(
+            index, query_vectors, k, self._vectors, self.rescore_factor or 1
+        )
+        return [
+            [
+                RetrievedChunk(texts[i], float(distance), int(i))
+                for distance, i in zip(row_distances, row_ids)
+                if i >= 0
+            ]
+            for row_distances, row_ids in zip(distances, ids)
+        ]
+
+
+@cache
+def get_token_counter(model_name: str = config.EMBEDDING_MODEL_NAME) -> Callable[[str], int]:
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _pack(pieces: list[str], counts: list[int], max_tokens: int, sep: str) -> list[str]:
+    packed: list[str] = []
+    current: list[str] = []
+    current_tokens = 0
+    for piece, tokens in zip(pieces, counts):
+        if current and current_tokens + tokens > max_tokens:
+            packed.append(sep.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        packed.append(sep.join(current))
+    return packed
+
+
+def split_segments(
+    text: str,
+    max_tokens: int = MAX_SEGMENT_TOKENS,
+    count_tokens: Callable[[str], int] | None = None,
+) -> list[str]:
+    """
+    Split `text` into segments of at most `max_tokens` tokens, packing whole lines
+    together and only breaking a line between words when it is too long by itself.
+    """
+    count_tokens = count_tokens or get_token_counter()
+    lines: list[str] = []
+    line_counts: list[int] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        tokens = count_tokens(line)
+        if tokens <= max_tokens:
+            lines.append(line)
+            line_counts.append(tokens)
+            continue
+        words = line.split()
+        for piece in _pack(words, [count_tokens(word) for word in words], max_tokens, " "):
+            lines.append(piece)
+            line_counts.append(count_tokens(piece))
+    return _pack(lines, line_counts, max_tokens, "\n")
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[RetrievedChunk]], k: int, rrf_k: int = RRF_K
+) -> list[RetrievedChunk]:
+    """
+    Merge several rankings, scoring each chunk by the sum of 1 / (rrf_k + rank)
+    over the rankings it appears in. Chunks are matched by chunk_id, or by text
+    when there is none. The closest distance seen for a chunk is kept.
+    """
+    scores: dict[Any, float] = {}
+    best: dict[Any, RetrievedChunk] = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            key = chunk.chunk_id if chunk.chunk_id is not None else chunk.text
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            if key not in best or chunk.distance < best[key].distance:
+                best[key] = chunk
+    fused = sorted(scores, key=scores.__getitem__, reverse=True)[:k]
+    return [
+        RetrievedChunk(best[key].text, best[key].distance, best[key].chunk_id, scores[key])
+        for key in fused
+    ]
+
+
+def linear_fusion(
+    vector_ranking: list[RetrievedChunk],
+    fts_ranking: list[RetrievedChunk],
+    k: int,
+    vector_weight: float = VECTOR_WEIGHT,
+) -> list[RetrievedChunk]:
+    """
+    Merge a vector and a BM25 ranking by a weighted sum of their scores, each
+    min-max normalized to [0, 1] with distances flipped so that higher is better.
+    A chunk missing from one ranking scores 0 there.
+    """
+
+    def normalized(values: list[float]) -> list[float]:
+        low, high = min(values, default=0.0), max(values, default=0.0)
+        return [1.0 if high == low else (v - low) / (high - low) for v in values]
+
+    vector_scores = normalized([-chunk.distance for chunk in vector_ranking])
+    fts_scores = normalized([chunk.score or 0.0 for chunk in fts_ranking])
+    scores: dict[Any, float] = {}
+    chunks: dict[Any, RetrievedChunk] = {}
+    for ranking, ranking_scores, weight in (
+        (vector_ranking, vector_scores, vector_weight),
+        (fts_ranking, fts_scores, 1.0 - vector_weight),
+    ):
+        for chunk, score in zip(ranking, ranking_scores):
+            key = chunk.chunk_id if chunk.chunk_id is not None else chunk.text
+            scores[key] = scores.get(key, 0.0) + weight * score
+            # Vector hits come first, so their distance is the one kept
+            chunks.setdefault(key, chunk)
+    fused = sorted(scores, key=scores.__getitem__, reverse=True)[:k]
+    return [
+        RetrievedChunk(chunks[key].text, chunks[key].distance, chunks[key].chunk_id, scores[key])
+        for key in fused
+    ]
+
+
+class SegmentedRetriever:
+    def __init__(
+        self,
+        retriever: Retriever,
+        max_tokens: int = MAX_SEGMENT_TOKENS,
+        rrf_k: int = RRF_K,
+        count_tokens: Callable[[str], int] | None = None,
+    ):
+        """
+        Cover queries longer than the embedding model's window: the query is split into
+        token-bounded segments, all segments are retrieved for in one batched call, and
+        the per-segment rankings are merged with reciprocal rank fusion.
+        """
+        self.retriever = retriever
+        self.max_tokens = max_tokens
+        self.rrf_k = rrf_k
+        self._count_tokens = count_tokens
+
+    @property
+    def count_tokens(self) -> Callable[[str], int]:
+        if self._count_tokens is None:
+            self._count_tokens = get_token_counter()
+        return self._count_tokens
+
+    def warmup(self):
+        self.count_tokens
+        self.retriever.warmup()
+
+    def fingerprint(self) -> str:
+        return json.dumps(["segmented", self.max_tokens, self.rrf_k, self.retriever.fingerprint()])
+
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]:
+        return self.retrieve_many([query], k)[0]
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        # Segments of every query share one embedding and search call
+        segments = [
+            split_segments(query, self.max_tokens, self.count_tokens) or [query]
+            for query in queries
+        ]
+        rankings = self.retriever.retrieve_many([s for group in segments for s in group], k)
+        results = []
+        start = 0
+        for group in segments:
+            query_rankings = rankings[start : start + len(group)]
+            start += len(group)
+            if len(query_rankings) == 1:
+                results.append(query_rankings[0])
+            else:
+                logger.debug(f"Fusing results for {len(group)} query segments")
+                results.append(reciprocal_rank_fusion(query_rankings, k, self.rrf_k))
+        return results
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from src.chat.base_chat import BaseChat
+from src.chat.context import ContextPacker
+from src.chat.llm import AsyncRateLimiter, strip_stream
+from src.chat.rag_chat import RAGChat
+from src.chat.response_cache import ResponseCache
+from src.chat.retrievers import RetrievedChunk
+
+
+class StubOpenAI(ThreadingHTTPServer):
+    """
+    OpenAI-compatible chat completions endpoint that echoes the last user message.
+    The first `fail_first` requests get a 429.
+    """
+
+    def __init__(self, fail_first: int = 0, delay: float = 0.05):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.fail_first = fail_first
+        self.delay = delay
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubOpenAI
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            if server.requests <= server.fail_first:
+                self._reply(429, {"error": {"message": "Rate limit", "type": "rate_limit"}})
+                return
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        report = body["messages"][-1]["content"].split("###")[1].strip()
+        if body.get("stream"):
+            self._stream(body["model"], f"Summary of {report}")
+            return
+        self._reply(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": f"Summary of {report}"},
+                    }
+                ],
+            },
+        )
+
+    def _stream(self, model: str, content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0, "model": model}
+        for i, word in enumerate(content.split(" ")):
+            delta = {"content": word if i == 0 else f" {word}"}
+            chunk = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        usage = {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13}
+        self.wfile.write(f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _reply(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stub_server(monkeypatch: pytest.MonkeyPatch):
+    server = StubOpenAI(fail_first=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setattr("src.chat.llm.RETRY_BASE_DELAY", 0.01)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_generate_many_retries_and_limits_concurrency(stub_server: StubOpenAI, tmp_path: Path):
+    chat = BaseChat(ResponseCache(tmp_path / "llm.sqlite", mode="bypass"), max_concurrency=3)
+    reports = [f"report {i}" for i in range(8)]
+    answers = chat.generate_many(reports)
+    assert answers == [f"Summary of {report}" for report in reports]
+    assert stub_server.requests == 8 + 2
+    assert 1 < stub_server.max_in_flight <= 3
+
+
+def test_generate_many_serves_repeats_from_the_cache(stub_server: StubOpenAI, tmp_path: Path):
+    cache = ResponseCache(tmp_path / "llm.sqlite")
+    chat = BaseChat(cache)
+    chat.generate_many(["report a", "report b"])
+    requests = stub_server.requests
+    assert chat.generate_many(["report b", "report a"]) == ["Summary of report b", "Summary of report a"]
+    assert stub_server.requests == requests
+    assert cache.hits == 2
+
+
+def test_stream_yields_deltas_and_caches_the_completion(stub_server: StubOpenAI, tmp_path: Path):
+    stub_server.fail_first = 0
+    cache = ResponseCache(tmp_path / "llm.sqlite")
+    chat = BaseChat(cache)
+    deltas = list(chat.stream("report s"))
+    assert deltas == ["Summary", " of", " report", " s"]
+    assert chat.generate("report s") == "Summary of report s"
+    assert stub_server.requests == 1
+    assert list(chat.stream("report s")) == ["Summary of report s"]
+
+
+def test_strip_stream_joins_up_to_the_stripped_text():
+    deltas = ["\n", " Summary", " of", " ", "report", " \n", "\n"]
+    stripped = list(strip_stream(deltas))
+    assert stripped == ["Summary", " of", " report"]
+    assert "".join(stripped) == "".join(deltas).strip()
+    assert list(strip_stream([" ", "\n"])) == []
+
+
+class StaticRetriever:
+    def warmup(self):
+        pass
+
+    def fingerprint(self) -> str:
+        return "static"
+
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]:
+        return [RetrievedChunk(f"guideline for {query}", 0.0, 0)]
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        return [self.retrieve(query, k) for query in queries]
+
+
+def test_rag_generate_many_returns_answers_with_context(stub_server: StubOpenAI, tmp_path: Path):
+    chat = RAGChat(
+        retriever=StaticRetriever(),
+        segment_tokens=None,
+        response_cache=ResponseCache(tmp_path / "llm.sqlite", mode="bypass"),
+        context_packer=ContextPacker(count_tokens=lambda text: len(text.split())),
+    )
+    results = chat.generate_many(["report 1", "report 2"])
+    assert results == [
+        ("Summary of report 1", ["guideline for report 1"]),
+        ("Summary of report 2", ["guideline for report 2"]),
+    ]
+
+
+def test_chats_sharing_a_rate_limiter_stay_under_its_rpm(stub_server: StubOpenAI, tmp_path: Path):
+    stub_server.fail_first = 0
+    requests_per_minute = 240  # 4 requests per second
+    rate_limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute=1e9)
+    cache = ResponseCache(tmp_path / "llm.sqlite", mode="bypass")
+    base_chat = BaseChat(cache, rate_limiter=rate_limiter)
+    rag_chat = RAGChat(
+        retriever=StaticRetriever(),
+        segment_tokens=None,
+        response_cache=cache,
+        pack_context=False,
+        rate_limiter=rate_limiter,
+    )
+
+    async def run() -> float:
+        # Empty the request bucket, so every request has to wait for a refill
+        for _ in range(requests_per_minute):
+            await rate_limiter.acquire()
+        start = time.perf_counter()
+        await asyncio.gather(
+            base_chat.agenerate_many([f"base report {i}" for i in range(3)]),
+            rag_chat.agenerate_many([f"rag report {i}" for i in range(3)]),
+        )
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    assert stub_server.requests == 6
+    # Separate limiters would each allow 4 requests per second; one allows 4 in total
+    assert elapsed >= 6 / 4 * 0.95
@@ -0,0 +1,74 @@
+from dataclasses import replace
+
+from src.chat.context import ContextPacker, drop_duplicates, merge_adjacent
+from src.chat.retrievers import RetrievedChunk
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def test_merge_adjacent_joins_consecutive_chunks_without_the_overlap():
+    chunks = [
+        RetrievedChunk("stage II disease is treated", 0.3, 5),
+        RetrievedChunk("unrelated", 0.4, 9),
+        RetrievedChunk("Adjuvant therapy for stage II disease", 0.2, 4),
+    ]
+    merged = merge_adjacent(chunks, overlap=len("stage II disease"))
+    assert [chunk.chunk_id for chunk in merged] == [4, 9]
+    assert merged[0].text == "Adjuvant therapy for stage II disease is treated"
+    assert merged[0].distance == 0.2
+
+
+def test_merge_adjacent_keeps_coincidental_overlaps():
+    pairs = [
+        ("Treatment options include", "endocrine therapy"),
+        ("See page 12", "2 for staging"),
+        ("Adjuvant options", "surgery first"),
+    ]
+    for first, second in pairs:
+        chunks = [RetrievedChunk(first, 0.1, 1), RetrievedChunk(second, 0.2, 2)]
+        for overlap in (0, 1, 5):
+            assert merge_adjacent(chunks, overlap)[0].text == f"{first}\n{second}"
+
+
+def test_drop_duplicates_keeps_the_better_ranked_copy():
+    text = "HER2 positive tumors receive trastuzumab based therapy"
+    chunks = [
+        RetrievedChunk(text, 0.1, 1),
+        RetrievedChunk("Staging of colon cancer follows TNM", 0.2, 7),
+        RetrievedChunk(text + " too", 0.3, 12),
+    ]
+    assert [chunk.chunk_id for chunk in drop_duplicates(chunks, 0.7)] == [1, 7]
+
+
+def test_pack_respects_budget_and_distance():
+    chunks = [
+        RetrievedChunk("one two three four five six", 0.1, 1),
+        RetrievedChunk("a b c d e f g h i j k l", 0.2, 10),
+        RetrievedChunk("far away chunk", 5.0, 20),
+        RetrievedChunk("bm25 only hit", float("inf"), 30),
+    ]
+    packer = ContextPacker(
+        token_budget=20, max_distance=1.0, max_distance_ratio=None, count_tokens=count_words
+    )
+    packed = packer.pack(chunks, "gpt-test")
+    # Doc tags add 3 words per chunk, so the 12-word chunk no longer fits
+    assert [chunk.chunk_id for chunk in packed] == [1, 30]
+
+
+def test_default_pack_drops_chunks_far_behind_the_closest_one():
+    chunks = [
+        RetrievedChunk("reranked first", 0.85, 1),
+        RetrievedChunk("closest", 0.6, 10),
+        RetrievedChunk("too far", 0.95, 20),
+        RetrievedChunk("bm25 only hit", float("inf"), 30),
+    ]
+    packer = ContextPacker(count_tokens=count_words)
+    # 0.85 is within 1.5x of the closest 0.6, 0.95 is not
+    assert [chunk.chunk_id for chunk in packer.pack(chunks, "gpt-test")] == [1, 10, 30]
+    # Scaling every distance keeps the same chunks
+    scaled = [replace(chunk, distance=chunk.distance * 100) for chunk in chunks]
+    assert [chunk.chunk_id for chunk in packer.pack(scaled, "gpt-test")] == [1, 10, 30]
+    packer = ContextPacker(max_distance_ratio=None, count_tokens=count_words)
+    assert len(packer.pack(chunks, "gpt-test")) == 4
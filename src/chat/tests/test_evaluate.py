@@ -0,0 +1,88 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("deepeval")
+
+from evaluate import load_checkpoint, run_evaluation  # noqa: E402
+
+
+class FakeMetric:
+    __name__ = "Fake"
+    threshold = 0.5
+
+    def __init__(self, fail_on: set[str]):
+        self.fail_on = fail_on
+        self.score = None
+        self.success = None
+        self.reason = None
+
+    async def a_measure(self, test_case):
+        if test_case.actual_output in self.fail_on:
+            raise TimeoutError("judge timed out")
+        self.score = 1.0
+        self.success = True
+
+
+class RecordingChat:
+    def __init__(self, chat: str):
+        self.chat = chat
+        self.calls: list[str] = []
+
+    async def agenerate(self, report_text: str, semaphore=None):
+        self.calls.append(report_text)
+        answer = f"{self.chat} {report_text}"
+        return (answer, ["context"]) if self.chat == "rag" else answer
+
+
+def evaluate(report_paths, checkpoint_path, fail_on=frozenset()):
+    rag, base = RecordingChat("rag"), RecordingChat("base")
+    asyncio.run(
+        run_evaluation(
+            report_paths,
+            rag,  # type: ignore
+            base,  # type: ignore
+            checkpoint_path,
+            concurrency=2,
+            metrics_factory=lambda chat: [FakeMetric(set(fail_on))],
+        )
+    )
+    return {("rag", text) for text in rag.calls} | {("base", text) for text in base.calls}
+
+
+def test_rerun_evaluates_only_missing_and_errored_cases(tmp_path: Path):
+    report_paths = []
+    for i in range(5):
+        path = tmp_path / f"r{i}.txt"
+        path.write_text(f"report {i}")
+        report_paths.append(path)
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+
+    # A run stopped after three reports, with one judge call failing along the way
+    evaluate(report_paths[:3], checkpoint_path, fail_on={"base report 1"})
+    assert set(load_checkpoint(checkpoint_path)) == {
+        ("r0", "rag"), ("r0", "base"), ("r1", "rag"), ("r2", "rag"), ("r2", "base")
+    }
+    # ...then killed while writing, after an older run had checkpointed a metric error
+    errored = {
+        "report": "r3",
+        "chat": "rag",
+        "retrieval_context": ["context"],
+        "metrics_data": [{"name": "Fake", "error": "rate limited"}],
+    }
+    with open(checkpoint_path, "a") as f:
+        f.write(json.dumps(errored) + "\n")
+        f.write('{"report": "r4", "chat": "ra')
+    assert ("r3", "rag") not in load_checkpoint(checkpoint_path)
+
+    processed = evaluate(report_paths, checkpoint_path)
+    assert processed == {
+        ("base", "report 1"),
+        ("rag", "report 3"),
+        ("base", "report 3"),
+        ("rag", "report 4"),
+        ("base", "report 4"),
+    }
+    assert len(load_checkpoint(checkpoint_path)) == 10
@@ -0,0 +1,31 @@
+import pytest
+
+from src.chat.context import get_token_counter
+from src.chat.prompts import MIN_CACHED_PREFIX_TOKENS, build_rag_messages
+
+
+def test_static_prefix_layout_shares_the_system_message():
+    first = build_rag_messages("report 1", ["chunk a", "chunk b"])
+    second = build_rag_messages("report 2", ["chunk c"])
+    assert first[0] == second[0]
+    assert "chunk a" in first[1]["content"] and "report 1" in first[1]["content"]
+    assert first[1]["content"].index("chunk b") < first[1]["content"].index("report 1")
+
+
+def test_legacy_layout_puts_context_in_the_system_message():
+    messages = build_rag_messages("report 1", ["chunk a"], layout="legacy")
+    assert "chunk a" in messages[0]["content"]
+    assert "chunk a" not in messages[1]["content"]
+    with pytest.raises(ValueError):
+        build_rag_messages("report 1", [], layout="unknown")
+
+
+def test_static_prefix_is_long_enough_for_prompt_caching():
+    system_prompt = build_rag_messages("report 1", [])[0]["content"]
+    # About four characters per token in English, checked exactly below when tiktoken can load
+    assert len(system_prompt) >= 4 * MIN_CACHED_PREFIX_TOKENS
+    try:
+        count_tokens = get_token_counter("gpt-4o")
+    except Exception:
+        pytest.skip("tiktoken encoding not available offline")
+    assert count_tokens(system_prompt) >= MIN_CACHED_PREFIX_TOKENS
@@ -0,0 +1,158 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from src.chat.rag_chat import RAGChat
+from src.chat.response_cache import ResponseCache
+from src.chat.reranker import CrossEncoderReranker
+from src.chat.retrievers import RetrievedChunk
+
+
+def overlap_scores(pairs: list[tuple[str, str]]) -> list[float]:
+    return [len(set(query.split()) & set(text.split())) for query, text in pairs]
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+CHUNKS = [
+    RetrievedChunk("staging of lung cancer", 0.1, 0),
+    RetrievedChunk("breast carcinoma margin status", 0.2, 1),
+    RetrievedChunk("breast carcinoma lymph node grade", 0.3, 2),
+    RetrievedChunk("colon polyps", 0.4, 3),
+]
+
+
+def test_rerank_keeps_the_top_scored_chunks():
+    reranker = CrossEncoderReranker(batch_size=3, score_pairs=overlap_scores, count_tokens=count_words)
+    reranked = reranker.rerank("breast carcinoma lymph node", CHUNKS, 2)
+    assert [chunk.chunk_id for chunk in reranked] == [2, 1]
+    assert [chunk.score for chunk in reranked] == [4, 2]
+    assert (reranker.reranked, reranker.timeouts) == (1, 0)
+
+
+def test_rerank_falls_back_to_retrieval_order_past_the_time_budget():
+    def slow_scores(pairs: list[tuple[str, str]]) -> list[float]:
+        time.sleep(0.05)
+        return overlap_scores(pairs)
+
+    reranker = CrossEncoderReranker(
+        batch_size=1, time_budget=0.01, score_pairs=slow_scores, count_tokens=count_words
+    )
+    assert reranker.rerank("breast carcinoma lymph node", CHUNKS, 2) == CHUNKS[:2]
+    assert reranker.timeouts == 1
+
+
+def test_rerank_scores_each_report_segment_and_keeps_the_best():
+    scored: list[tuple[str, str]] = []
+
+    def recording_scores(pairs: list[tuple[str, str]]) -> list[float]:
+        scored.extend(pairs)
+        return overlap_scores(pairs)
+
+    reranker = CrossEncoderReranker(
+        segment_tokens=3, score_pairs=recording_scores, count_tokens=count_words
+    )
+    reranked = reranker.rerank("breast carcinoma\nlymph node grade", CHUNKS, 2)
+    assert {query for query, _ in scored} == {"breast carcinoma", "lymph node grade"}
+    assert len(scored) == 2 * len(CHUNKS)
+    # Chunk 2 matches both segments but scores its best one, not their sum
+    assert [chunk.chunk_id for chunk in reranked] == [2, 1]
+    assert [chunk.score for chunk in reranked] == [3, 2]
+
+
+def test_rerank_bounds_a_slow_batch_and_keeps_the_scores_so_far():
+    calls = 0
+    slow_batch_done = threading.Event()
+
+    def slowing_scores(pairs: list[tuple[str, str]]) -> list[float]:
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            time.sleep(0.5)
+            slow_batch_done.set()
+        return overlap_scores(pairs)
+
+    reranker = CrossEncoderReranker(
+        batch_size=2, time_budget=0.1, score_pairs=slowing_scores, count_tokens=count_words
+    )
+    start = time.perf_counter()
+    reranked = reranker.rerank("breast carcinoma lymph node", CHUNKS, 3)
+    assert time.perf_counter() - start < 0.3
+    # The first batch is ranked by score, the unscored rest keeps the retrieval order
+    assert [chunk.chunk_id for chunk in reranked] == [1, 0, 2]
+    assert [chunk.score for chunk in reranked] == [2, 0, CHUNKS[2].score]
+    assert (reranker.reranked, reranker.timeouts) == (0, 1)
+
+    # The next report does not wait behind the batch that is still running
+    assert not slow_batch_done.is_set()
+    reranked = reranker.rerank("breast carcinoma lymph node", CHUNKS, 3)
+    assert [chunk.chunk_id for chunk in reranked] == [2, 1, 0]
+    assert (reranker.reranked, reranker.timeouts) == (1, 1)
+    slow_batch_done.wait()
+
+
+def test_rerank_scores_only_the_pairs_that_fit_the_budget():
+    scored: list[tuple[str, str]] = []
+    pair_seconds = 0.02
+
+    def timed_scores(pairs: list[tuple[str, str]]) -> list[float]:
+        scored.extend(pairs)
+        time.sleep(pair_seconds * len(pairs))
+        return overlap_scores(pairs)
+
+    reranker = CrossEncoderReranker(
+        batch_size=1,
+        time_budget=None,
+        segment_tokens=2,
+        score_pairs=timed_scores,
+        count_tokens=count_words,
+    )
+    query = "breast carcinoma\nlymph node"
+    reranker.rerank(query, CHUNKS, 4)
+    assert len(scored) == 2 * len(CHUNKS)
+
+    # The measured 20 ms per pair leaves room for 3 of the 8 pairs: one segment, 3 chunks
+    scored.clear()
+    pair_seconds = 0
+    reranker.time_budget = 0.07
+    reranked = reranker.rerank(query, CHUNKS, 4)
+    assert scored == [("breast carcinoma", chunk.text) for chunk in CHUNKS[:3]]
+    assert [chunk.chunk_id for chunk in reranked] == [1, 2, 0, 3]
+    assert (reranker.reranked, reranker.timeouts) == (2, 0)
+
+
+class RecordingRetriever:
+    def __init__(self):
+        self.ks: list[int] = []
+
+    def warmup(self):
+        pass
+
+    def fingerprint(self) -> str:
+        return "recording"
+
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]:
+        self.ks.append(k)
+        return CHUNKS[:k]
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        return [self.retrieve(query, k) for query in queries]
+
+
+def test_rag_chat_overfetches_and_reranks(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    retriever = RecordingRetriever()
+    chat = RAGChat(
+        k=1,
+        retriever=retriever,
+        segment_tokens=None,
+        pack_context=False,
+        response_cache=ResponseCache(tmp_path / "llm.sqlite"),
+        reranker=CrossEncoderReranker(score_pairs=overlap_scores, count_tokens=count_words),
+    )
+    assert chat._retrieve("breast carcinoma lymph node", "gpt-test") == [CHUNKS[2].text]
+    assert retriever.ks == [4]
@@ -0,0 +1,99 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion
+from openai.types.completion_usage import CompletionUsage
+
+from src.chat.response_cache import ResponseCache
+
+MESSAGES = [{"role": "user", "content": "Summarize this report"}]
+
+
+def make_completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-test",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        }
+    )
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs) -> ChatCompletion:
+        self.calls += 1
+        return make_completion(f"answer {self.calls}")
+
+
+def complete(cache: ResponseCache, client: FakeClient, temperature: float = 0.7) -> str:
+    completion = cache.create(
+        client, model="gpt-test", messages=MESSAGES, temperature=temperature, max_tokens=500  # type: ignore
+    )
+    return completion.choices[0].message.content or ""
+
+
+def test_modes_and_counters(tmp_path: Path):
+    client = FakeClient()
+    cache = ResponseCache(tmp_path / "llm.sqlite")
+    assert complete(cache, client) == "answer 1"
+    assert complete(cache, client) == "answer 1"
+    assert complete(cache, client, temperature=0.0) == "answer 2"
+    assert (cache.hits, cache.misses, client.calls) == (1, 2, 2)
+
+    cache.mode = "write_through"
+    assert complete(cache, client) == "answer 3"
+    cache.mode = "bypass"
+    assert complete(cache, client) == "answer 4"
+
+    # The refreshed entry persists across instances
+    cache = ResponseCache(tmp_path / "llm.sqlite")
+    assert complete(cache, client) == "answer 3"
+    assert len(cache) == 2
+
+
+def test_evicts_least_recently_used(tmp_path: Path):
+    size = len(make_completion("answer 1").model_dump_json())
+    cache = ResponseCache(tmp_path / "llm.sqlite", max_bytes=2 * size)
+    client = FakeClient()
+    complete(cache, client, temperature=0.1)
+    complete(cache, client, temperature=0.2)
+    complete(cache, client, temperature=0.1)  # Hit, so 0.2 is now the least recently used
+    complete(cache, client, temperature=0.3)
+    assert len(cache) == 2
+    assert complete(cache, client, temperature=0.1) == "answer 1"
+    assert complete(cache, client, temperature=0.2) == "answer 4"
+
+
+class CachingProviderClient(FakeClient):
+    def create(self, **kwargs) -> ChatCompletion:
+        completion = super().create(**kwargs)
+        completion.usage = CompletionUsage.model_validate(
+            {
+                "prompt_tokens": 2000,
+                "completion_tokens": 100,
+                "total_tokens": 2100,
+                "prompt_tokens_details": {"cached_tokens": 1536},
+            }
+        )
+        return completion
+
+
+def test_usage_counts_cached_prompt_tokens(tmp_path: Path):
+    cache = ResponseCache(tmp_path / "llm.sqlite")
+    complete(cache, CachingProviderClient())
+    complete(cache, CachingProviderClient())  # Served from the cache, so not counted again
+    usage = cache.usage
+    assert (usage.requests, usage.prompt_tokens, usage.cached_tokens) == (1, 2000, 1536)
+    assert usage.cached_fraction == 0.768
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+from src.chat.retrieval_cache import CachedRetriever, RetrievalCache
+from src.chat.retrievers import RetrievedChunk
+
+
+class CountingRetriever:
+    def __init__(self, version: str = "v1"):
+        self.version = version
+        self.calls: list[list[str]] = []
+
+    def warmup(self):
+        pass
+
+    def fingerprint(self) -> str:
+        return self.version
+
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]:
+        return self.retrieve_many([query], k)[0]
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        self.calls.append(queries)
+        return [[RetrievedChunk(f"{query}:{self.version}", float("inf"), 1, 2.5)] for query in queries]
+
+
+def test_cached_retriever_reuses_results_until_the_index_changes():
+    inner = CountingRetriever()
+    retriever = CachedRetriever(inner, RetrievalCache(capacity=2))
+    first = retriever.retrieve("report", 5)
+    assert retriever.retrieve("report", 5) == first
+    retriever.retrieve_many(["report", "other", "third"], 5)
+    assert inner.calls == [["report"], ["other", "third"]]
+
+    retriever.retrieve("report", 3)  # A different k is a different entry
+    inner.version = "v2"  # e.g. the table was rebuilt
+    assert retriever.retrieve("other", 5)[0].text == "other:v2"
+    assert len(inner.calls) == 4
+
+
+def test_disk_tier_is_shared_across_instances(tmp_path: Path):
+    inner = CountingRetriever()
+    CachedRetriever(inner, RetrievalCache(cache_dir=tmp_path)).retrieve("report", 5)
+    cache = RetrievalCache(cache_dir=tmp_path)
+    chunks = CachedRetriever(inner, cache).retrieve("report", 5)
+    assert chunks == [RetrievedChunk("report:v1", float("inf"), 1, 2.5)]
+    assert len(inner.calls) == 1
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path: Path):
+    cache = RetrievalCache(capacity=0, cache_dir=tmp_path, max_disk_bytes=150)
+    for key in ("aa", "bb", "cc"):
+        cache.put(key, [RetrievedChunk("x" * 20, 0.0)])
+    assert cache.get("aa") is None
+    assert cache.get("cc") is not None
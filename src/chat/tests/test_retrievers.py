@@ -0,0 +1,168 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.chat.retrievers import (
+    FaissRetriever,
+    LanceDBRetriever,
+    RetrievedChunk,
+    SegmentedRetriever,
+    linear_fusion,
+    reciprocal_rank_fusion,
+    split_segments,
+)
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def test_split_segments_packs_lines_and_splits_long_ones():
+    text = "one two\nthree four five\n\n" + " ".join(f"w{i}" for i in range(7)) + "\nsix"
+    segments = split_segments(text, max_tokens=5, count_tokens=count_words)
+    assert segments == ["one two\nthree four five", "w0 w1 w2 w3 w4", "w5 w6\nsix"]
+    assert all(count_words(segment) <= 5 for segment in segments)
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    a = RetrievedChunk("a", 0.5, 1)
+    b = RetrievedChunk("b", 0.2, 2)
+    c = RetrievedChunk("c", 0.1, 3)
+    fused = reciprocal_rank_fusion([[a, b], [c, RetrievedChunk("b", 0.3, 2)]], k=2)
+    assert [chunk.chunk_id for chunk in fused] == [2, 1]
+    assert fused[0].distance == 0.2
+    assert fused[0].score is not None and fused[0].score > fused[1].score  # type: ignore
+
+
+def test_linear_fusion_weights_vector_and_bm25_scores():
+    vector = [RetrievedChunk("a", 0.1, 1), RetrievedChunk("b", 0.3, 2)]
+    fts = [RetrievedChunk("c", float("inf"), 3, 9.0), RetrievedChunk("b", float("inf"), 2, 1.0)]
+    fused = linear_fusion(vector, fts, k=3, vector_weight=0.7)
+    assert [chunk.chunk_id for chunk in fused] == [1, 3, 2]
+    assert fused[2].distance == 0.3
+    fused = linear_fusion(vector, fts, k=1, vector_weight=0.2)
+    assert [chunk.chunk_id for chunk in fused] == [3]
+
+
+class RecordingRetriever:
+    def __init__(self):
+        self.calls: list[list[str]] = []
+
+    def warmup(self):
+        pass
+
+    def retrieve(self, query: str, k: int) -> list[RetrievedChunk]:
+        return self.retrieve_many([query], k)[0]
+
+    def retrieve_many(self, queries: list[str], k: int) -> list[list[RetrievedChunk]]:
+        self.calls.append(queries)
+        return [[RetrievedChunk(query, 0.0, hash(query))] for query in queries]
+
+
+def test_segmented_retriever_searches_all_segments_in_one_call():
+    inner = RecordingRetriever()
+    retriever = SegmentedRetriever(inner, max_tokens=2, count_tokens=count_words)
+    results = retriever.retrieve_many(["a b\nc d\ne", "short"], k=10)
+    assert inner.calls == [["a b", "c d", "e", "short"]]
+    assert {chunk.text for chunk in results[0]} == {"a b", "c d", "e"}
+    assert [chunk.text for chunk in results[1]] == ["short"]
+
+
+def test_faiss_fingerprint_tracks_the_rescoring_vectors(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    from src.index.index_faiss import index_faiss, save_texts, save_vectors
+
+    monkeypatch.setattr("src.index.index_faiss.get_model", lambda: None)
+    monkeypatch.setattr("src.index.embedding_cache.EmbeddingCache", lambda *args: None)
+    vectors = np.random.default_rng(0).standard_normal((20, 8)).astype(np.float32)
+    index_faiss(vectors, tmp_path / "faiss", "SQ8")
+    save_texts([f"chunk {i}" for i in range(20)], tmp_path / "texts.json")
+    save_vectors(vectors, tmp_path / "vectors.npy")
+
+    def fingerprints() -> tuple[str, str]:
+        paths = dict(
+            index_file_path=tmp_path / "faiss",
+            texts_file_path=tmp_path / "texts.json",
+            vectors_file_path=tmp_path / "vectors.npy",
+        )
+        return (
+            FaissRetriever(**paths).fingerprint(),
+            FaissRetriever(**paths, rescore_factor=4).fingerprint(),
+        )
+
+    plain, rescored = fingerprints()
+    save_vectors(vectors[::-1].copy(), tmp_path / "vectors.npy")
+    new_plain, new_rescored = fingerprints()
+    assert new_plain == plain
+    assert new_rescored != rescored
+
+
+class StubModel:
+    name = "stub-model"
+    backend = "torch"
+
+
+def test_lancedb_fingerprint_follows_writes_to_the_table(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    import lancedb
+    import pyarrow as pa
+
+    monkeypatch.setattr("src.index.index_lancedb.DB_URI", tmp_path)
+    monkeypatch.setattr("src.index.index_lancedb.get_model", StubModel)
+    rows = [{"chunk_id": i, "text": f"chunk {i}", "vector": [float(i)] * 4} for i in range(3)]
+    schema = pa.schema(
+        [
+            pa.field("chunk_id", pa.int64()),
+            pa.field("text", pa.string()),
+            pa.field("vector", pa.list_(pa.float32(), 4)),
+        ]
+    )
+    table = lancedb.connect(tmp_path).create_table("docs", rows, schema=schema)
+    retriever = LanceDBRetriever(version_check_interval=60)
+    before = retriever.fingerprint()
+
+    table.add([{"chunk_id": 3, "text": "chunk 3", "vector": [3.0] * 4}])
+    assert retriever.fingerprint() == before  # Not checked again yet
+    retriever.version_check_interval = 0
+    after = retriever.fingerprint()
+    assert after != before
+    assert retriever.table.count_rows() == 4
+    assert retriever.fingerprint() == after
+
+
+def test_lancedb_fingerprint_follows_a_recreated_table(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    import lancedb
+    import pyarrow as pa
+
+    monkeypatch.setattr("src.index.index_lancedb.DB_URI", tmp_path)
+    monkeypatch.setattr("src.index.index_lancedb.get_model", StubModel)
+    schema = pa.schema(
+        [
+            pa.field("chunk_id", pa.int64()),
+            pa.field("text", pa.string()),
+            pa.field("vector", pa.list_(pa.float32(), 4)),
+        ]
+    )
+    db = lancedb.connect(tmp_path)
+    rows = [{"chunk_id": i, "text": f"chunk {i}", "vector": [float(i)] * 4} for i in range(3)]
+    db.create_table("docs", rows, schema=schema)
+    retriever = LanceDBRetriever(version_check_interval=0)
+    before = retriever.fingerprint()
+
+    # What `--overwrite` does: the version number restarts in a new table
+    db.drop_table("docs")
+    db.create_table("docs", rows[:2], schema=schema)
+    after = retriever.fingerprint()
+    assert after != before
+    assert retriever.table.count_rows() == 2
+    assert retriever.fingerprint() == after
+
+    db.drop_table("docs")
+    missing = retriever.fingerprint()
+    assert missing not in (before, after)
+    assert retriever.fingerprint() != missing
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 ROOT_DIR = Path(__file__).parents[1]
@@ -5,4 +6,6 @@ DATA_DIR = ROOT_DIR / "data"
 RAW_DIR = DATA_DIR / "raw"
 REPORT_DIR = ROOT_DIR / "reports"
 PROCESSED_DIR = DATA_DIR / "processed"
-EMBEDDING_MODEL_NAME = "NeuML/pubmedbert-base-embeddings"
\ No newline at end of file
+EMBEDDING_MODEL_NAME = "NeuML/pubmedbert-base-embeddings"
+# torch, onnx or onnx-int8; see src/index/embedding_backend.py
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
@@ -1,53 +1,143 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version
 from pathlib import Path
+from typing import Iterator
 
 import pymupdf
 import pymupdf4llm
 from unstructured.chunking.basic import chunk_elements
+from unstructured.documents.elements import Element
 from unstructured.partition.pdf import partition_pdf
+from unstructured.staging.base import elements_from_json, elements_to_json
+
+from src import config
+from src.utils import atomic_open, sha256_file, sha256_text
+
+PARTITION_CACHE_DIR = config.PROCESSED_DIR / "partition_cache"
+
+
+def get_elements(
+    pdf_file_path: Path,
+    cache_dir: Path | None = PARTITION_CACHE_DIR,
+    **partition_kwargs,
+) -> list[Element]:
+    """
+    Partition a PDF with unstructured, reusing serialized elements from `cache_dir`
+    when the same PDF was already partitioned with the same settings.
+    """
+    if cache_dir is None:
+        return partition_pdf(str(pdf_file_path), **partition_kwargs)
+
+    # The unstructured version is part of the key since it changes partition output
+    settings = json.dumps(
+        {"unstructured": version("unstructured"), **partition_kwargs},
+        sort_keys=True,
+        default=str,
+    )
+    key = sha256_text(f"{sha256_file(pdf_file_path)}:{settings}")
+    cache_path = cache_dir / f"{key}.json"
+    if cache_path.exists():
+        print(f"Loading cached elements from {cache_path}")
+        return elements_from_json(filename=str(cache_path))
+
+    elements = partition_pdf(str(pdf_file_path), **partition_kwargs)
+    with atomic_open(cache_path, "w") as f:
+        f.write(elements_to_json(elements) or "[]")
+    print(f"Cached elements at {cache_path}")
+    return elements
 
 
 def get_chunks(
     pdf_file_path: Path,
     max_characters: int = 500,
     overlap: int = 0,
+    cache_dir: Path | None = PARTITION_CACHE_DIR,
+    **partition_kwargs,
 ) -> list[str]:
     print(f"Processing {pdf_file_path}...")
 
-    elements = partition_pdf(str(pdf_file_path))
+    elements = get_elements(pdf_file_path, cache_dir, **partition_kwargs)
     print(f"Number of elements: {len(elements)}")
 
     chunks = chunk_elements(elements, max_characters=max_characters, overlap=overlap)
-    print(f"Number of chunks: {len(elements)}")
+    print(f"Number of chunks: {len(chunks)}")
 
     return [c.text for c in chunks]
 
 
-def process_page(args: tuple[Path, int]) -> tuple[str, int]:
-    input_pdf_path, page_id = args
-    nccn_doc = pymupdf.open(input_pdf_path)
-    md_text = pymupdf4llm.to_markdown(nccn_doc, pages=[page_id])
-    nccn_doc.close()
-    return md_text, page_id
+# Document opened once per worker process by `_init_worker`
+_worker_doc: pymupdf.Document | None = None
+
+
+def _init_worker(pdf_file_path: Path):
+    global _worker_doc
+    _worker_doc = pymupdf.open(pdf_file_path)
+
+
+def process_page_range(page_range: tuple[int, int]) -> list[str]:
+    if _worker_doc is None:
+        raise RuntimeError("Worker document is not initialized")
+    start, stop = page_range
+    page_chunks = pymupdf4llm.to_markdown(
+        _worker_doc, pages=list(range(start, stop)), page_chunks=True
+    )
+    return [page_chunk["text"] for page_chunk in page_chunks]
+
+
+def get_page_ranges(page_count: int, num_ranges: int) -> list[tuple[int, int]]:
+    """
+    Split `page_count` pages into at most `num_ranges` contiguous, near-equal ranges.
+    """
+    if page_count == 0:
+        return []
+    num_ranges = max(1, min(num_ranges, page_count))
+    size, remainder = divmod(page_count, num_ranges)
+    ranges = []
+    start = 0
+    for i in range(num_ranges):
+        stop = start + size + (1 if i < remainder else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def iter_md_pages(
+    pdf_file_path: Path, max_workers: int = 8, ranges_per_worker: int = 4
+) -> Iterator[tuple[int, str]]:
+    """
+    Convert every page to markdown across a process pool, yielding `(page_id, md_text)`
+    in page order as soon as each range finishes. Each worker opens the PDF once and
+    receives contiguous page ranges; several ranges per worker keep the pool
+    balanced and let progress stream back early.
+    """
+    with pymupdf.open(pdf_file_path) as nccn_doc:
+        page_count = nccn_doc.page_count
+    page_ranges = get_page_ranges(page_count, max_workers * ranges_per_worker)
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(pdf_file_path,)
+    ) as executor:
+        # map yields results in submission order, so pages come back in order
+        for (start, _), md_texts in zip(
+            page_ranges, executor.map(process_page_range, page_ranges)
+        ):
+            for page_id, md_text in enumerate(md_texts, start):
+                print(f"Processed page {page_id + 1} of {page_count}.")
+                yield page_id, md_text
 
 
 def get_md_pages(
     pdf_file_path: Path, output_dir_path: Path, max_workers: int = 8
 ) -> list[str]:
+    """
+    Convert every page to markdown and also write it to `output_dir_path` as
+    `<page_id>.txt`.
+    """
     output_dir_path.mkdir(parents=True, exist_ok=True)
     print(f"Processing {pdf_file_path}...")
-    nccn_doc = pymupdf.open(pdf_file_path)
-    page_count = nccn_doc.page_count
-    nccn_doc.close()
-
-    md_pages = [None] * page_count
-    args = [(pdf_file_path, page_id) for page_id in range(page_count)]
-
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_page, arg): arg[1] for arg in args}
-        for future in as_completed(futures):
-            md_text, page_id = future.result()
-            print(f"Processed page {page_id + 1} of {page_count}.")
-            md_pages[page_id] = md_text
-
+    md_pages = []
+    for page_id, md_text in iter_md_pages(pdf_file_path, max_workers):
+        (output_dir_path / f"{page_id}.txt").write_text(md_text)
+        md_pages.append(md_text)
     return md_pages
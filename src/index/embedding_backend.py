@@ -0,0 +1,105 @@
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from src import config
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# torch: PyTorch fp32; onnx: ONNX Runtime fp32; onnx-int8: ONNX Runtime with
+# dynamically quantized int8 weights
+BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_DIR = config.PROCESSED_DIR / "onnx_models"  # Exported and quantized models
+QUANTIZATION_CONFIG = "avx2"  # One of arm64, avx2, avx512, avx512_vnni
+MIN_COSINE = 0.99  # Lowest acceptable cosine similarity to the fp32 embeddings
+
+
+def load_sentence_transformer(
+    model_name: str = config.EMBEDDING_MODEL_NAME,
+    device: str | None = None,
+    backend: str = config.EMBEDDING_BACKEND,
+    num_threads: int | None = None,
+) -> "SentenceTransformer":
+    """
+    Load `model_name` with one of `BACKENDS`. The ONNX backends run on the CPU
+    from a local copy under `ONNX_DIR`, which is exported (and quantized) from
+    the PyTorch weights the first time it is needed. `num_threads` caps the
+    intra-op threads of ONNX Runtime, or of torch for the torch backend.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+
+    if backend == "torch":
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        if device is None:
+            if torch.cuda.is_available():
+                device = "cuda"
+            elif torch.backends.mps.is_available():
+                device = "mps"
+            else:
+                device = "cpu"
+        return SentenceTransformer(model_name, device=device)
+
+    import onnxruntime
+
+    export_dir = ONNX_DIR / model_name.replace("/", "__")
+    file_name = "onnx/model.onnx"
+    if not (export_dir / file_name).exists():
+        print(f"Exporting {model_name} to ONNX in {export_dir}")
+        SentenceTransformer(model_name, device="cpu", backend="onnx").save_pretrained(
+            str(export_dir)
+        )
+    if backend == "onnx-int8":
+        suffix = f"qint8_{QUANTIZATION_CONFIG}"
+        file_name = f"onnx/model_{suffix}.onnx"
+        if not (export_dir / file_name).exists():
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+
+            print(f"Quantizing {model_name} to int8 for {QUANTIZATION_CONFIG}")
+            export_dynamic_quantized_onnx_model(
+                SentenceTransformer(str(export_dir), device="cpu", backend="onnx"),
+                QUANTIZATION_CONFIG,
+                str(export_dir),
+                file_suffix=suffix,
+            )
+
+    session_options = onnxruntime.SessionOptions()
+    if num_threads:
+        session_options.intra_op_num_threads = num_threads
+    return SentenceTransformer(
+        str(export_dir),
+        device="cpu",
+        backend="onnx",
+        model_kwargs={
+            "file_name": file_name,
+            "provider": "CPUExecutionProvider",
+            "session_options": session_options,
+        },
+    )
+
+
+def cache_namespace(model_name: str, backend: str) -> str:
+    """
+    `EmbeddingCache` namespace for a model and backend. Backends produce slightly
+    different vectors, so each gets its own cache; torch keeps the bare model name
+    that existing caches use.
+    """
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def cosine_parity(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """
+    Row-wise cosine similarity between two `(n, ndims)` embedding arrays of the
+    same texts, e.g. fp32 PyTorch and int8 ONNX.
+    """
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    if reference.shape != candidate.shape:
+        raise ValueError(f"Shape mismatch: {reference.shape} vs {candidate.shape}")
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return np.einsum("ij,ij->i", reference, candidate) / np.maximum(norms, 1e-12)
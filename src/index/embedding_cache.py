@@ -0,0 +1,198 @@
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Sequence
+
+import numpy as np
+
+from src import config
+
+CACHE_DIR = config.PROCESSED_DIR / "embedding_cache"
+CAPACITY = 200_000  # Cached embeddings per model before LRU eviction
+
+INDEX_DTYPE = np.dtype([("key", "S32"), ("last_used", "<i8")])
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by the SHA-256 of each text.
+
+    Vectors live in a memory-mapped `vectors.npy` of shape `(capacity, ndims)`;
+    `index.npy` is a memory-mapped array holding each slot's key and last-use
+    clock, so hits update the LRU order in place without rewriting any file.
+    Caches are namespaced by model name.
+
+    Several instances, in one or more processes, may share a directory: writes
+    are serialized by a file lock, and a hit only counts if the key stored in the
+    slot still matches, since another instance may have reused the slot.
+    """
+
+    def __init__(
+        self,
+        ndims: int,
+        model_name: str = config.EMBEDDING_MODEL_NAME,
+        cache_dir: Path = CACHE_DIR,
+        capacity: int = CAPACITY,
+    ):
+        self.ndims = ndims
+        self.capacity = capacity
+        self.cache_dir = cache_dir / model_name.replace("/", "__")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._lock_path = self.cache_dir / "lock"
+
+        self._vectors_path = self.cache_dir / "vectors.npy"
+        self._index_path = self.cache_dir / "index.npy"
+        if not self._open():
+            # Another process may be creating the files right now, so check again
+            # under the lock before (re)creating them
+            with self._write_lock():
+                if not self._open():
+                    self._vectors = np.lib.format.open_memmap(
+                        self._vectors_path, mode="w+", dtype=np.float32, shape=(capacity, ndims)
+                    )
+                    self._index = np.lib.format.open_memmap(
+                        self._index_path, mode="w+", dtype=INDEX_DTYPE, shape=(capacity,)
+                    )
+
+        used = np.flatnonzero(self._index["last_used"] > 0)
+        self._slots: dict[bytes, int] = {
+            bytes(key): int(slot) for key, slot in zip(self._index["key"][used], used)
+        }
+        self._clock = int(self._index["last_used"].max()) if capacity else 0
+
+    def _open(self) -> bool:
+        """
+        Map the existing cache files, returning False if they are missing, still
+        being created or laid out for a different capacity or dimension.
+        """
+        try:
+            vectors = np.load(self._vectors_path, mmap_mode="r+")
+            index = np.load(self._index_path, mmap_mode="r+")
+        except (FileNotFoundError, ValueError):
+            return False
+        if vectors.shape != (self.capacity, self.ndims) or index.shape != (self.capacity,):
+            return False
+        self._vectors = vectors
+        self._index = index
+        return True
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @contextmanager
+    def _write_lock(self):
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self, key: bytes, out: np.ndarray) -> bool:
+        """
+        Copy the cached vector for `key` into `out`. The key is checked before and
+        after the copy; writers clear it before overwriting a slot, so a slot
+        reused by another instance in the meantime is never mistaken for a hit.
+        """
+        slot = self._slots.get(key)
+        if slot is None:
+            return False
+        if bytes(self._index["key"][slot]) == key:
+            out[:] = self._vectors[slot]
+            if bytes(self._index["key"][slot]) == key:
+                self._clock += 1
+                self._index["last_used"][slot] = self._clock
+                return True
+        del self._slots[key]
+        return False
+
+    def _find(self, keys: Sequence[bytes]):
+        """
+        Add the slots of any of `keys` that other instances have stored since this
+        one was created, with one pass over the shared index.
+        """
+        stored = self._index["key"]
+        for slot in np.flatnonzero(np.isin(stored, np.array(keys, dtype=stored.dtype))):
+            self._slots[bytes(stored[slot])] = int(slot)
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        # numpy drops trailing NUL bytes when reading an S32 field back
+        return hashlib.sha256(text.encode("utf-8")).digest().rstrip(b"\x00")
+
+    def _allocate(self, count: int) -> np.ndarray:
+        """
+        Pick `count` slots for new entries: empty slots first, then the least
+        recently used ones.
+        """
+        last_used = self._index["last_used"]
+        if count >= self.capacity:
+            slots = np.arange(self.capacity)
+        else:
+            slots = np.argpartition(last_used, count - 1)[:count]
+        for slot in slots:
+            if last_used[slot] > 0:
+                self._slots.pop(bytes(self._index["key"][slot]), None)
+        return slots
+
+    def encode(
+        self,
+        texts: Sequence[str],
+        encode_fn: Callable[[list[str]], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Return embeddings for `texts` as a `(len(texts), ndims)` array, calling
+        `encode_fn` only for texts that are not cached.
+        """
+        keys = [self.key(text) for text in texts]
+        embeddings = np.empty((len(texts), self.ndims), dtype=np.float32)
+        with self._lock:
+            missing: dict[bytes, list[int]] = {}
+            for i, key in enumerate(keys):
+                if key in missing or not self._read(key, embeddings[i]):
+                    missing.setdefault(key, []).append(i)
+            if missing:
+                self._find(list(missing))
+                for key in [key for key in missing if key in self._slots]:
+                    ids = missing[key]
+                    if self._read(key, embeddings[ids[0]]):
+                        embeddings[ids] = embeddings[ids[0]]
+                        del missing[key]
+            # Repeats of a missing text are embedded once, so they count as hits
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+
+        if not missing:
+            return embeddings
+
+        computed = np.asarray(
+            encode_fn([texts[ids[0]] for ids in missing.values()]), dtype=np.float32
+        )
+        with self._lock, self._write_lock():
+            # Entries beyond capacity are returned but not cached
+            keep = min(len(missing), self.capacity)
+            slots = self._allocate(keep) if keep else []
+            # Keep the LRU clock ahead of other instances writing to the same files
+            self._clock = max(self._clock, int(self._index["last_used"].max()))
+            for j, (key, ids) in enumerate(missing.items()):
+                embeddings[ids] = computed[j]
+                if j < keep:
+                    slot = int(slots[j])
+                    self._clock += 1
+                    # Clear the key first so readers never pair it with a half-written vector
+                    self._index[slot] = (b"", 0)
+                    self._vectors[slot] = computed[j]
+                    self._index[slot] = (key, self._clock)
+                    self._slots[key] = slot
+            self.flush()
+        return embeddings
+
+    def flush(self):
+        # Vectors first, so an index entry never points at an unwritten vector
+        self._vectors.flush()
+        self._index.flush()
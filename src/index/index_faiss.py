@@ -1,27 +1,64 @@
+import json
+from functools import cache
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import faiss
 import numpy as np
-import torch
-from sentence_transformers import SentenceTransformer
 
 from src import config
+from src.utils import atomic_open
 
-from .chunking import get_chunks
+from .embedding_backend import BACKENDS, cache_namespace, load_sentence_transformer
+from .embedding_cache import EmbeddingCache
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 INDEX_FILE_PATH = config.ROOT_DIR / "faiss"
+TEXTS_FILE_PATH = config.ROOT_DIR / "faiss_texts.json"  # Chunk texts, in index order
+VECTORS_FILE_PATH = config.ROOT_DIR / "faiss_vectors.npy"  # float32 vectors, for rescoring
+# Any faiss.index_factory string, e.g. "Flat", "IVF256,Flat", "HNSW32", "IVF256,PQ48", "IVF256,SQ8",
+# or a faiss.index_binary_factory string starting with "B" ("BFlat", "BIVF256", "BHNSW32")
+# to index one sign bit per dimension
+INDEX_FACTORY = "Flat"
+# Compact codes for the first-stage search: float16, int8 scalar quantization, sign bits
+QUANTIZED_FACTORIES = {"fp16": "SQfp16", "sq8": "SQ8", "binary": "BFlat"}
+RESCORE_FACTOR = 4  # Candidates fetched per result when rescoring with full-precision vectors
+TRAIN_SAMPLE_SIZE = 50_000  # Vectors sampled to train IVF/PQ/SQ indexes
+
+
+@cache
+def get_model(
+    device: str | None = None, backend: str = config.EMBEDDING_BACKEND
+) -> "SentenceTransformer":
+    model = load_sentence_transformer(config.EMBEDDING_MODEL_NAME, device, backend)
+    print(
+        f"Model {config.EMBEDDING_MODEL_NAME} initialized with {backend} on device: {model.device}"
+    )
+    return model
 
 
 def embed_texts(
-    texts: list[str], model: SentenceTransformer, batch_size: int = 32
+    texts: list[str],
+    model: "SentenceTransformer",
+    batch_size: int = 32,
+    cache: EmbeddingCache | None = None,
 ) -> np.ndarray:
-    embeddings = model.encode(
-        texts,
-        batch_size=batch_size,
-        show_progress_bar=True,
-        device=model.device.type,
-        convert_to_numpy=True,
-    )  # [len(texts), embedding_size]
+    def encode(texts: list[str]) -> np.ndarray:
+        return model.encode(
+            texts,
+            batch_size=batch_size,
+            show_progress_bar=True,
+            device=model.device.type,
+            convert_to_numpy=True,
+        )  # [len(texts), embedding_size]
+
+    if cache is None:
+        embeddings = encode(texts)
+    else:
+        embeddings = cache.encode(texts, encode)
+        print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses")
     print(
         f"Embeddings shape (num_embeddings * embedding_size): {embeddings.shape[0]} * {embeddings.shape[1]}"
     )
@@ -31,23 +68,141 @@ def embed_texts(
     return embeddings
 
 
-def index_faiss(embeddings: np.ndarray, index_file_path: Path) -> faiss.IndexFlatL2:
+def is_binary_factory(factory: str) -> bool:
+    return factory.startswith("B")
+
+
+def binarize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Pack the sign of every dimension into bits, the codes binary indexes compare
+    by Hamming distance.
+    """
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+def index_faiss(
+    embeddings: np.ndarray,
+    index_file_path: Path,
+    factory: str = INDEX_FACTORY,
+    train_sample_size: int = TRAIN_SAMPLE_SIZE,
+    seed: int = 0,
+) -> faiss.Index | faiss.IndexBinary:
     if len(embeddings.shape) != 2:
         raise ValueError(
             f"Invalid embeddings shape {embeddings.shape}. Expected 2: num_embeddings * embedding_size"
         )
     num_embeddings, embedding_size = embeddings.shape
-    index = faiss.IndexFlatL2(embedding_size)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    binary = is_binary_factory(factory)
+    if binary:
+        if embedding_size % 8:
+            raise ValueError(f"Binary indexes need a multiple of 8 dimensions, got {embedding_size}")
+        index = faiss.index_binary_factory(embedding_size, factory)
+        embeddings = binarize(embeddings)
+    else:
+        index = faiss.index_factory(embedding_size, factory)
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample_size = min(num_embeddings, train_sample_size)
+        sample = embeddings[rng.choice(num_embeddings, sample_size, replace=False)]
+        print(f"Training {factory} index on {sample_size} vectors")
+        index.train(sample)  # type: ignore
     index.add(embeddings)  # type: ignore
-    print(f"{num_embeddings} vectors added to the index")
-    faiss.write_index(index, str(index_file_path))
+    print(f"{num_embeddings} vectors added to the {factory} index")
+    if binary:
+        faiss.write_index_binary(index, str(index_file_path))
+    else:
+        faiss.write_index(index, str(index_file_path))
     print(f"Index saved to {index_file_path}")
     return index
 
 
+def load_index(
+    index_file_path: Path = INDEX_FILE_PATH, mmap: bool = True
+) -> faiss.Index | faiss.IndexBinary:
+    """
+    Read an index from disk. With `mmap`, vector codes and inverted lists stay in the
+    page cache instead of process memory, so every worker process shares one copy.
+    """
+    flags = 0
+    if mmap:
+        # Newer FAISS maps codes of every index type with IO_FLAG_MMAP_IFC; combining
+        # it with the older IO_FLAG_MMAP breaks reading IVF indexes
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    with open(index_file_path, "rb") as f:
+        # Binary index headers start with "IB", e.g. IBxF for BFlat
+        if f.read(2) == b"IB":
+            return faiss.read_index_binary(str(index_file_path), flags)
+    return faiss.read_index(str(index_file_path), flags)
+
+
+def save_vectors(vectors: np.ndarray, vectors_file_path: Path = VECTORS_FILE_PATH):
+    with atomic_open(vectors_file_path) as f:
+        np.save(f, np.asarray(vectors, dtype=np.float32))
+
+
+def load_vectors(vectors_file_path: Path = VECTORS_FILE_PATH) -> np.ndarray:
+    # Memory-mapped, so rescoring reads only the candidate rows from disk
+    return np.load(vectors_file_path, mmap_mode="r")
+
+
+def rescore(
+    query_vectors: np.ndarray, candidate_ids: np.ndarray, vectors: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Rank each query's candidates by exact squared L2 distance to their full-precision
+    vectors and keep the best `k`. Missing results are padded with id -1.
+    """
+    distances = np.full((len(query_vectors), k), np.inf, dtype=np.float32)
+    ids = np.full((len(query_vectors), k), -1, dtype=np.int64)
+    for row, (query, candidates) in enumerate(zip(query_vectors, candidate_ids)):
+        # Sorted ids turn the memory-mapped gather into forward reads
+        candidates = np.unique(candidates[candidates >= 0])
+        exact = np.square(vectors[candidates] - query).sum(axis=1)
+        best = np.argsort(exact)[:k]
+        distances[row, : len(best)] = exact[best]
+        ids[row, : len(best)] = candidates[best]
+    return distances, ids
+
+
+def search(
+    index: faiss.Index | faiss.IndexBinary,
+    query_vectors: np.ndarray,
+    k: int,
+    vectors: np.ndarray | None = None,
+    rescore_factor: int = RESCORE_FACTOR,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Search `index` for the `k` nearest neighbours of each query. Given the
+    full-precision `vectors`, the index only proposes `k * rescore_factor`
+    candidates, which are reranked by exact L2 distance. Without them, binary
+    indexes return Hamming distances.
+    """
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+    fetch = k * rescore_factor if vectors is not None else k
+    if isinstance(index, faiss.IndexBinary):
+        distances, ids = index.search(binarize(query_vectors), fetch)  # type: ignore
+    else:
+        distances, ids = index.search(query_vectors, fetch)  # type: ignore
+    if vectors is None:
+        return distances, ids
+    return rescore(query_vectors, ids, vectors, k)
+
+
+def save_texts(texts: list[str], texts_file_path: Path = TEXTS_FILE_PATH):
+    with atomic_open(texts_file_path, "w") as f:
+        json.dump(texts, f)
+
+
+def load_texts(texts_file_path: Path = TEXTS_FILE_PATH) -> list[str]:
+    return json.loads(texts_file_path.read_text())
+
+
 def main():
     import argparse
 
+    from .chunking import get_chunks
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--overwrite",
@@ -55,18 +210,38 @@ def main():
         action="store_true",
         help="Overwrite existing index if it exists",
     )
+    parser.add_argument(
+        "--factory",
+        default=INDEX_FACTORY,
+        help="faiss.index_factory string, e.g. Flat, IVF256,Flat, HNSW32, IVF256,PQ48, IVF256,SQ8, "
+        "or a binary factory string such as BFlat",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=list(QUANTIZED_FACTORIES),
+        default=None,
+        help="Store compact codes (a flat index) and rescore with full-precision vectors; "
+        "overrides --factory",
+    )
+    parser.add_argument(
+        "--train-sample-size",
+        type=int,
+        default=TRAIN_SAMPLE_SIZE,
+        help="Number of vectors sampled to train the index",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=config.EMBEDDING_BACKEND,
+        help="Embedding backend; onnx and onnx-int8 run on the CPU with ONNX Runtime",
+    )
     args = parser.parse_args()
 
-    device = (
-        "cuda"
-        if torch.cuda.is_available()
-        else "mps"
-        if torch.backends.mps.is_available()
-        else "cpu"
-    )
-    print(f"Device: {device}")
-    model = SentenceTransformer(config.EMBEDDING_MODEL_NAME, device=device)
-    print(f"Model {config.EMBEDDING_MODEL_NAME} initialized on device: {device}")
+    model = get_model(backend=args.backend)
+    ndims = model.get_sentence_embedding_dimension()
+    if ndims is None:
+        raise AssertionError(f"Embedding size of model {config.EMBEDDING_MODEL_NAME} not known")
+    cache = EmbeddingCache(ndims, cache_namespace(config.EMBEDDING_MODEL_NAME, args.backend))
 
     if INDEX_FILE_PATH.exists():
         if args.overwrite:
@@ -79,15 +254,19 @@ def main():
 
     pdf_file_path = config.RAW_DIR / "NCCNGuidelines.pdf"
     texts = get_chunks(pdf_file_path)
-    embeddings = embed_texts(texts, model)
-    index = index_faiss(embeddings, INDEX_FILE_PATH)
-    index = faiss.read_index(str(INDEX_FILE_PATH))
+    embeddings = embed_texts(texts, model, cache=cache)
+    factory = QUANTIZED_FACTORIES[args.quantization] if args.quantization else args.factory
+    index_faiss(embeddings, INDEX_FILE_PATH, factory, args.train_sample_size)
+    save_texts(texts, TEXTS_FILE_PATH)
+    save_vectors(embeddings, VECTORS_FILE_PATH)
+    index = load_index(INDEX_FILE_PATH)
+    vectors = load_vectors(VECTORS_FILE_PATH) if args.quantization else None
 
     query_texts = ["ABBREVIATIONS", "NCCN Categories of Preference"]
-    query_embeddings = embed_texts(query_texts, model)
+    query_embeddings = embed_texts(query_texts, model, cache=cache)
     k = 4
     print("Doing search:")
-    scores, indexes = index.search(query_embeddings, k)  # type: ignore
+    scores, indexes = search(index, query_embeddings, k, vectors)
     print(f"Scores: {scores}. Indexes: {indexes}")
 
 
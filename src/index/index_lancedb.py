@@ -1,70 +1,315 @@
-from typing import cast
+import json
+import threading
+from functools import cache
+from itertools import batched
+from typing import TYPE_CHECKING, Any, ClassVar, Iterable, Iterator, cast
 
 import numpy as np
-import polars as pl
-import sentence_transformers
-import torch
+import pyarrow as pa
+from pydantic import PrivateAttr
 
 import lancedb
 from lancedb.embeddings import get_registry
 from lancedb.embeddings.base import TextEmbeddingFunction
 from lancedb.embeddings.registry import register
 from lancedb.pydantic import LanceModel, Vector
+from lancedb.table import Table
 from src import config
+from src.utils import sha256_text
 
-from .chunking import get_chunks
+from .embedding_backend import cache_namespace
+from .embedding_cache import EmbeddingCache
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 DB_URI = config.ROOT_DIR / "lancedb"
 TABLE_NAME = "docs"
+BATCH_SIZE = 256  # Chunks embedded and written per record batch
+INDEX_TYPES = ["IVF_PQ", "IVF_HNSW_SQ", "IVF_HNSW_PQ", "IVF_FLAT"]
+METRIC = "l2"  # Distance used by RAGChat queries; an index must be built with the same one
 
 
 @register("sentence-transformer")
 class CustomSentenceTransformer(TextEmbeddingFunction):
-    def __init__(
-        self, name: str = config.EMBEDDING_MODEL_NAME, device: str | None = None
-    ):
-        if device is None:
-            if torch.cuda.is_available():
-                device = "cuda"
-            elif torch.backends.mps.is_available():
-                device = "mps"
-            else:
-                device = "cpu"
-        self.model = sentence_transformers.SentenceTransformer(
-            model_name_or_path=name, device=device
-        )
-        self.device = device
+    name: str = config.EMBEDDING_MODEL_NAME
+    device: str | None = None
+    backend: str = config.EMBEDDING_BACKEND  # One of embedding_backend.BACKENDS
+    use_cache: bool = True
+    _model: Any = PrivateAttr()
+    _cache: EmbeddingCache | None = PrivateAttr(default=None)
+    _instances: ClassVar[dict[str, "CustomSentenceTransformer"]] = {}
+    _instances_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def create(cls, **kwargs) -> "CustomSentenceTransformer":
+        """
+        Return one shared instance per configuration, so the indexer and every table
+        opened through the registry reuse a single loaded model.
+        """
+        key = json.dumps(kwargs, sort_keys=True, default=str)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = super().create(**kwargs)
+            return cls._instances[key]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # torch and sentence_transformers take seconds to import, so defer them
+        # until a model is actually needed
+        from .embedding_backend import load_sentence_transformer
 
-        ndims = self.model.get_sentence_embedding_dimension()
+        self._model = load_sentence_transformer(self.name, self.device, self.backend)
+        self.device = self._model.device.type
+
+        ndims = self._model.get_sentence_embedding_dimension()
         if ndims is None:
-            raise AssertionError(f"Embedding size of model {name} not known")
+            raise AssertionError(f"Embedding size of model {self.name} not known")
         self._ndims = ndims
+        if self.use_cache:
+            self._cache = EmbeddingCache(ndims, cache_namespace(self.name, self.backend))
 
-    def generate_embeddings(self, texts: list[str]) -> list[np.ndarray]:
-        embeddings = self.model.encode(
+    @property
+    def model(self) -> "SentenceTransformer":
+        return self._model
+
+    @property
+    def cache(self) -> EmbeddingCache | None:
+        return self._cache
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(
             texts,
             device=self.device,
             convert_to_numpy=True,
         )  # [len(texts), embedding_size]
-        return list(embeddings)
+
+    def generate_embeddings(self, texts: list[str]) -> list[np.ndarray]:
+        texts = list(texts)
+        if self._cache is None:
+            return list(self._encode(texts))
+        return list(self._cache.encode(texts, self._encode))
 
     def ndims(self) -> int:
         return self._ndims
 
 
-model = cast(
-    CustomSentenceTransformer, get_registry().get("sentence-transformers").create()
-)
+def get_model() -> CustomSentenceTransformer:
+    return cast(
+        CustomSentenceTransformer, get_registry().get("sentence-transformer").create()
+    )
+
+
+@cache
+def get_docs_schema() -> type[LanceModel]:
+    model = get_model()
+
+    class Docs(LanceModel):
+        chunk_id: int
+        hash: str
+        text: str = model.SourceField()
+        vector: Vector(model.ndims()) = model.VectorField()  # type: ignore
+
+    return Docs
+
+
+def __getattr__(name: str):
+    # `model` and `Docs` used to be built at import time; keep them importable lazily
+    if name == "model":
+        return get_model()
+    if name == "Docs":
+        return get_docs_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _make_batch(
+    table: Table,
+    rows: list[tuple[int, str, str]],
+    vectors: np.ndarray,
+) -> pa.RecordBatch:
+    schema = table.schema
+    chunk_ids, hashes, texts = zip(*rows)
+    fields = [schema.field(name) for name in ("chunk_id", "hash", "text", "vector")]
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(chunk_ids, type=fields[0].type),
+            pa.array(hashes, type=fields[1].type),
+            pa.array(texts, type=fields[2].type),
+            pa.FixedSizeListArray.from_arrays(
+                pa.array(vectors.ravel(), type=pa.float32()), vectors.shape[1]
+            ),
+        ],
+        schema=pa.schema(fields),
+    )
+
+
+def _embed(embedding_model: CustomSentenceTransformer, texts: list[str]) -> np.ndarray:
+    vectors = embedding_model.generate_embeddings(texts)
+    return np.asarray(vectors, dtype=np.float32).reshape(len(texts), embedding_model.ndims())
+
+
+def _hashed_chunks(chunks: Iterable[str]) -> Iterator[tuple[int, str, str]]:
+    """
+    Yield `(chunk_id, hash, text)`, with chunk_id being the position of the chunk in
+    the stream. Repeated texts are only yielded once since the hash is the row key.
+    """
+    seen = set()
+    for chunk_id, text in enumerate(chunks):
+        text_hash = sha256_text(text)
+        if text_hash not in seen:
+            seen.add(text_hash)
+            yield chunk_id, text_hash, text
+
+
+def _sql_list(values: Iterable[str]) -> str:
+    return ", ".join(f"'{value}'" for value in values)
+
+
+def read_chunk_ids(table: Table) -> dict[str, int]:
+    row_count = table.count_rows()
+    if row_count == 0:
+        return {}
+    rows = table.search().select(["hash", "chunk_id"]).limit(row_count).to_arrow()
+    return dict(zip(rows["hash"].to_pylist(), rows["chunk_id"].to_pylist()))
+
 
+def ingest(
+    table: Table,
+    chunks: Iterable[str],
+    embedding_model: CustomSentenceTransformer | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Embed `chunks` in fixed-size batches and append each batch to `table` as soon
+    as it is embedded, so memory is bounded by `batch_size` rather than corpus size.
 
-class Docs(LanceModel):
-    text: str = model.SourceField()
-    vector: Vector(model.ndims()) = model.VectorField()  # type: ignore
+    Returns the number of chunks added.
+    """
+    embedding_model = embedding_model or get_model()
+    added = 0
+    for rows in batched(_hashed_chunks(chunks), batch_size):
+        vectors = _embed(embedding_model, [text for _, _, text in rows])
+        table.add(_make_batch(table, list(rows), vectors))
+        added += len(rows)
+        print(f"Added {added} chunks")
+    return added
+
+
+def upsert(
+    table: Table,
+    chunks: Iterable[str],
+    embedding_model: CustomSentenceTransformer | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> tuple[int, int, int]:
+    """
+    Bring `table` in line with `chunks` by text hash: only chunks whose hash is not
+    in the table are embedded, chunks that moved get their stored vector rewritten
+    with the new chunk_id, and rows whose hash vanished are deleted. This also
+    resumes an interrupted `ingest`.
+
+    Returns the number of added, moved and deleted chunks.
+    """
+    embedding_model = embedding_model or get_model()
+    existing = read_chunk_ids(table)
+    seen = set()
+
+    def changed_rows() -> Iterator[tuple[int, str, str]]:
+        for row in _hashed_chunks(chunks):
+            seen.add(row[1])
+            if existing.get(row[1]) != row[0]:
+                yield row
+
+    added = moved = 0
+    for rows in batched(changed_rows(), batch_size):
+        new_rows = [row for row in rows if row[1] not in existing]
+        moved_rows = [row for row in rows if row[1] in existing]
+        if new_rows:
+            new_vectors = _embed(embedding_model, [text for _, _, text in new_rows])
+            batch = _make_batch(table, new_rows, new_vectors)
+            table.merge_insert("hash").when_not_matched_insert_all().execute(batch)
+        if moved_rows:
+            # Reuse the stored vectors; the whole row is rewritten because partial
+            # updates would trigger the table's embedding function
+            stored = (
+                table.search()
+                .where(f"hash IN ({_sql_list(row[1] for row in moved_rows)})")
+                .select(["hash", "vector"])
+                .limit(len(moved_rows))
+                .to_arrow()
+            )
+            stored_vectors = dict(
+                zip(stored["hash"].to_pylist(), stored["vector"].to_numpy(zero_copy_only=False))
+            )
+            moved_vectors = np.stack([stored_vectors[row[1]] for row in moved_rows])
+            batch = _make_batch(table, moved_rows, moved_vectors.astype(np.float32))
+            table.merge_insert("hash").when_matched_update_all().execute(batch)
+        added += len(new_rows)
+        moved += len(moved_rows)
+        print(f"Added {added} chunks, moved {moved} chunks")
+
+    vanished = [text_hash for text_hash in existing if text_hash not in seen]
+    for hashes in batched(vanished, batch_size):
+        table.delete(f"hash IN ({_sql_list(hashes)})")
+    print(f"Deleted {len(vanished)} chunks")
+    return added, moved, len(vanished)
+
+
+def create_vector_index(
+    table: Table,
+    index_type: str = "IVF_PQ",
+    metric: str = METRIC,
+    num_partitions: int | None = None,
+    num_sub_vectors: int | None = None,
+    m: int = 20,
+    ef_construction: int = 300,
+):
+    """
+    Build (or replace) the ANN index on the vector column. By default the number of
+    IVF partitions is about sqrt(rows), capped so each partition trains on at least
+    256 vectors, and PQ uses 16-dimensional sub-vectors.
+    """
+    row_count = table.count_rows()
+    ndims = table.schema.field("vector").type.list_size
+    if num_partitions is None:
+        num_partitions = max(1, min(int(row_count**0.5), row_count // 256))
+    if num_sub_vectors is None:
+        num_sub_vectors = max(1, ndims // 16)
+    if ndims % num_sub_vectors:
+        raise ValueError(f"{ndims} dimensions cannot be split into {num_sub_vectors} sub-vectors")
+    print(
+        f"Building {index_type} index on {row_count} rows: metric={metric}, "
+        f"partitions={num_partitions}, sub-vectors={num_sub_vectors}"
+    )
+    table.create_index(
+        metric=metric,
+        num_partitions=num_partitions,
+        num_sub_vectors=num_sub_vectors,
+        index_type=index_type,  # type: ignore
+        m=m,
+        ef_construction=ef_construction,
+        replace=True,
+    )
+
+
+def create_fts_index(table: Table):
+    """
+    Build (or replace) the native BM25 full-text index on `text`, which hybrid
+    retrieval searches alongside the vectors to match exact terms such as TNM
+    codes, gene and drug names.
+    """
+    from lancedb.index import FTS
+
+    print(f"Building full-text index on {table.count_rows()} rows")
+    table.create_index("text", config=FTS(), replace=True)  # type: ignore
 
 
 def main():
     import argparse
 
+    import polars as pl
+
+    from .chunking import get_chunks
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--overwrite",
@@ -72,30 +317,80 @@ def main():
         action="store_true",
         help="Overwrite existing index if it exists",
     )
+    parser.add_argument(
+        "--upsert",
+        "-u",
+        action="store_true",
+        help="Update the existing table in place, embedding only new chunks and "
+        "deleting vanished ones. Also resumes an interrupted ingestion",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="Number of chunks embedded and written at a time",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=INDEX_TYPES,
+        default=None,
+        help="Build an ANN index of this type after ingestion (default: exact search only)",
+    )
+    parser.add_argument("--metric", default=METRIC, help="Distance metric for the index")
+    parser.add_argument("--num-partitions", type=int, default=None, help="IVF partitions")
+    parser.add_argument("--num-sub-vectors", type=int, default=None, help="PQ sub-vectors")
+    parser.add_argument(
+        "--no-fts",
+        action="store_true",
+        help="Skip building the full-text index used for hybrid retrieval",
+    )
     args = parser.parse_args()
 
     db = lancedb.connect(DB_URI)
     print(f"Created DB at {DB_URI}")
 
+    Docs = get_docs_schema()
+    upserting = False
     if TABLE_NAME in db.table_names():
         if args.overwrite:
             print("Table docs already exists. Deleting...")
             db.drop_table(TABLE_NAME)
+            table = db.create_table(TABLE_NAME, schema=Docs)
+        elif args.upsert:
+            table = db.open_table(TABLE_NAME)
+            if "hash" not in table.schema.names:
+                print(f"Table {TABLE_NAME} has no hash column. Use --overwrite.")
+                exit(1)
+            upserting = True
         else:
             print(f"Table {TABLE_NAME} already exists. Use --overwrite to overwrite.")
             exit(0)
-
-    table = db.create_table(TABLE_NAME, schema=Docs)
-    print(f"Created table {TABLE_NAME}")
+    else:
+        table = db.create_table(TABLE_NAME, schema=Docs)
+        print(f"Created table {TABLE_NAME}")
 
     print("Extracting chunks")
     chunks = get_chunks(config.RAW_DIR / "NCCNGuidelines.pdf")
 
-    df = pl.DataFrame({"text": chunks})
-    print("Adding chunks to the table...")
-    table.add(data=df)
+    if upserting:
+        print("Upserting chunks into the table...")
+        upsert(table, chunks, batch_size=args.batch_size)
+    else:
+        print("Adding chunks to the table...")
+        ingest(table, chunks, batch_size=args.batch_size)
+
+    if args.index_type:
+        create_vector_index(
+            table,
+            args.index_type,
+            args.metric,
+            args.num_partitions,
+            args.num_sub_vectors,
+        )
+    if not args.no_fts:
+        create_fts_index(table)
 
-    table_df = pl.from_arrow(table.to_arrow())
+    table_df = pl.from_arrow(table.head(10))
     print(table_df)
 
     print("Test: Querying the table...")
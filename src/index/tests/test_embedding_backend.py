@@ -0,0 +1,28 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.index.embedding_backend import cache_namespace, cosine_parity
+from src.index.embedding_cache import EmbeddingCache
+
+
+def test_cosine_parity_is_scale_invariant():
+    rng = np.random.default_rng(0)
+    reference = rng.normal(size=(4, 8)).astype(np.float32)
+    np.testing.assert_allclose(cosine_parity(reference, 2 * reference), 1.0, rtol=1e-6)
+    np.testing.assert_allclose(cosine_parity(reference, -reference), -1.0, rtol=1e-6)
+    with pytest.raises(ValueError):
+        cosine_parity(reference, reference[:2])
+
+
+def test_backends_get_separate_caches(tmp_path: Path):
+    def encode(texts: list[str]) -> np.ndarray:
+        return np.ones((len(texts), 3), dtype=np.float32)
+
+    torch_cache = EmbeddingCache(3, cache_namespace("org/model", "torch"), cache_dir=tmp_path)
+    torch_cache.encode(["alpha"], encode)
+    onnx_cache = EmbeddingCache(3, cache_namespace("org/model", "onnx-int8"), cache_dir=tmp_path)
+    onnx_cache.encode(["alpha"], encode)
+    assert (onnx_cache.hits, onnx_cache.misses) == (0, 1)
+    assert (tmp_path / "org__model").exists()
@@ -0,0 +1,82 @@
+from pathlib import Path
+
+import numpy as np
+
+from src.index.embedding_cache import EmbeddingCache
+
+
+def fake_encode(texts: list[str]) -> np.ndarray:
+    return np.array([[len(text), ord(text[0]), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_embedding_cache_hits_and_persists(tmp_path: Path):
+    encoded = []
+
+    def encode(texts: list[str]) -> np.ndarray:
+        encoded.extend(texts)
+        return fake_encode(texts)
+
+    cache = EmbeddingCache(3, "org/model", cache_dir=tmp_path, capacity=10)
+    texts = ["alpha", "beta", "alpha", "gamma"]
+    np.testing.assert_array_equal(cache.encode(texts, encode), fake_encode(texts))
+    assert encoded == ["alpha", "beta", "gamma"]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # A new instance reads the same memory-mapped files
+    cache = EmbeddingCache(3, "org/model", cache_dir=tmp_path, capacity=10)
+    np.testing.assert_array_equal(cache.encode(["gamma", "beta"], encode), fake_encode(["gamma", "beta"]))
+    assert len(encoded) == 3
+    assert (tmp_path / "org__model" / "vectors.npy").exists()
+
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path: Path):
+    cache = EmbeddingCache(3, "model", cache_dir=tmp_path, capacity=3)
+    cache.encode(["a", "bb", "ccc"], fake_encode)
+    cache.encode(["a"], fake_encode)  # "bb" is now the least recently used
+    cache.encode(["dddd"], fake_encode)
+    assert len(cache) == 3
+    misses = cache.misses
+    cache.encode(["a", "ccc", "dddd"], fake_encode)
+    assert cache.misses == misses
+    cache.encode(["bb"], fake_encode)
+    assert cache.misses == misses + 1
+
+
+def test_instances_sharing_a_directory_never_return_another_texts_vector(tmp_path: Path):
+    a = EmbeddingCache(3, "model", cache_dir=tmp_path, capacity=2)
+    b = EmbeddingCache(3, "model", cache_dir=tmp_path, capacity=2)
+    a.encode(["x"], fake_encode)
+    b.encode(["y"], fake_encode)
+    b.encode(["zz"], fake_encode)  # Reuses the slot `a` stored "x" in
+    np.testing.assert_array_equal(a.encode(["x"], fake_encode), fake_encode(["x"]))
+    assert (a.hits, a.misses) == (0, 2)
+    np.testing.assert_array_equal(a.encode(["x"], fake_encode), fake_encode(["x"]))
+    assert a.hits == 1
+
+
+def test_entries_written_by_another_instance_are_hits(tmp_path: Path):
+    a = EmbeddingCache(3, "model", cache_dir=tmp_path, capacity=10)
+    b = EmbeddingCache(3, "model", cache_dir=tmp_path, capacity=10)
+    a.encode(["x", "yy"], fake_encode)
+
+    encoded = []
+
+    def encode(texts: list[str]) -> np.ndarray:
+        encoded.extend(texts)
+        return fake_encode(texts)
+
+    texts = ["yy", "x", "zzz", "x"]
+    np.testing.assert_array_equal(b.encode(texts, encode), fake_encode(texts))
+    assert encoded == ["zzz"]
+    assert (b.hits, b.misses) == (3, 1)
+    assert len(b) == 3
+
+
+def test_a_second_instance_keeps_the_files_another_one_created(tmp_path: Path):
+    a = EmbeddingCache(3, "model", cache_dir=tmp_path, capacity=10)
+    a.encode(["x"], fake_encode)
+    b = EmbeddingCache(3, "model", cache_dir=tmp_path, capacity=10)
+    assert len(b) == 1
+    # A different layout recreates the files
+    c = EmbeddingCache(4, "model", cache_dir=tmp_path, capacity=10)
+    assert len(c) == 0
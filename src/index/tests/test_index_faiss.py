@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from src.index.index_faiss import (
+    index_faiss,
+    load_index,
+    load_texts,
+    load_vectors,
+    save_texts,
+    save_vectors,
+    search,
+)
+
+
+def test_index_faiss_trains_and_loads_with_mmap(tmp_path: Path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((500, 16)).astype(np.float32)
+    index_path = tmp_path / "faiss"
+    index = index_faiss(embeddings, index_path, "IVF8,SQ8", train_sample_size=300)
+    assert index.is_trained
+    assert index.ntotal == 500
+
+    loaded = load_index(index_path, mmap=True)
+    assert loaded.ntotal == 500
+    loaded.nprobe = 8  # type: ignore
+    _, ids = loaded.search(embeddings[:5], 1)  # type: ignore
+    assert ids[:, 0].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_texts_round_trip(tmp_path: Path):
+    texts = ["NCCN Categories", "ABBREVIATIONS", "ünïcode"]
+    save_texts(texts, tmp_path / "texts.json")
+    assert load_texts(tmp_path / "texts.json") == texts
+
+
+def test_quantized_indexes_rescored_with_full_vectors_match_exact_search(tmp_path: Path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((1000, 32)).astype(np.float32)
+    queries = embeddings[:20] + 0.5 * rng.standard_normal((20, 32)).astype(np.float32)
+    flat = faiss.IndexFlatL2(32)
+    flat.add(embeddings)  # type: ignore
+    exact_distances, exact_ids = flat.search(queries, 5)  # type: ignore
+    save_vectors(embeddings, tmp_path / "vectors.npy")
+    vectors = load_vectors(tmp_path / "vectors.npy")
+
+    for factory in ["SQfp16", "SQ8", "BFlat"]:
+        index_faiss(embeddings, tmp_path / factory, factory)
+        index = load_index(tmp_path / factory, mmap=True)
+        assert index.ntotal == 1000
+        # Rescoring 1000 candidates out of 1000 vectors is exact search
+        distances, ids = search(index, queries, 5, vectors, rescore_factor=200)
+        np.testing.assert_array_equal(ids, exact_ids)
+        np.testing.assert_allclose(distances, exact_distances, rtol=1e-4)
+
+    binary = load_index(tmp_path / "BFlat")
+    assert isinstance(binary, faiss.IndexBinary)
+    hamming, _ = search(binary, queries, 5)
+    assert hamming.dtype == np.int32
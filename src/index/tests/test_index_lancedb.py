@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import lancedb
+import numpy as np
+import pyarrow as pa
+
+from src.index.index_lancedb import ingest, upsert
+from src.utils import sha256_text
+
+NDIMS = 4
+
+
+class StubEmbedding:
+    def __init__(self):
+        self.embedded: list[str] = []
+
+    def generate_embeddings(self, texts: list[str]) -> list[np.ndarray]:
+        self.embedded.extend(texts)
+        return [np.full(NDIMS, len(text), dtype=np.float32) for text in texts]
+
+    def ndims(self) -> int:
+        return NDIMS
+
+
+def make_table(tmp_path: Path):
+    schema = pa.schema(
+        [
+            pa.field("chunk_id", pa.int64()),
+            pa.field("hash", pa.string()),
+            pa.field("text", pa.string()),
+            pa.field("vector", pa.list_(pa.float32(), NDIMS)),
+        ]
+    )
+    return lancedb.connect(tmp_path / "lancedb").create_table("docs", schema=schema)
+
+
+def read_rows(table) -> dict[str, tuple[int, str, list[float]]]:
+    rows = table.to_arrow().to_pylist()
+    return {row["text"]: (row["chunk_id"], row["hash"], row["vector"]) for row in rows}
+
+
+def test_upsert_only_embeds_new_chunks_and_keeps_rows_in_line(tmp_path: Path):
+    table = make_table(tmp_path)
+    model = StubEmbedding()
+    assert ingest(table, ["a", "bb", "ccc", "bb"], model, batch_size=2) == 3  # type: ignore
+    assert model.embedded == ["a", "bb", "ccc"]
+    assert read_rows(table) == {
+        "a": (0, sha256_text("a"), [1.0] * NDIMS),
+        "bb": (1, sha256_text("bb"), [2.0] * NDIMS),
+        "ccc": (2, sha256_text("ccc"), [3.0] * NDIMS),
+    }
+
+    # "ccc" moves, "bb" is unchanged, "a" is removed and "dddd" is new
+    model.embedded.clear()
+    counts = upsert(table, ["ccc", "bb", "dddd"], model, batch_size=2)  # type: ignore
+    assert counts == (1, 1, 1)
+    assert model.embedded == ["dddd"]
+    assert read_rows(table) == {
+        "ccc": (0, sha256_text("ccc"), [3.0] * NDIMS),
+        "bb": (1, sha256_text("bb"), [2.0] * NDIMS),
+        "dddd": (2, sha256_text("dddd"), [4.0] * NDIMS),
+    }
+
+    model.embedded.clear()
+    assert upsert(table, ["ccc", "bb", "dddd"], model) == (0, 0, 0)  # type: ignore
+    assert model.embedded == []
+    assert table.count_rows() == 3
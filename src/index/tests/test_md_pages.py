@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import pymupdf
+import pytest
+
+pytest.importorskip("unstructured")
+
+from src.index.chunking import get_md_pages, get_page_ranges, iter_md_pages
+
+
+def test_page_ranges_cover_every_page_once():
+    assert get_page_ranges(0, 4) == []
+    assert get_page_ranges(3, 8) == [(0, 1), (1, 2), (2, 3)]
+    assert get_page_ranges(10, 4) == [(0, 3), (3, 6), (6, 8), (8, 10)]
+    assert get_page_ranges(5, 0) == [(0, 5)]
+
+
+def make_pdf(path: Path, page_count: int) -> Path:
+    with pymupdf.open() as doc:
+        for page_id in range(page_count):
+            doc.new_page().insert_text((72, 72), f"Page number {page_id}")
+        doc.save(path)
+    return path
+
+
+def test_md_pages_come_back_once_and_in_order(tmp_path: Path):
+    pdf_path = make_pdf(tmp_path / "doc.pdf", 7)
+    pages = list(iter_md_pages(pdf_path, max_workers=2, ranges_per_worker=2))
+    assert [page_id for page_id, _ in pages] == list(range(7))
+    assert all(f"Page number {page_id}" in text for page_id, text in pages)
+
+    output_dir_path = tmp_path / "md"
+    md_pages = get_md_pages(pdf_path, output_dir_path, max_workers=2)
+    assert md_pages == [text for _, text in pages]
+    assert [(output_dir_path / f"{i}.txt").read_text() for i in range(7)] == md_pages
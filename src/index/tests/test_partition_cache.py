@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("unstructured")
+
+from unstructured.documents.elements import Element, NarrativeText
+
+from src.index import chunking
+
+
+def test_get_elements_reuses_partitions_with_the_same_pdf_and_settings(
+    tmp_path: Path, monkeypatch
+):
+    calls = []
+
+    def partition_pdf(filename: str, **kwargs) -> list[Element]:
+        calls.append((filename, kwargs))
+        return [NarrativeText(f"{Path(filename).read_bytes()!r} {kwargs}")]
+
+    monkeypatch.setattr(chunking, "partition_pdf", partition_pdf)
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(b"%PDF-1.7 first")
+    cache_dir = tmp_path / "cache"
+
+    first = chunking.get_elements(pdf_path, cache_dir, strategy="fast")
+    second = chunking.get_elements(pdf_path, cache_dir, strategy="fast")
+    assert len(calls) == 1
+    assert [e.text for e in second] == [e.text for e in first]
+    assert len(list(cache_dir.glob("*.json"))) == 1
+
+    chunking.get_elements(pdf_path, cache_dir, strategy="hi_res")
+    assert len(calls) == 2
+
+    pdf_path.write_bytes(b"%PDF-1.7 second")
+    changed = chunking.get_elements(pdf_path, cache_dir, strategy="fast")
+    assert len(calls) == 3
+    assert changed[0].text != first[0].text
+    assert len(list(cache_dir.glob("*.json"))) == 3
+
+    chunking.get_elements(pdf_path, None, strategy="fast")
+    assert len(calls) == 4
+    assert len(list(cache_dir.glob("*.json"))) == 3
@@ -50,9 +50,6 @@ def test_pymupdf_nccn():
         md_pages = [file.read_text() for file in output_dir_path.glob("*.txt")]
     else:
         md_pages = get_md_pages(input_pdf_path, output_dir_path, max_workers)
-        for page_id, md_page in enumerate(md_pages):
-            txt_path = output_dir_path / f"{page_id}.txt"
-            txt_path.write_text(md_page)
 
     for i, md_text in enumerate(md_pages):
         with open("temp.md", "w") as f:
@@ -0,0 +1,205 @@
+import hashlib
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable
+
+import boto3
+import pymupdf
+from loguru import logger
+from moto import mock_aws
+from mypy_boto3_textract.client import TextractClient
+
+from src.utils import atomic_open, sha256_file
+
+from .ocr_textract import (
+    MAX_IN_FLIGHT,
+    REGION_NAME,
+    REQUESTS_PER_SECOND,
+    RateLimiter,
+    extract_text_from_blocks,
+    setup_testing_s3,
+)
+from .textract_cache import TextractCache
+
+# Pages whose text layer yields fewer characters than this are treated as scanned
+MIN_PAGE_CHARS = 50
+
+
+def page_to_pdf_bytes(doc: pymupdf.Document, page_id: int) -> bytes:
+    with pymupdf.open() as page_doc:
+        page_doc.insert_pdf(doc, from_page=page_id, to_page=page_id)
+        return page_doc.tobytes(garbage=3, deflate=True)
+
+
+def read_pages(pdf_path: Path, min_page_chars: int = MIN_PAGE_CHARS) -> list[str | bytes]:
+    """
+    Each page's text from the PDF text layer or, for pages that yield fewer than
+    `min_page_chars` characters, the page as a single-page PDF for Textract.
+
+    PyMuPDF is not thread-safe, so this must only run on one thread at a time.
+    """
+    with pymupdf.open(str(pdf_path)) as report:
+        pages: list[str | bytes] = []
+        for page in report.pages():
+            text = page.get_text()
+            if len(text.strip()) < min_page_chars:
+                pages.append(page_to_pdf_bytes(report, page.number))  # type: ignore
+            else:
+                pages.append(text)
+        return pages
+
+
+def detect_page_text(
+    textract: TextractClient,
+    pdf_bytes: bytes,
+    rate_limiter: RateLimiter | None = None,
+) -> list[dict]:
+    """
+    Run Textract on a single-page PDF. Single pages go through the synchronous
+    DetectDocumentText API, so there is no S3 upload and no job to poll.
+    """
+    if rate_limiter:
+        rate_limiter.acquire()
+    response = textract.detect_document_text(Document={"Bytes": pdf_bytes})
+    return response["Blocks"]
+
+
+def _detect_and_cache(
+    textract: TextractClient,
+    pdf_bytes: bytes,
+    digest: str,
+    rate_limiter: RateLimiter | None,
+    cache: TextractCache | None,
+) -> list[dict]:
+    blocks = detect_page_text(textract, pdf_bytes, rate_limiter)
+    if cache is not None:
+        cache.put(digest, blocks)
+    return blocks
+
+
+def page_text(blocks: Iterable[dict]) -> str:
+    # Textract ends its single page with a form feed; the writer adds our own
+    return extract_text_from_blocks(blocks).removesuffix("\f")
+
+
+def submit_pdf_file(
+    executor: Executor,
+    textract: TextractClient,
+    pdf_path: Path,
+    min_page_chars: int = MIN_PAGE_CHARS,
+    rate_limiter: RateLimiter | None = None,
+    cache: TextractCache | None = None,
+) -> list[str | Future[list[dict]]]:
+    """
+    Read the pages of `pdf_path` on the calling thread and submit the scanned
+    pages missing from `cache` to Textract on `executor`, so the pages of one
+    report are recognized concurrently.
+
+    Returns each page's text, or the future of its Textract blocks.
+    """
+    pdf_digest = sha256_file(pdf_path) if cache is not None else ""
+    pages: list[str | Future[list[dict]]] = []
+    for page_id, page in enumerate(read_pages(pdf_path, min_page_chars)):
+        if isinstance(page, str):
+            pages.append(page)
+            continue
+        digest = hashlib.sha256(f"{pdf_digest}:{page_id}".encode()).hexdigest()
+        blocks = cache.get(digest) if cache is not None else None
+        if blocks is not None:
+            done: Future[list[dict]] = Future()
+            done.set_result(list(blocks))
+            pages.append(done)
+            continue
+        logger.info(f"🔍 Sending page {page_id + 1} of {pdf_path.name} to Textract")
+        pages.append(
+            executor.submit(_detect_and_cache, textract, page, digest, rate_limiter, cache)
+        )
+    return pages
+
+
+def write_pages(pages: list[str | Future[list[dict]]], txt_path: Path) -> tuple[int, int]:
+    """
+    Wait for the Textract pages and write all pages in order, each followed by a
+    form feed, like `ocr_pymupdf`.
+
+    Returns the page count and the number of pages recognized by Textract.
+    """
+    texts = [page if isinstance(page, str) else page_text(page.result()) for page in pages]
+    with atomic_open(txt_path, "wb") as txt_file:
+        for text in texts:
+            txt_file.write(text.encode("utf8"))
+            txt_file.write(bytes((12,)))
+    return len(pages), sum(not isinstance(page, str) for page in pages)
+
+
+def process(
+    in_pdf_dir: Path,
+    out_txt_dir: Path,
+    min_page_chars: int = MIN_PAGE_CHARS,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    requests_per_second: float = REQUESTS_PER_SECOND,
+    cache: TextractCache | None = None,
+) -> int:
+    """
+    OCR every PDF in `in_pdf_dir`. Reports are read one at a time on this thread,
+    while up to `max_in_flight` Textract requests for the scanned pages of this and
+    earlier reports run on worker threads.
+    """
+    textract = boto3.client("textract", region_name=REGION_NAME)
+    if not in_pdf_dir.is_dir():
+        raise ValueError(f"{in_pdf_dir} is not a directory")
+    rate_limiter = RateLimiter(requests_per_second, burst=max(1, int(requests_per_second)))
+    pdf_paths = [p for p in in_pdf_dir.iterdir() if p.suffix.lower() == ".pdf"]
+    success_count = 0
+    page_count = 0
+    textract_count = 0
+    # Reports read but not yet written; bounded so their page bytes stay few
+    pending: deque[tuple[str, list[str | Future[list[dict]]]]] = deque()
+
+    def finish(report_name: str, pages: list[str | Future[list[dict]]]):
+        nonlocal success_count, page_count, textract_count
+        try:
+            pages_written, textract_pages = write_pages(
+                pages, out_txt_dir / f"{report_name}.txt"
+            )
+        except Exception:
+            logger.exception(f"❌ Unexpected error while processing {report_name}")
+            return
+        success_count += 1
+        page_count += pages_written
+        textract_count += textract_pages
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for pdf_path in pdf_paths:
+            try:
+                pages = submit_pdf_file(
+                    executor, textract, pdf_path, min_page_chars, rate_limiter, cache
+                )
+            except Exception:
+                logger.exception(f"❌ Unexpected error while processing {pdf_path.stem}")
+                continue
+            pending.append((pdf_path.stem, pages))
+            while len(pending) > max_in_flight:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    logger.info(
+        f"Successfully processed {success_count}/{len(pdf_paths)} files. "
+        f"Sent {textract_count}/{page_count} pages to Textract"
+    )
+    return success_count
+
+
+def test_process(in_pdf_dir: Path, out_txt_dir: Path, cache: TextractCache | None = None):
+    with mock_aws():
+        setup_testing_s3()
+        process(in_pdf_dir, out_txt_dir, cache=cache)
+
+
+if __name__ == "__main__":
+    from src import config
+
+    in_pdf_dir = config.RAW_DIR / "TCGA_Reports_pdf"
+    out_txt_dir = config.PROCESSED_DIR / "TCGA_Reports_txt"
+    test_process(in_pdf_dir, out_txt_dir, TextractCache())  # or process() for real AWS
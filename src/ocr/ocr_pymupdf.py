@@ -1,17 +1,22 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import pymupdf
 from loguru import logger
 
+from src.utils import atomic_open, sha256_file
+
+MANIFEST_NAME = ".manifest.json"
+
 
 def process_pdf_file(pdf_path: Path, txt_path: Path):
-    report = pymupdf.open(str(pdf_path))
-    txt_file = open(txt_path, "wb")
-    for page in report.pages():
-        text = page.get_text().encode("utf8")
-        txt_file.write(text)
-        txt_file.write(bytes((12,)))
-    txt_file.close()
+    with pymupdf.open(str(pdf_path)) as report, atomic_open(txt_path, "wb") as txt_file:
+        for page in report.pages():
+            text = page.get_text().encode("utf8")
+            txt_file.write(text)
+            txt_file.write(bytes((12,)))
 
 
 def process(in_pdf_dir: Path, out_txt_dir: Path):
@@ -28,9 +33,136 @@ def process(in_pdf_dir: Path, out_txt_dir: Path):
     logger.info(f"Processed {total_count} files")
 
 
-if __name__ == "__main__":
+def load_manifest(manifest_path: Path) -> dict[str, dict]:
+    if not manifest_path.exists():
+        return {}
+    try:
+        return json.loads(manifest_path.read_text())
+    except json.JSONDecodeError:
+        logger.warning(f"Manifest {manifest_path} is corrupt. Reprocessing everything.")
+        return {}
+
+
+def save_manifest(manifest: dict[str, dict], manifest_path: Path):
+    with atomic_open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def _process_pdf_task(args: tuple[Path, Path]) -> None:
+    pdf_path, txt_path = args
+    process_pdf_file(pdf_path, txt_path)
+
+
+def process_batch(
+    in_pdf_dir: Path,
+    out_txt_dir: Path,
+    max_workers: int | None = None,
+    force: bool = False,
+    checkpoint_every: int = 50,
+) -> tuple[int, int]:
+    """
+    Extract every PDF in `in_pdf_dir` across a process pool, skipping reports whose
+    content hash matches the manifest kept in `out_txt_dir`.
+
+    Returns the number of processed and skipped reports.
+    """
+    if not in_pdf_dir.is_dir():
+        raise ValueError(f"{in_pdf_dir} is not a directory")
+    out_txt_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_txt_dir / MANIFEST_NAME
+    manifest = {} if force else load_manifest(manifest_path)
+
+    pending: dict[str, tuple[Path, Path, dict]] = {}
+    skipped_count = 0
+    for pdf_path in sorted(in_pdf_dir.iterdir()):
+        if pdf_path.suffix.lower() != ".pdf":
+            continue
+        report_name = pdf_path.stem
+        txt_path = out_txt_dir / f"{report_name}.txt"
+        stat = pdf_path.stat()
+        entry = manifest.get(report_name)
+        if entry is not None and txt_path.exists():
+            # Cheap check first: an untouched file never needs to be re-hashed
+            if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                skipped_count += 1
+                continue
+            digest = sha256_file(pdf_path)
+            if entry["sha256"] == digest:
+                entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                skipped_count += 1
+                continue
+        else:
+            digest = sha256_file(pdf_path)
+        pending[report_name] = (
+            pdf_path,
+            txt_path,
+            {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+        )
+
+    logger.info(f"{len(pending)} reports to process, {skipped_count} unchanged")
+
+    processed_count = 0
+    failed_count = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(_process_pdf_task, (pdf_path, txt_path)): report_name
+                for report_name, (pdf_path, txt_path, _) in pending.items()
+            }
+            for future in as_completed(futures):
+                report_name = futures[future]
+                try:
+                    future.result()
+                except Exception:
+                    failed_count += 1
+                    logger.exception(f"Failed to process report {report_name}")
+                    continue
+                manifest[report_name] = pending[report_name][2]
+                processed_count += 1
+                logger.info(f"({processed_count}/{len(pending)}) Processed report {report_name}")
+                if processed_count % checkpoint_every == 0:
+                    save_manifest(manifest, manifest_path)
+
+    save_manifest(manifest, manifest_path)
+    logger.info(
+        f"Processed {processed_count} files, skipped {skipped_count} unchanged, {failed_count} failed"
+    )
+    return processed_count, skipped_count
+
+
+def main():
+    import argparse
+
     from src import config
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--batch",
+        "-b",
+        action="store_true",
+        help="Process reports in parallel and skip the ones unchanged since the last run",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes in batch mode",
+    )
+    parser.add_argument(
+        "--force",
+        "-f",
+        action="store_true",
+        help="Ignore the manifest and reprocess every report in batch mode",
+    )
+    args = parser.parse_args()
+
     in_pdf_dir = config.RAW_DIR / "TCGA_Reports_pdf"
     out_txt_dir = config.PROCESSED_DIR / "TCGA_Reports_txt"
-    process(in_pdf_dir, out_txt_dir)
+    if args.batch:
+        process_batch(in_pdf_dir, out_txt_dir, args.max_workers, args.force)
+    else:
+        process(in_pdf_dir, out_txt_dir)
+
+
+if __name__ == "__main__":
+    main()
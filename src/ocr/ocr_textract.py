@@ -1,6 +1,10 @@
 import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Iterable, Iterator
 
 import boto3
 from loguru import logger
@@ -9,9 +13,50 @@ from mypy_boto3_s3.client import S3Client
 from mypy_boto3_textract.client import TextractClient
 from mypy_boto3_textract.type_defs import GetDocumentAnalysisRequestTypeDef
 
+from src.utils import atomic_open, sha256_file
+
+from .textract_cache import TextractCache
+
 # ----------------- Configuration -----------------
 REGION_NAME = "us-east-1"
 BUCKET_NAME = "TCGA_Reports_pdf"
+MAX_IN_FLIGHT = 8  # Concurrent Textract jobs
+REQUESTS_PER_SECOND = 5.0  # Shared budget for Textract API calls on the account
+
+# Polling backoff for a running job, in seconds
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 30.0
+POLL_BACKOFF = 1.5
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket. One instance is shared by every worker so the
+    whole process stays under the account's Textract TPS quota.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
 
 
 def upload_to_s3(s3: S3Client, report_path: Path, bucket: str, object_name: str):
@@ -22,8 +67,15 @@ def upload_to_s3(s3: S3Client, report_path: Path, bucket: str, object_name: str)
         logger.exception(f"❌ Failed to upload {object_name}")
 
 
-def start_textract_job(textract: TextractClient, bucket: str, document: str) -> str:
+def start_textract_job(
+    textract: TextractClient,
+    bucket: str,
+    document: str,
+    rate_limiter: RateLimiter | None = None,
+) -> str:
     try:
+        if rate_limiter:
+            rate_limiter.acquire()
         response = textract.start_document_text_detection(
             DocumentLocation={"S3Object": {"Bucket": bucket, "Name": document}}
         )
@@ -35,22 +87,43 @@ def start_textract_job(textract: TextractClient, bucket: str, document: str) ->
         raise
 
 
-def is_job_complete(textract: TextractClient, job_id: str) -> bool:
+def is_job_complete(
+    textract: TextractClient,
+    job_id: str,
+    rate_limiter: RateLimiter | None = None,
+    initial_delay: float = POLL_INITIAL_DELAY,
+    max_delay: float = POLL_MAX_DELAY,
+    backoff: float = POLL_BACKOFF,
+) -> bool:
+    """
+    Poll a job until it finishes. The delay between polls grows geometrically up
+    to `max_delay`, with jitter so concurrent jobs do not poll in lockstep.
+    """
+    delay = initial_delay
     try:
         while True:
-            response = textract.get_document_text_detection(JobId=job_id)
+            if rate_limiter:
+                rate_limiter.acquire()
+            response = textract.get_document_text_detection(JobId=job_id, MaxResults=1)
             status = response["JobStatus"]
             logger.debug(f"⏳ Job {job_id} status: {status}")
             if status in ["SUCCEEDED", "FAILED"]:
                 return status == "SUCCEEDED"
-            time.sleep(5)
+            time.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * backoff, max_delay)
     except Exception:
         logger.exception(f"❌ Error while polling job {job_id}")
         raise
 
 
-def get_job_results(textract: TextractClient, job_id: str) -> list[dict]:
-    pages = []
+def iter_job_blocks(
+    textract: TextractClient, job_id: str, rate_limiter: RateLimiter | None = None
+) -> Iterator[dict]:
+    """
+    Yield the blocks of a finished job one `NextToken` page at a time, so only a
+    single response is held in memory however long the document is.
+    """
+    block_count = 0
     next_token = None
     try:
         while True:
@@ -58,21 +131,54 @@ def get_job_results(textract: TextractClient, job_id: str) -> list[dict]:
             if next_token:
                 kwargs["NextToken"] = next_token
 
+            if rate_limiter:
+                rate_limiter.acquire()
             response = textract.get_document_text_detection(**kwargs)
-            pages.extend(response["Blocks"])
+            blocks = response["Blocks"]
+            block_count += len(blocks)
+            yield from blocks
             next_token = response.get("NextToken")
             if not next_token:
                 break
-        logger.info(f"📄 Retrieved {len(pages)} blocks for job {job_id}\n")
-        return pages
+        logger.info(f"📄 Retrieved {block_count} blocks for job {job_id}\n")
     except Exception:
         logger.exception(f"❌ Failed to retrieve results for job {job_id}")
         raise
 
 
-def extract_text_from_blocks(blocks: list[dict]) -> str:
-    lines = [block["Text"] for block in blocks if block["BlockType"] == "LINE"]
-    return "\n".join(lines)
+def get_job_results(
+    textract: TextractClient, job_id: str, rate_limiter: RateLimiter | None = None
+) -> list[dict]:
+    return list(iter_job_blocks(textract, job_id, rate_limiter))
+
+
+def iter_text_from_blocks(blocks: Iterable[dict]) -> Iterator[str]:
+    """
+    Yield the document's lines, each followed by a newline, and a form feed after
+    every page, matching the layout written by `ocr_pymupdf`.
+    """
+    page_count = 0
+    for block in blocks:
+        # Blocks arrive in page order; pages without any lines still get a separator
+        page = block.get("Page", 1)
+        while page_count < page:
+            if page_count:
+                yield "\f"
+            page_count += 1
+        if block["BlockType"] == "LINE":
+            yield block["Text"] + "\n"
+    if page_count:
+        yield "\f"
+
+
+def extract_text_from_blocks(blocks: Iterable[dict]) -> str:
+    return "".join(iter_text_from_blocks(blocks))
+
+
+def write_text(txt_file: Path, chunks: Iterable[str]):
+    with atomic_open(txt_file, "w") as f:
+        f.writelines(chunks)
+    logger.success(f"✅ Text written to {txt_file}\n")
 
 
 def process_pdf_file(
@@ -81,18 +187,29 @@ def process_pdf_file(
     pdf_file: Path,
     txt_file: Path,
     report_name: str,
+    rate_limiter: RateLimiter | None = None,
+    cache: TextractCache | None = None,
 ) -> bool:
     try:
         logger.info(f"📥 Processing file: {pdf_file}\n")
+        digest = None
+        if cache is not None:
+            digest = sha256_file(pdf_file)
+            blocks = cache.get(digest)
+            if blocks is not None:
+                logger.info(f"♻️ Cache hit for {report_name}, skipping Textract\n")
+                cache.record(report_name, digest)
+                write_text(txt_file, iter_text_from_blocks(blocks))
+                return True
+
         upload_to_s3(s3, pdf_file, BUCKET_NAME, report_name)
-        job_id = start_textract_job(textract, BUCKET_NAME, report_name)
-        if is_job_complete(textract, job_id):
-            blocks = get_job_results(textract, job_id)
-            text = extract_text_from_blocks(blocks)
-
-            txt_file.parent.mkdir(parents=True, exist_ok=True)
-            txt_file.write_text(text)
-            logger.success(f"✅ Text written to {txt_file}\n")
+        job_id = start_textract_job(textract, BUCKET_NAME, report_name, rate_limiter)
+        if is_job_complete(textract, job_id, rate_limiter):
+            # Blocks stream from Textract through the cache into the text file
+            blocks = iter_job_blocks(textract, job_id, rate_limiter)
+            if cache is not None and digest is not None:
+                blocks = cache.writing(digest, blocks, report_name)
+            write_text(txt_file, iter_text_from_blocks(blocks))
             return True
         else:
             logger.error(f"❌ Textract job {job_id} failed for {report_name}")
@@ -102,21 +219,64 @@ def process_pdf_file(
         return False
 
 
-def process(in_pdf_dir: Path, out_txt_dir: Path):
+def process(
+    in_pdf_dir: Path,
+    out_txt_dir: Path,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    requests_per_second: float = REQUESTS_PER_SECOND,
+    cache: TextractCache | None = None,
+) -> int:
+    """
+    Run up to `max_in_flight` documents through upload, job start, polling and
+    result retrieval concurrently. Every Textract call draws from one shared
+    rate limiter. PDFs whose blocks are already in `cache` skip AWS entirely.
+    Returns the number of successfully processed files.
+    """
+    # boto3 clients are thread-safe, so all workers share the same pair
     s3 = boto3.client("s3", region_name=REGION_NAME)
     textract = boto3.client("textract", region_name=REGION_NAME)
     if not in_pdf_dir.is_dir():
         raise ValueError(f"{in_pdf_dir} is not a directory")
-    total_count = 0
+    rate_limiter = RateLimiter(requests_per_second, burst=max(1, int(requests_per_second)))
+    pdf_paths = [p for p in in_pdf_dir.iterdir() if p.suffix.lower() == ".pdf"]
+    total_count = len(pdf_paths)
     success_count = 0
-    for pdf_path in in_pdf_dir.iterdir():
-        if pdf_path.suffix.lower() == ".pdf":
-            total_count += 1
-            report_name = pdf_path.stem
-            txt_path = out_txt_dir / f"{report_name}.txt"
-            if process_pdf_file(s3, textract, pdf_path, txt_path, report_name):
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [
+            executor.submit(
+                process_pdf_file,
+                s3,
+                textract,
+                pdf_path,
+                out_txt_dir / f"{pdf_path.stem}.txt",
+                pdf_path.stem,
+                rate_limiter,
+                cache,
+            )
+            for pdf_path in pdf_paths
+        ]
+        for future in as_completed(futures):
+            if future.result():
                 success_count += 1
     logger.info(f"Successfully processed {success_count}/{total_count} files")
+    return success_count
+
+
+def rederive_texts(out_txt_dir: Path, cache: TextractCache) -> int:
+    """
+    Rewrite every cached report's text with the current `extract_text_from_blocks`,
+    without touching S3 or Textract.
+    """
+    count = 0
+    for report_name, digest in sorted(cache.index.items()):
+        blocks = cache.get(digest)
+        if blocks is None:
+            logger.warning(f"Blocks for {report_name} were evicted from the cache")
+            continue
+        write_text(out_txt_dir / f"{report_name}.txt", iter_text_from_blocks(blocks))
+        count += 1
+    logger.info(f"Re-derived text for {count} reports")
+    return count
 
 
 # Set up testing environment for AWS S3
@@ -140,15 +300,40 @@ def setup_testing_s3():
     setup_mock_s3()
 
 
-def test_process(in_pdf_dir: Path, out_txt_dir: Path):
+def test_process(in_pdf_dir: Path, out_txt_dir: Path, cache: TextractCache | None = None):
     with mock_aws():
         setup_testing_s3()
-        process(in_pdf_dir, out_txt_dir)
+        process(in_pdf_dir, out_txt_dir, cache=cache)
 
 
-if __name__ == "__main__":
+def main():
+    import argparse
+
     from src import config
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rederive",
+        action="store_true",
+        help="Regenerate text files from cached Textract blocks without calling AWS",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always upload and run Textract, even for PDFs already in the cache",
+    )
+    args = parser.parse_args()
+
     in_pdf_dir = config.RAW_DIR / "TCGA_Reports_pdf"
     out_txt_dir = config.PROCESSED_DIR / "TCGA_Reports_txt"
-    test_process(in_pdf_dir, out_txt_dir)  # or process() for real AWS
+    cache = None if args.no_cache else TextractCache()
+    if args.rederive:
+        if cache is None:
+            parser.error("--rederive needs the cache")
+        rederive_texts(out_txt_dir, cache)
+    else:
+        test_process(in_pdf_dir, out_txt_dir, cache)  # or process() for real AWS
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import threading
+import time
+from pathlib import Path
+
+import pymupdf
+import pytest
+from moto import mock_aws
+from moto.textract.models import TextractBackend
+
+from src.ocr import ocr_hybrid
+from src.ocr.ocr_hybrid import process
+from src.ocr.ocr_textract import setup_testing_s3
+from src.ocr.textract_cache import TextractCache
+
+BLOCKS = [
+    {"BlockType": "PAGE", "Id": "p1", "Page": 1},
+    {"BlockType": "LINE", "Id": "l1", "Page": 1, "Text": "Scanned addendum"},
+]
+TEXT_LAYER = "FINAL DIAGNOSIS: Invasive ductal carcinoma of the left breast, grade 2."
+
+
+def test_only_scanned_pages_go_to_textract(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    in_pdf_dir = tmp_path / "pdf"
+    out_txt_dir = tmp_path / "txt"
+    in_pdf_dir.mkdir()
+    doc = pymupdf.open()
+    doc.new_page().insert_text((72, 72), TEXT_LAYER)
+    doc.new_page()  # No text layer, like a scanned page
+    doc.new_page().insert_text((72, 72), TEXT_LAYER)
+    doc.save(in_pdf_dir / "mixed.pdf")
+    doc.close()
+
+    calls = []
+    detect_page_text = ocr_hybrid.detect_page_text
+
+    def counting_detect_page_text(*args, **kwargs):
+        calls.append(args)
+        return detect_page_text(*args, **kwargs)
+
+    monkeypatch.setattr(ocr_hybrid, "detect_page_text", counting_detect_page_text)
+    monkeypatch.setattr(TextractBackend, "BLOCKS", BLOCKS)
+    cache = TextractCache(tmp_path / "cache")
+    with mock_aws():
+        setup_testing_s3()
+        assert process(in_pdf_dir, out_txt_dir, requests_per_second=100, cache=cache) == 1
+        assert process(in_pdf_dir, out_txt_dir, requests_per_second=100, cache=cache) == 1
+
+    assert len(calls) == 1
+    pages = (out_txt_dir / "mixed.txt").read_text().split("\f")
+    assert len(pages) == 4 and pages[-1] == ""
+    assert TEXT_LAYER in pages[0] and TEXT_LAYER in pages[2]
+    assert pages[1] == "Scanned addendum\n"
+
+
+def test_pages_go_to_textract_concurrently_and_pymupdf_stays_on_one_thread(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    in_pdf_dir = tmp_path / "pdf"
+    in_pdf_dir.mkdir()
+    for name in ("a", "b"):
+        doc = pymupdf.open()
+        for _ in range(3):
+            doc.new_page()  # Scanned
+        doc.save(in_pdf_dir / f"{name}.pdf")
+        doc.close()
+
+    read_threads = set()
+    read_pages = ocr_hybrid.read_pages
+
+    def recording_read_pages(*args, **kwargs):
+        read_threads.add(threading.current_thread())
+        return read_pages(*args, **kwargs)
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def slow_detect_page_text(textract, pdf_bytes, rate_limiter=None):
+        nonlocal in_flight, max_in_flight
+        assert pdf_bytes.startswith(b"%PDF")
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight -= 1
+        return BLOCKS
+
+    monkeypatch.setattr(ocr_hybrid, "read_pages", recording_read_pages)
+    monkeypatch.setattr(ocr_hybrid, "detect_page_text", slow_detect_page_text)
+    with mock_aws():
+        assert process(in_pdf_dir, tmp_path / "txt", max_in_flight=3, requests_per_second=100) == 2
+
+    assert read_threads == {threading.current_thread()}
+    assert max_in_flight == 3
+    for name in ("a", "b"):
+        assert (tmp_path / "txt" / f"{name}.txt").read_text() == "Scanned addendum\n\f" * 3
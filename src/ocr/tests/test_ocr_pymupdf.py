@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import pymupdf
+
+from src.ocr.ocr_pymupdf import MANIFEST_NAME, process_batch
+
+
+def make_pdf(pdf_path: Path, pages: list[str]):
+    doc = pymupdf.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_text((72, 72), text)
+    doc.save(pdf_path)
+    doc.close()
+
+
+def test_process_batch_skips_unchanged(tmp_path: Path):
+    in_pdf_dir = tmp_path / "pdf"
+    out_txt_dir = tmp_path / "txt"
+    in_pdf_dir.mkdir()
+    for i in range(3):
+        make_pdf(in_pdf_dir / f"report-{i}.pdf", [f"Report {i} page 1", f"Report {i} page 2"])
+
+    processed, skipped = process_batch(in_pdf_dir, out_txt_dir, max_workers=2)
+    assert (processed, skipped) == (3, 0)
+    assert (out_txt_dir / MANIFEST_NAME).exists()
+    text = (out_txt_dir / "report-0.txt").read_text()
+    assert text.count("\f") == 2
+    assert "Report 0 page 2" in text
+
+    make_pdf(in_pdf_dir / "report-3.pdf", ["New report"])
+    make_pdf(in_pdf_dir / "report-1.pdf", ["Revised report"])
+    processed, skipped = process_batch(in_pdf_dir, out_txt_dir, max_workers=2)
+    assert (processed, skipped) == (2, 2)
+    assert "Revised report" in (out_txt_dir / "report-1.txt").read_text()
+
+    # No temporary files are left behind by the atomic writes
+    assert not list(out_txt_dir.glob(".*.tmp"))
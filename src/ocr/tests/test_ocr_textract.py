@@ -0,0 +1,150 @@
+import time
+from pathlib import Path
+
+import pymupdf
+import pytest
+from moto import mock_aws
+from moto.textract.models import TextractBackend
+
+from src.ocr import ocr_textract
+from src.ocr.ocr_textract import (
+    RateLimiter,
+    iter_job_blocks,
+    iter_text_from_blocks,
+    process,
+    rederive_texts,
+    setup_testing_s3,
+)
+from src.ocr.textract_cache import TextractCache
+
+BLOCKS = [
+    {"BlockType": "PAGE", "Id": "p1", "Page": 1},
+    {"BlockType": "LINE", "Id": "l1", "Page": 1, "Text": "DIAGNOSIS"},
+    {"BlockType": "WORD", "Id": "w1", "Page": 1, "Text": "DIAGNOSIS"},
+    {"BlockType": "LINE", "Id": "l2", "Page": 1, "Text": "Invasive ductal carcinoma"},
+]
+
+
+@pytest.fixture
+def pdf_dir(tmp_path: Path) -> Path:
+    in_pdf_dir = tmp_path / "pdf"
+    in_pdf_dir.mkdir()
+    for i in range(6):
+        doc = pymupdf.open()
+        doc.new_page().insert_text((72, 72), f"Report {i}")
+        doc.save(in_pdf_dir / f"report-{i}.pdf")
+        doc.close()
+    return in_pdf_dir
+
+
+@pytest.fixture
+def mock_textract(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(TextractBackend, "BLOCKS", BLOCKS)
+    with mock_aws():
+        setup_testing_s3()
+        yield
+
+
+def test_process_concurrent(pdf_dir: Path, tmp_path: Path, mock_textract):
+    out_txt_dir = tmp_path / "txt"
+    success_count = process(pdf_dir, out_txt_dir, max_in_flight=4, requests_per_second=100)
+    assert success_count == 6
+    for i in range(6):
+        text = (out_txt_dir / f"report-{i}.txt").read_text()
+        assert "Invasive ductal carcinoma" in text
+
+
+def test_failed_job(pdf_dir: Path, tmp_path: Path, mock_textract, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(TextractBackend, "JOB_STATUS", "FAILED")
+    out_txt_dir = tmp_path / "txt"
+    assert process(pdf_dir, out_txt_dir, max_in_flight=2, requests_per_second=100) == 0
+    assert not list(out_txt_dir.glob("*.txt"))
+
+
+def test_polling_backs_off(monkeypatch: pytest.MonkeyPatch):
+    statuses = iter(["IN_PROGRESS", "IN_PROGRESS", "IN_PROGRESS", "SUCCEEDED"])
+    delays = []
+
+    class FakeTextract:
+        def get_document_text_detection(self, **kwargs):
+            return {"JobStatus": next(statuses)}
+
+    monkeypatch.setattr(ocr_textract.time, "sleep", delays.append)
+    assert ocr_textract.is_job_complete(
+        FakeTextract(), "job", initial_delay=1.0, max_delay=3.0, backoff=2.0  # type: ignore
+    )
+    assert len(delays) == 3
+    assert delays[0] < delays[1] and delays[2] <= 3.0 * 1.2
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(11):
+        rate_limiter.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def test_cache_skips_aws(pdf_dir: Path, tmp_path: Path, mock_textract, monkeypatch: pytest.MonkeyPatch):
+    cache = TextractCache(tmp_path / "cache")
+    out_txt_dir = tmp_path / "txt"
+    assert process(pdf_dir, out_txt_dir, requests_per_second=100, cache=cache) == 6
+    assert len(cache.index) == 6
+
+    def fail(*args, **kwargs):
+        raise AssertionError("AWS should not be called on a cache hit")
+
+    monkeypatch.setattr(ocr_textract, "upload_to_s3", fail)
+    monkeypatch.setattr(ocr_textract, "start_textract_job", fail)
+    (out_txt_dir / "report-0.txt").unlink()
+    assert process(pdf_dir, out_txt_dir, requests_per_second=100, cache=cache) == 6
+    assert "Invasive ductal carcinoma" in (out_txt_dir / "report-0.txt").read_text()
+
+    monkeypatch.setattr(
+        ocr_textract, "iter_text_from_blocks", lambda blocks: [str(len(list(blocks)))]
+    )
+    assert rederive_texts(out_txt_dir, cache) == 6
+    assert (out_txt_dir / "report-3.txt").read_text() == str(len(BLOCKS))
+
+
+def test_cache_eviction(tmp_path: Path):
+    cache = TextractCache(tmp_path / "cache", max_bytes=1)
+    cache.put("a" * 64, BLOCKS, "report-a")
+    assert "a" * 64 not in cache
+    assert cache.index == {}
+
+
+def test_streamed_pages():
+    responses = {
+        None: {
+            "JobStatus": "SUCCEEDED",
+            "NextToken": "t1",
+            "Blocks": [
+                {"BlockType": "PAGE", "Page": 1},
+                {"BlockType": "LINE", "Page": 1, "Text": "Page one"},
+            ],
+        },
+        "t1": {
+            "JobStatus": "SUCCEEDED",
+            "Blocks": [
+                {"BlockType": "PAGE", "Page": 2},
+                {"BlockType": "PAGE", "Page": 3},
+                {"BlockType": "LINE", "Page": 3, "Text": "Page three"},
+                {"BlockType": "WORD", "Page": 3, "Text": "three"},
+            ],
+        },
+    }
+    requested = []
+
+    class FakeTextract:
+        def get_document_text_detection(self, JobId, NextToken=None):
+            requested.append(NextToken)
+            return responses[NextToken]
+
+    blocks = iter_job_blocks(FakeTextract(), "job")  # type: ignore
+    chunks = iter_text_from_blocks(blocks)
+    assert next(chunks) == "Page one\n"
+    # The second response is only fetched once the first one is consumed
+    assert requested == [None]
+    assert "".join(chunks) == "\f\fPage three\n\f"
+    assert requested == [None, "t1"]
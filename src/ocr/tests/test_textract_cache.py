@@ -0,0 +1,48 @@
+import os
+from pathlib import Path
+
+from src.ocr.textract_cache import TextractCache
+
+BLOCKS = [
+    {"BlockType": "PAGE", "Page": 1},
+    {"BlockType": "LINE", "Page": 1, "Text": "Invasive ductal carcinoma"},
+]
+
+
+def test_corrupt_entry_is_dropped_and_missed(tmp_path: Path):
+    cache = TextractCache(tmp_path / "cache")
+    for digest in ("a" * 64, "b" * 64):
+        cache.put(digest, BLOCKS)
+    assert list(cache.get("a" * 64) or []) == BLOCKS
+
+    truncated = cache.path_for("a" * 64)
+    truncated.write_bytes(truncated.read_bytes()[:-8])
+    cache.path_for("b" * 64).write_bytes(b"not gzip")
+    size = cache._size
+
+    assert cache.get("a" * 64) is None
+    assert cache.get("b" * 64) is None
+    assert "a" * 64 not in cache
+    assert "b" * 64 not in cache
+    assert cache._size < size
+
+    cache.put("a" * 64, BLOCKS)
+    assert list(cache.get("a" * 64) or []) == BLOCKS
+
+
+def test_eviction_keeps_the_most_recently_read_entries(tmp_path: Path):
+    cache = TextractCache(tmp_path / "cache")
+    digests = ["a" * 64, "b" * 64, "c" * 64]
+    for age, digest in enumerate(digests):
+        cache.put(digest, BLOCKS)
+        # Spread the write times out so the order does not depend on clock resolution
+        mtime = 1_000_000 + age
+        os.utime(cache.path_for(digest), (mtime, mtime))
+    entry_size = cache.path_for("a" * 64).stat().st_size
+
+    assert cache.get("a" * 64) is not None
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+    assert "a" * 64 in cache
+    assert "b" * 64 not in cache
+    assert "c" * 64 in cache
@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from loguru import logger
+
+from src import config
+from src.utils import atomic_open
+
+CACHE_DIR = config.PROCESSED_DIR / "textract_cache"
+MAX_CACHE_BYTES = 2 * 1024**3
+INDEX_NAME = "index.json"
+
+
+class TextractCache:
+    """
+    Content-addressed store of raw Textract `Blocks`, keyed by the SHA-256 of the
+    submitted PDF. Each entry is a gzipped JSON Lines file with one block per
+    line. Entries are evicted least-recently-used first once the cache grows
+    past `max_bytes`.
+
+    The index maps report names to digests so text can be re-derived from the
+    cached blocks without calling AWS.
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index_path = self.cache_dir / INDEX_NAME
+        self._index: dict[str, str] = (
+            json.loads(self._index_path.read_text()) if self._index_path.exists() else {}
+        )
+        self._size = sum(p.stat().st_size for p in self._entry_paths())
+
+    def _entry_paths(self) -> list[Path]:
+        return list(self.cache_dir.glob("*/*.jsonl.gz"))
+
+    def path_for(self, digest: str) -> Path:
+        return self.cache_dir / digest[:2] / f"{digest}.jsonl.gz"
+
+    def __contains__(self, digest: str) -> bool:
+        return self.path_for(digest).exists()
+
+    @property
+    def index(self) -> dict[str, str]:
+        with self._lock:
+            return dict(self._index)
+
+    def get(self, digest: str) -> Iterator[dict] | None:
+        """
+        Return a lazy iterator over the cached blocks, or None on a miss. A truncated
+        or corrupt entry is deleted and counts as a miss.
+        """
+        path = self.path_for(digest)
+        try:
+            # Bump the modification time so eviction treats this entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        if not self._is_intact(path):
+            logger.warning(f"Dropping corrupt cache entry {path}")
+            self._discard(path)
+            return None
+        return self._read(path)
+
+    @staticmethod
+    def _is_intact(path: Path) -> bool:
+        # Decompressing to the end checks gzip's CRC and length trailer, so a bad
+        # entry is caught here instead of halfway through writing a report
+        try:
+            with gzip.open(path, "rb") as f:
+                while f.read(1 << 20):
+                    pass
+        except (OSError, EOFError):
+            return False
+        return True
+
+    def _discard(self, path: Path):
+        with self._lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                return
+            self._size -= size
+
+    @staticmethod
+    def _read(path: Path) -> Iterator[dict]:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def put(self, digest: str, blocks: Iterable[dict], report_name: str | None = None):
+        for _ in self.writing(digest, blocks, report_name):
+            pass
+
+    def writing(
+        self, digest: str, blocks: Iterable[dict], report_name: str | None = None
+    ) -> Iterator[dict]:
+        """
+        Pass `blocks` through while writing them to the cache. The entry is only
+        committed once the iterator is exhausted, so a failed or abandoned stream
+        never leaves a partial entry behind.
+        """
+        path = self.path_for(digest)
+        old_size = path.stat().st_size if path.exists() else 0
+        with atomic_open(path, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            for block in blocks:
+                f.write(json.dumps(block, separators=(",", ":")))
+                f.write("\n")
+                yield block
+        with self._lock:
+            self._size += path.stat().st_size - old_size
+        if report_name is not None:
+            self.record(report_name, digest)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def record(self, report_name: str, digest: str):
+        with self._lock:
+            if self._index.get(report_name) == digest:
+                return
+            self._index[report_name] = digest
+            self._save_index()
+
+    def _save_index(self):
+        with atomic_open(self._index_path, "w") as f:
+            json.dump(self._index, f, indent=2, sort_keys=True)
+
+    def evict(self):
+        with self._lock:
+            entries = sorted(self._entry_paths(), key=lambda p: p.stat().st_mtime)
+            self._size = sum(p.stat().st_size for p in entries)
+            evicted = set()
+            while entries and self._size > self.max_bytes:
+                path = entries.pop(0)
+                self._size -= path.stat().st_size
+                path.unlink(missing_ok=True)
+                evicted.add(path.name.removesuffix(".jsonl.gz"))
+            if evicted:
+                self._index = {
+                    name: digest
+                    for name, digest in self._index.items()
+                    if digest not in evicted
+                }
+                self._save_index()
+                logger.info(f"Evicted {len(evicted)} entries from {self.cache_dir}")